@@ -23,11 +23,13 @@ from tqdm import tqdm
 
 from models.build import build_models, freeze_backbone
 from setup import config, log
-from utils.data_loader import build_loader
+from utils.data_loader import build_loader, loader_sampler, pop_cache_stats, pop_image_errors, pop_transform_timings
+from utils.echo import EchoLoader
 from utils.eval import *
 from utils.info import *
 from utils.optimizer import build_optimizer
 from utils.scheduler import build_scheduler
+from utils.selective_backprop import build_selective_backprop
 
 
 def detect_inference_mode(config):
@@ -184,6 +186,7 @@ def main(config):
 		criterion = LabelSmoothingCrossEntropy(smoothing=config.model.label_smooth)
 	else:
 		criterion = torch.nn.CrossEntropyLoss()
+	selector = build_selective_backprop(config)
 
 	# Function Mode
 	if config.model.resume:
@@ -222,17 +225,27 @@ def main(config):
 	# 推理模式检测：统一使用detect_inference_mode()函数
 	is_inference_mode = detect_inference_mode(config)
 	
+	# 从step级检查点恢复时，恢复本rank的RNG与sampler位置，第一个epoch从中断处的下一个batch开始
+	if train_loader is not None:
+		load_resume_state(config, loader_sampler(train_loader))
 	for epoch in range(config.train.start_epoch, config.train.epochs):
 		train_timer.start()
-		if config.local_rank != -1 and train_loader is not None:
-			train_loader.sampler.set_epoch(epoch)
+		if train_loader is not None and hasattr(train_loader.dataset, 'set_epoch'):
+			train_loader.dataset.set_epoch(epoch)
+		elif train_loader is not None and hasattr(loader_sampler(train_loader), 'set_epoch'):
+			loader_sampler(train_loader).set_epoch(epoch)
+		if train_loader is not None and hasattr(train_loader.collate_fn, 'set_epoch'):
+			# worker端mixup按(epoch, batch序号)取随机数，恢复时从中断的batch继续
+			train_loader.collate_fn.set_epoch(epoch, config.train.start_step if epoch == config.train.start_epoch else 0)
 		# list1 = list(model.named_parameters())
 		# print(list1[76])
 
 		# 修复：推理模式下跳过训练，只执行验证
 		if not config.misc.eval_mode and not is_inference_mode and train_loader is not None:
+			start_step = config.train.start_step if epoch == config.train.start_epoch else 0
 			train_accuracy = train_one_epoch(config, model, criterion, train_loader, optimizer,
-			                                 epoch, scheduler, loss_scaler, mixup_fn, writer)
+			                                 epoch, scheduler, loss_scaler, mixup_fn, writer, start_step, best_acc,
+			                                 selector)
 		else:
 			# 推理模式或eval模式下设置默认训练准确率
 			train_accuracy = 0.0
@@ -256,6 +269,36 @@ def main(config):
 					                     f'{best_acc:2.3f}', best_epoch, f'{loss:1.5f}'], rank=config.local_rank)
 			pass  # Eval
 		eval_timer.stop()
+		if selector is not None:
+			seen, kept = selector.pop()
+			if seen and config.local_rank in [-1, 0]:
+				# 反向约为前向的2倍计算量，打分前向约为1倍：净节省 = 1 - (seen + 3 * kept) / (3 * seen)
+				saved, net = 1 - kept / seen, 1 - (seen + 3 * kept) / (3 * seen)
+				log.info(f'Epoch {epoch + 1:^3}/{config.train.epochs:^3}: 反向传播 {kept}/{seen} 个样本，'
+				         f'节省反向计算 {saved * 100:.1f}%（计入打分前向后约 {net * 100:.1f}%）')
+				if writer is not None:
+					writer.add_scalar('train/backward_saved', saved, epoch)
+		if isinstance(train_loader, EchoLoader) and config.local_rank in [-1, 0]:
+			batches, echoes = train_loader.pop()
+			if echoes:
+				log.info(f'Epoch {epoch + 1:^3}/{config.train.epochs:^3}: 数据回声 {batches} 个新batch，'
+				         f'{echoes} 个回声batch（factor {train_loader.factor}）')
+		image_errors = pop_image_errors(train_loader, test_loader)
+		if image_errors and config.local_rank in [-1, 0]:
+			log.info(f'Epoch {epoch + 1:^3}/{config.train.epochs:^3}: {image_errors} 次图像读取失败，已用占位图代替')
+		cache_stats = pop_cache_stats(train_loader, test_loader)
+		if cache_stats and config.local_rank in [-1, 0]:
+			hits, misses, nbytes = cache_stats
+			log.info(f'Epoch {epoch + 1:^3}/{config.train.epochs:^3}: 本地文件缓存命中 {hits} 次，未命中 {misses} 次'
+			         f'（命中率 {hits / max(hits + misses, 1) * 100:.1f}%），复制 {nbytes / 2 ** 30:.2f} GiB')
+		for split, loader in (('train', train_loader), ('test', test_loader)):
+			timings = pop_transform_timings(loader)
+			if timings and config.local_rank in [-1, 0]:
+				log.info(f'Epoch {epoch + 1:^3}/{config.train.epochs:^3}: {split} transforms (ms/img) ' +
+				         '  '.join(f'{stage} {ms:.2f}' for stage, ms in timings.items()))
+				if writer is not None:
+					for stage, ms in timings.items():
+						writer.add_scalar(f'transforms_{split}/{stage}', ms, epoch)
 		pass  # Train
 
 	# Finish Training
@@ -273,11 +316,12 @@ def main(config):
 
 
 def train_one_epoch(config, model, criterion, train_loader, optimizer, epoch, scheduler, loss_scaler, mixup_fn=None,
-                    writer=None):
+                    writer=None, start_step=0, best_acc=0., selector=None):
 	model.train()
 	optimizer.zero_grad()
 
-	step_per_epoch = len(train_loader)
+	# 从检查点恢复时sampler只产出本epoch剩余的样本
+	step_per_epoch = len(train_loader) + start_step
 	loss_meter = AverageMeter()
 	norm_meter = AverageMeter()
 	scaler_meter = AverageMeter()
@@ -288,16 +332,34 @@ def train_one_epoch(config, model, criterion, train_loader, optimizer, epoch, sc
 	loss3_meter = AverageMeter()
 
 	p_bar = tqdm(total=step_per_epoch,
+	             initial=start_step,
 	             desc=f'Train {epoch + 1:^3}/{epochs:^3}',
 	             dynamic_ncols=True,
 	             ascii=True,
 	             disable=config.local_rank not in [-1, 0])
 	all_preds, all_label = None, None
-	for step, (x, y) in enumerate(train_loader):
+	echo = isinstance(train_loader, EchoLoader)
+	for step, (x, y) in enumerate(train_loader, start=start_step):
+		# 数据回声时step为新batch的序号，progress以新batch计（回声batch为小数），学习率调度、进度条与检查点都按新batch计数
+		progress = step + 1
+		if echo:
+			step, progress = start_step + train_loader.step, start_step + train_loader.progress
 		global_step = epoch * step_per_epoch + step
 		x, y = x.cuda(non_blocking=True), y.cuda(non_blocking=True)
 		if mixup_fn:
 			x, y = mixup_fn(x, y)
+		# 选择性反向传播：eval模式下no_grad前向（不传标签，跳过Grad-CAM）给整个batch打分，只对高损失样本做训练前向与反向；
+		# eval模式使打分不受Dropout/DropPath/parts_drop的随机性影响，也不会用整个batch再更新一次BatchNorm统计量
+		score_logits, y_all = None, y
+		if selector is not None:
+			num_keep = selector.count(x.size(0), selector.ratio(epoch, step / step_per_epoch))
+			if num_keep < x.size(0):
+				model.eval()
+				with torch.no_grad(), torch.cuda.amp.autocast(enabled=config.misc.amp):
+					score_logits = model(x)
+				model.train()
+				keep = selector.select(score_logits, y, num_keep)
+				x, y = x[keep], y[keep]
 		with torch.cuda.amp.autocast(enabled=config.misc.amp):
 			if config.model.baseline_model:
 				logits = model(x)
@@ -310,12 +372,12 @@ def train_one_epoch(config, model, criterion, train_loader, optimizer, epoch, sc
 		                        parameters=model.parameters(), create_graph=is_second_order)
 
 		optimizer.zero_grad()
-		scheduler.step_update(global_step + 1)
+		scheduler.step_update(epoch * step_per_epoch + progress)
 		loss_scale_value = loss_scaler.state_dict()["scale"]
 
-		if mixup_fn is None:
-			preds = torch.argmax(logits, dim=-1)
-			all_preds, all_label = save_preds(preds, y, all_preds, all_label)
+		if y_all.dim() == 1:  # mixup/cutmix的软标签不统计训练精度
+			preds = torch.argmax(logits if score_logits is None else score_logits, dim=-1)
+			all_preds, all_label = save_preds(preds, y_all, all_preds, all_label)
 		torch.cuda.synchronize()
 
 		if grad_norm is not None:
@@ -329,6 +391,8 @@ def train_one_epoch(config, model, criterion, train_loader, optimizer, epoch, sc
 			writer.add_scalar("train/lr", lr, global_step)
 			writer.add_scalar("train/grad_norm", norm_meter.val, global_step)
 			writer.add_scalar("train/scaler_meter", scaler_meter.val, global_step)
+			if selector is not None:
+				writer.add_scalar("train/backprop_ratio", y.size(0) / y_all.size(0), global_step)
 			if other_loss:
 				try:
 					loss1_meter.update(other_loss[0].item(), y.size(0))
@@ -344,11 +408,17 @@ def train_one_epoch(config, model, criterion, train_loader, optimizer, epoch, sc
 
 		# set_postfix require dic input
 		p_bar.set_postfix(loss="%2.5f" % loss_meter.avg, lr="%.2e" % lr, gn="%1.4f" % norm_meter.avg)
+		if progress < step + 1:
+			continue
 		p_bar.update()
 
+		if config.write and config.train.resume_every > 0 and (step + 1) % config.train.resume_every == 0:
+			save_resume_checkpoint(config, epoch, step + 1, model, optimizer, scheduler, loss_scaler,
+			                       loader_sampler(train_loader), best_acc)
+
 	# After Training an Epoch
 	p_bar.close()
-	train_accuracy = eval_accuracy(all_preds, all_label, config) if mixup_fn is None else 0.0
+	train_accuracy = eval_accuracy(all_preds, all_label, config) if all_preds is not None else 0.0
 	return train_accuracy
 
 
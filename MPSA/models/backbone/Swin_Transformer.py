@@ -5,11 +5,13 @@
 # Written by Ze Liu
 # --------------------------------------------------------
 
+import collections
 import os
 import sys
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.utils.checkpoint as checkpoint
 from timm.models.layers import DropPath, to_2tuple, trunc_normal_
 
@@ -57,6 +59,20 @@ def window_partition(x, window_size):
 	return windows
 
 
+def resize_token_grid(tokens, src_size, dst_size, dim=1):
+	"""
+	Bicubically resample position parameters laid out as a flattened (H*W) grid along `dim`,
+	so that tables learned for one input resolution can be used with another (e.g. non-square) one.
+	"""
+	if tuple(src_size) == tuple(dst_size):
+		return tokens
+	x = tokens.movedim(dim, -1)
+	lead = x.shape[:-1]
+	x = x.reshape(1, -1, src_size[0], src_size[1])
+	x = F.interpolate(x, size=tuple(dst_size), mode='bicubic', align_corners=False)
+	return x.reshape(*lead, dst_size[0] * dst_size[1]).movedim(-1, dim)
+
+
 def window_reverse(windows, window_size, H, W):
 	"""
 	Args:
@@ -230,7 +246,27 @@ class SwinTransformerBlock(nn.Module):
 		if self.shift_size > 0:
 			# calculate attention mask for SW-MSA
 			H, W = self.input_resolution
-			img_mask = torch.zeros((1, H, W, 1))  # 1 H W 1
+			attn_mask = self.compute_mask(H, W, H, W)
+		else:
+			attn_mask = None
+
+		self.register_buffer("attn_mask", attn_mask)
+		self.fused_window_process = fused_window_process
+		# masks for non-default resolutions, keyed by (H, W, device, dtype); bounded LRU so that changing input
+		# sizes (e.g. aspect-ratio buckets) cannot grow it without limit
+		self._mask_cache = collections.OrderedDict()
+		self._mask_cache_size = 16
+
+	def compute_mask(self, H, W, Hp, Wp, device=None):
+		"""
+		Attention mask for an (H, W) feature map padded to (Hp, Wp): tokens only attend to tokens of the
+		same shifted region, and padded tokens get their own regions so real tokens never attend to them.
+		Returns None when no masking is needed.
+		"""
+		if self.shift_size == 0 and (Hp, Wp) == (H, W):
+			return None
+		img_mask = torch.zeros((1, Hp, Wp, 1), device=device)  # 1 Hp Wp 1
+		if self.shift_size > 0:
 			h_slices = (slice(0, -self.window_size),
 			            slice(-self.window_size, -self.shift_size),
 			            slice(-self.shift_size, None))
@@ -242,19 +278,21 @@ class SwinTransformerBlock(nn.Module):
 				for w in w_slices:
 					img_mask[:, h, w, :] = cnt
 					cnt += 1
-
-			mask_windows = window_partition(img_mask, self.window_size)  # nW, window_size, window_size, 1
-			mask_windows = mask_windows.view(-1, self.window_size * self.window_size)
-			attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
-			attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
-		else:
-			attn_mask = None
-
-		self.register_buffer("attn_mask", attn_mask)
-		self.fused_window_process = fused_window_process
-
-	def forward(self, x):
-		H, W = self.input_resolution
+		if (Hp, Wp) != (H, W):
+			pad_mask = torch.zeros((1, Hp, Wp, 1), device=device)
+			pad_mask[:, H:, :, :] = 1
+			pad_mask[:, :, W:, :] = 1
+			pad_mask = torch.roll(pad_mask, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
+			img_mask = img_mask + pad_mask * 9
+
+		mask_windows = window_partition(img_mask, self.window_size)  # nW, window_size, window_size, 1
+		mask_windows = mask_windows.view(-1, self.window_size * self.window_size)
+		attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
+		attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+		return attn_mask
+
+	def forward(self, x, resolution=None):
+		H, W = resolution or self.input_resolution
 		B, L, C = x.shape
 		# print(H,W,L,C)
 		assert L == H * W, "input feature has wrong size"
@@ -263,14 +301,34 @@ class SwinTransformerBlock(nn.Module):
 		x = self.norm1(x)
 		x = x.view(B, H, W, C)
 
+		# pad feature maps to multiples of the window size (non-square / other input resolutions)
+		pad_b = (self.window_size - H % self.window_size) % self.window_size
+		pad_r = (self.window_size - W % self.window_size) % self.window_size
+		if pad_b or pad_r:
+			x = F.pad(x, (0, 0, 0, pad_r, 0, pad_b))
+		Hp, Wp = H + pad_b, W + pad_r
+		if (H, W) == tuple(self.input_resolution) and not (pad_b or pad_r):
+			attn_mask = self.attn_mask
+		else:
+			key = (H, W, x.device, x.dtype)
+			if key in self._mask_cache:
+				self._mask_cache.move_to_end(key)
+			else:
+				mask = self.compute_mask(H, W, Hp, Wp, x.device)
+				self._mask_cache[key] = mask.to(x.dtype) if mask is not None else None
+				while len(self._mask_cache) > self._mask_cache_size:
+					self._mask_cache.popitem(last=False)
+			attn_mask = self._mask_cache[key]
+		fused = self.fused_window_process and (Hp, Wp) == tuple(self.input_resolution)
+
 		# cyclic shift
 		if self.shift_size > 0:
-			if not self.fused_window_process:
+			if not fused:
 				shifted_x = torch.roll(x, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
 				# partition windows
 				x_windows = window_partition(shifted_x, self.window_size)  # nW*B, window_size, window_size, C
 			else:
-				x_windows = WindowProcess.apply(x, B, H, W, C, -self.shift_size, self.window_size)
+				x_windows = WindowProcess.apply(x, B, Hp, Wp, C, -self.shift_size, self.window_size)
 		else:
 			shifted_x = x
 			# partition windows
@@ -279,21 +337,23 @@ class SwinTransformerBlock(nn.Module):
 		x_windows = x_windows.view(-1, self.window_size * self.window_size, C)  # nW*B, window_size*window_size, C
 
 		# W-MSA/SW-MSA
-		attn_windows = self.attn(x_windows, mask=self.attn_mask)  # nW*B, window_size*window_size, C
+		attn_windows = self.attn(x_windows, mask=attn_mask)  # nW*B, window_size*window_size, C
 
 		# merge windows
 		attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
 
 		# reverse cyclic shift
 		if self.shift_size > 0:
-			if not self.fused_window_process:
-				shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
+			if not fused:
+				shifted_x = window_reverse(attn_windows, self.window_size, Hp, Wp)  # B H' W' C
 				x = torch.roll(shifted_x, shifts=(self.shift_size, self.shift_size), dims=(1, 2))
 			else:
-				x = WindowProcessReverse.apply(attn_windows, B, H, W, C, self.shift_size, self.window_size)
+				x = WindowProcessReverse.apply(attn_windows, B, Hp, Wp, C, self.shift_size, self.window_size)
 		else:
-			shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
+			shifted_x = window_reverse(attn_windows, self.window_size, Hp, Wp)  # B H' W' C
 			x = shifted_x
+		if pad_b or pad_r:
+			x = x[:, :H, :W, :].contiguous()
 		x = x.view(B, H * W, C)
 		x = shortcut + self.drop_path(x)
 
@@ -337,17 +397,18 @@ class PatchMerging(nn.Module):
 		self.reduction = nn.Linear(4 * dim, 2 * dim, bias=False)
 		self.norm = norm_layer(4 * dim)
 
-	def forward(self, x):
+	def forward(self, x, resolution=None):
 		"""
 		x: B, H*W, C
 		"""
-		H, W = self.input_resolution
+		H, W = resolution or self.input_resolution
 		B, L, C = x.shape
 		# print(H,W,L,C)
 		assert L == H * W, "input feature has wrong size"
-		assert H % 2 == 0 and W % 2 == 0, f"x size ({H}*{W}) are not even."
 
 		x = x.view(B, H, W, C)
+		if H % 2 or W % 2:
+			x = F.pad(x, (0, 0, 0, W % 2, 0, H % 2))
 
 		x0 = x[:, 0::2, 0::2, :]  # B H/2 W/2 C
 		x1 = x[:, 1::2, 0::2, :]  # B H/2 W/2 C
@@ -422,16 +483,27 @@ class BasicLayer(nn.Module):
 		else:
 			self.downsample = None
 
-	def forward(self, x):
+	def forward(self, x, resolution=None):
+		"""
+		resolution: (H, W) of the input tokens, defaults to the resolution the layer was built for
+		"""
 		if self.downsample is not None:
-			x = self.downsample(x)
+			x = self.downsample(x, resolution)
+		resolution = self.output_resolution(resolution)
 		for blk in self.blocks:
 			if self.use_checkpoint:
-				x = checkpoint.checkpoint(blk, x)
+				x = checkpoint.checkpoint(blk, x, resolution)
 			else:
-				x = blk(x)
+				x = blk(x, resolution)
 		return x
 
+	def output_resolution(self, resolution=None):
+		if resolution is None:
+			return self.input_resolution
+		if self.downsample is not None:
+			return (resolution[0] + 1) // 2, (resolution[1] + 1) // 2
+		return tuple(resolution)
+
 	def extra_repr(self) -> str:
 		return f"dim={self.dim}, input_resolution={self.input_resolution}, depth={self.depth}"
 
@@ -476,9 +548,9 @@ class PatchEmbed(nn.Module):
 
 	def forward(self, x):
 		B, C, H, W = x.shape
-		# FIXME look at relaxing size constraints
-		assert H == self.img_size[0] and W == self.img_size[1], \
-			f"Input image size ({H}*{W}) doesn't match model ({self.img_size[0]}*{self.img_size[1]})."
+		# other (e.g. non-square) input sizes are allowed as long as they are divisible by the patch size
+		assert H % self.patch_size[0] == 0 and W % self.patch_size[1] == 0, \
+			f"Input image size ({H}*{W}) is not divisible by the patch size ({self.patch_size[0]}*{self.patch_size[1]})."
 		x = self.proj(x).flatten(2).transpose(1, 2)  # B Ph*Pw C
 		if self.norm is not None:
 			x = self.norm(x)
@@ -536,6 +608,7 @@ class SwinTransformer(nn.Module):
 		self.mlp_ratio = mlp_ratio
 		self.cross_layer = cross_layer
 		self.save_feature = None
+		self.feature_resolutions = None
 
 		# split image into non-overlapping patches
 		self.patch_embed = PatchEmbed(
@@ -609,13 +682,18 @@ class SwinTransformer(nn.Module):
 		return {'relative_position_bias_table'}
 
 	def forward_features(self, x):
+		resolution = (x.shape[2] // self.patch_embed.patch_size[0], x.shape[3] // self.patch_embed.patch_size[1])
 		x = self.patch_embed(x)
 		if self.ape:
-			x = x + self.absolute_pos_embed
+			x = x + resize_token_grid(self.absolute_pos_embed, self.patches_resolution, resolution)
 		x = self.pos_drop(x)
 		layer_x = []
+		# token grid (H, W) of each stage output, used by the heads to adapt their position parameters
+		self.feature_resolutions = []
 		for layer in self.layers:
-			x = layer(x)
+			x = layer(x, resolution)
+			resolution = layer.output_resolution(resolution)
+			self.feature_resolutions.append(resolution)
 			if self.cross_layer:
 				layer_x.append(x)
 
@@ -9,7 +9,7 @@ from timm.models.layers import DropPath
 from torch import nn
 from utils.eval import count_parameters
 
-from models.backbone.Swin_Transformer import swin_backbone, PatchMerging, Mlp,swin_backbone_tiny
+from models.backbone.Swin_Transformer import swin_backbone, PatchMerging, Mlp,swin_backbone_tiny, resize_token_grid
 from models.backbone.Vision_Transformer import vit_backbone
 
 
@@ -112,7 +112,8 @@ class MultiPartsSampling(nn.Module):
 
 	def forward(self, x, label=None):
 		x = self.backbone(x)
-		x, feature_weights = self.block(x)
+		# 非方形输入（长宽比分桶）时各stage的token网格尺寸，位置参数按此插值
+		x, feature_weights = self.block(x, getattr(self.backbone, 'feature_resolutions', None))
 		featmap = x
 		x = self.norm(x)
 		x = self.head_drop(x)
@@ -196,14 +197,15 @@ class MultiPartRetrospect(nn.Module):
 		return flops
 
 
-	def forward(self, x):
+	def forward(self, x, resolutions=None):
+		resolutions = resolutions or [None] * 4
 		if self.cross_layer:
 			out_list, feature_weights_list = [], []
 			for i in range(4):
 				x[i] = self.norm_list[i](x[i])
 			for i in range(4):
-				parts = self.parts_generation_list[i](x[i])
-				out, feature_weights = self.mpsa_list[i](x[-1], parts)
+				parts = self.parts_generation_list[i](x[i], resolutions[i])
+				out, feature_weights = self.mpsa_list[i](x[-1], parts, resolutions[-1])
 				out_list.append(out)
 				feature_weights_list.append(feature_weights)
 			out = torch.cat(out_list, dim=-1)
@@ -212,8 +214,8 @@ class MultiPartRetrospect(nn.Module):
 		else:
 			x = x[-1]
 			x = self.norm(x)
-			parts = self.parts_generation(x)
-			out, feature_weights = self.mpsa(x, parts)
+			parts = self.parts_generation(x, resolutions[-1])
+			out, feature_weights = self.mpsa(x, parts, resolutions[-1])
 			x = self.activation(out)
 		return x, feature_weights
 
@@ -237,6 +239,7 @@ class PartSamplingAttention(nn.Module):
 			torch.nn.init.kaiming_normal_(self.learnable_parts)
 		self.parts_attention = PartSE(self.num_parts - self.parts_drop)
 		self.scale = heads_dim ** -0.5
+		self.query_size = tuple(query_size)
 		self.atten_pos = nn.Parameter(torch.zeros((1, self.num_heads, query_size[0] * query_size[1],
 		                                           self.num_parts - self.parts_drop)))
 		self.softmax = nn.Softmax(dim=-1)
@@ -269,7 +272,7 @@ class PartSamplingAttention(nn.Module):
 		return flops
 
 
-	def forward(self, x, parts):
+	def forward(self, x, parts, resolution=None):
 		B, N, C = x.shape
 		self.num_tokens = N
 		if self.parts_base:
@@ -290,7 +293,10 @@ class PartSamplingAttention(nn.Module):
 
 		parts_attention = self.parts_attention(parts)
 		attention_weights = (q @ k.transpose(-2, -1).contiguous()) * self.scale
-		attention_weights = attention_weights + self.atten_pos
+		atten_pos = self.atten_pos
+		if resolution is not None:
+			atten_pos = resize_token_grid(atten_pos, self.query_size, resolution, dim=2)
+		attention_weights = attention_weights + atten_pos
 
 		# # Drop Key
 		# if self.training:
@@ -362,6 +368,7 @@ class PartSampling(nn.Module):
 		self.linear = nn.Linear(dim, num_parts)
 		self.dim = dim
 		self.num_parts = num_parts
+		self.input_size = tuple(input_size)
 		self.part_pos = nn.Parameter(torch.zeros((1, input_size[0] * input_size[1], num_parts)))
 		self.softmax = nn.Softmax(dim=-1)
 		self.activation = nn.GELU()
@@ -377,13 +384,16 @@ class PartSampling(nn.Module):
 		return flops
 
 
-	def forward(self, x):
+	def forward(self, x, resolution=None):
 		B,N,C = x.shape
 		self.num_tokens = N
 		parts = self.linear(x)
 		parts = self.activation(parts)
 		if self.pos:
-			parts = parts + self.part_pos
+			part_pos = self.part_pos
+			if resolution is not None:
+				part_pos = resize_token_grid(part_pos, self.input_size, resolution)
+			parts = parts + part_pos
 		sample_map = self.softmax(rearrange(parts, 'b hw cr -> b cr hw'))
 		x = sample_map @ x  # (B,C/r,C)
 
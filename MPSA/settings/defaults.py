@@ -20,6 +20,34 @@ _C.data.hue = 0.  # 0.4
 _C.data.rotate = 0
 _C.data.mixup = 0.  # 0.8
 _C.data.cutmix = 0.  # 1.0
+_C.data.mixup_collate = False  # mixup/cutmix在DataLoader worker的collate中完成（MixupCollate），训练主循环不再执行mixup
+_C.data.num_workers = 32  # 每个进程的DataLoader worker数
+_C.data.prefetch_factor = 4  # 每个worker预取的batch数
+_C.data.eval_workers = 'persistent'  # 验证集worker：persistent（常驻） / lazy（仅在验证时创建，结束后退出，常驻进程减半，每次验证多出启动worker的时间）
+_C.data.autotune = False  # 自动测试worker数与预取深度的组合，结果按主机与配置缓存在~/.cache/mpsa/autotune.json
+_C.data.profile_transforms = False  # 统计每个变换在worker中的耗时，每个epoch输出到日志与TensorBoard
+_C.data.store = 'raw'  # raw：原始图像文件；packed：tools/pack_dataset.py生成的预缩放内存映射文件；shards：tar分片顺序读取（仅训练集）
+_C.data.packed_root = ''  # 打包文件目录，为空时使用 <data_root>/<dataset>_packed_<resize>
+_C.data.shard_root = ''  # tar分片目录（tools/make_shards.py生成），为空时使用 <data_root>/<dataset>_shards
+_C.data.shuffle_buffer = 2000  # 每个worker的shuffle buffer大小
+_C.data.gpu_aug = False  # worker只输出uint8图像，翻转/颜色抖动/归一化在GPU上按batch执行；颜色抖动在裁剪之后（对比度用裁剪区域的均值）、顺序固定，与CPU流程不是严格相同的增强
+_C.data.cache_dir = ''  # 本地SSD缓存目录：非空时图像文件首次读取后复制到此处，之后从本地读取（仅store=raw）
+_C.data.cache_gb = 200.  # 本地缓存容量上限（GB），超出时按最近访问时间淘汰
+_C.data.cache_warmup = False  # 启动后台线程预先把训练/验证集文件复制到本地缓存（多卡时各rank分担）
+_C.data.echo_factor = 1  # 数据回声：每个新batch训练的次数，1表示关闭，0表示按等待数据/计算时间自动选择
+_C.data.echo_max = 4  # 自动选择回声次数时的上限
+_C.data.echo_shift = 16  # 回声batch随机平移裁剪的最大像素数
+_C.data.decoder = 'pil'  # 解码后端：pil / torchvision（decode_jpeg） / opencv / auto（启动时在数据集样本上测速选择）
+_C.data.eval_cache_gb = 0.  # 验证集变换结果缓存大小（GiB，本机所有rank合计），0表示关闭；放不下整个验证集时固定缓存各rank最先访问的样本
+_C.data.eval_cache_dir = ''  # 缓存文件目录，为空时使用/dev/shm
+_C.data.aspect_buckets = []  # 长宽比（宽/高）分桶，如[0.5, 0.75, 1.0, 1.333, 2.0]；非空时训练batch使用各桶的非方形裁剪，token数不超过img_size方形输入，验证仍为方形
+_C.data.fused_crop = False  # 训练/测试的Resize→裁剪合并为只重采样裁剪区域（FusedResizeCrop），实测与原流程最大差值为0且更快；训练集在padding/blur/rotate/autoaug或CPU颜色抖动开启时不融合
+_C.data.decode = 'full'  # 图像解码：full（原尺寸）/ draft（JPEG按DCT缩放解码到不小于resize的最小尺寸，tools/bench_decode.py可对比速度）
+_C.data.prune_index = ''  # tools/prune_scores.py写出的逐样本难度分数文件，非空时按类别剪枝训练集（WebFG/WebiNat；packed/shards须由记录了训练集划分digest的pack_dataset.py/make_shards.py生成）
+_C.data.prune_keep = 1.0  # 剪枝后每个类别保留的样本比例（保留最难的样本）
+_C.data.prune_skip = 0.  # 保留前先去掉每个类别中最难的这一比例样本（多为标签噪声）
+_C.data.quarantine = 'none'  # WebFG400/WebiNat5000训练集损坏图像预扫描：none（不扫描） / exclude（排除） / remap（在训练子集内替换为同类别完好样本）；划分后进行，验证集中的损坏样本总是排除
+_C.data.verify = 'fast'  # 数据集完整性校验：none / fast（文件存在） / full（解析图像头并检查JPEG截断）
 
 # -----------------------------------------------------------------------------
 # Model Settings
@@ -57,11 +85,13 @@ _C.parameters.cross_layer = False
 # -----------------------------------------------------------------------------
 _C.train = CN()
 _C.train.start_epoch = 0
+_C.train.start_step = 0  # 从step级检查点恢复时由load_checkpoint设置
 _C.train.epochs = 50
 _C.train.warmup_epochs = 0
 _C.train.weight_decay = 1e-08
 _C.train.clip_grad = None
 _C.train.checkpoint = False
+_C.train.resume_every = 0  # 每隔多少个step保存一次可恢复检查点（last.bin），0表示关闭
 _C.train.lr = 2e-02
 _C.train.scheduler = 'cosine'
 _C.train.optimizer = 'SGD'
@@ -69,6 +99,10 @@ _C.train.freeze_backbone = False
 _C.train.eps = 1e-8
 _C.train.betas = (0.9, 0.999)
 _C.train.momentum = 0.9
+_C.train.sb_keep = 1.0  # 选择性反向传播：先在eval模式下给整个batch打分，只对损失最大的这一比例样本做反向，1.0表示关闭
+_C.train.sb_schedule = 'constant'  # 保留比例调度：constant / linear / cosine（从1.0过渡到sb_keep）
+_C.train.sb_start_epoch = 0  # 此epoch之前全部样本都反向传播
+_C.train.sb_strategy = 'topk'  # topk：保留损失最大的样本；weighted：按损失加权采样，对噪声标签更稳健
 
 # -----------------------------------------------------------------------------
 # Misc Settings
@@ -6,7 +6,7 @@ import yaml
 
 from utils.eval import get_world_size
 from utils.info import *
-from settings.defaults import augment_parser
+from settings.defaults import augment_parser, _C
 
 
 def SetupConfig(config, cfg_file=None, args=None):
@@ -32,6 +32,18 @@ def SetupConfig(config, cfg_file=None, args=None):
 	return config
 
 
+def LoadConfig(cfg_file, opts=None):
+	"""供tools/下的独立脚本使用：只合并配置文件与命令行选项，不初始化设备与日志"""
+	config = _C.clone()
+	config.defrost()
+	if cfg_file:
+		config.merge_from_file(cfg_file)
+	if opts:
+		config.merge_from_list(opts)
+	config.freeze()
+	return config
+
+
 def SetupLogs(config, rank=0):
 	write = config.write
 	if rank not in [-1, 0]: return
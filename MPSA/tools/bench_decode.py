@@ -0,0 +1,81 @@
+"""对比 default_loader、draft 模式与其他解码后端的速度、解码后图像大小以及缩放后的像素差异
+
+用法（在MPSA目录下运行）：
+	python tools/bench_decode.py --cfg configs/swin-webinat5000.yaml --num 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings.setup_functions import LoadConfig
+from utils.data_loader import build_datasets, decode_size
+from utils.dataset import get_samples, build_image_loader
+from utils.decoders import available_backends
+
+
+def bench(loader, paths, size):
+	"""返回(每张耗时列表, 解码后的图像字节数列表, 缩放到(size, size)后的uint8数组列表)"""
+	times, sizes, resized = [], [], []
+	for path in paths:
+		tik = time.perf_counter()
+		img = loader(path)
+		times.append(time.perf_counter() - tik)
+		sizes.append(img.width * img.height * len(img.getbands()))
+		resized.append(np.asarray(img.resize((size, size), Image.BICUBIC), dtype=np.int16))
+	return times, sizes, resized
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark full vs draft-mode JPEG decoding and decoder backends')
+	parser.add_argument('--cfg', required=True, help='Path to the config file.')
+	parser.add_argument('--num', default=500, type=int, help='Number of randomly sampled images.')
+	parser.add_argument('--seed', default=0, type=int)
+	parser.add_argument('opts', nargs=argparse.REMAINDER, help='Extra config options, e.g. data.data_root /data')
+	args = parser.parse_args()
+
+	config = LoadConfig(args.cfg, args.opts + ['data.store', 'raw', 'data.decode', 'full'])
+	train_set, test_set, _ = build_datasets(config, None, None)
+	samples = get_samples(train_set if train_set is not None else test_set)
+	indices = random.Random(args.seed).sample(range(len(samples)), min(args.num, len(samples)))
+	paths = [samples[i][0] for i in indices]
+	size = decode_size(config)
+
+	# 先完整读取一遍，使两种方式都从页缓存读文件，只比较解码本身
+	for path in paths:
+		with open(path, 'rb') as f:
+			f.read()
+
+	results = {}
+	loaders = [('default_loader', build_image_loader('full')), ('draft', build_image_loader('draft', size))]
+	loaders += [(backend, build_image_loader('full', backend=backend)) for backend in available_backends()
+	            if backend != 'pil']
+	for name, loader in loaders:
+		results[name] = bench(loader, paths, size)
+		times, sizes, _ = results[name]
+		print(f'{name:>14}: {len(paths) / sum(times):7.1f} img/s, mean {np.mean(times) * 1000:6.2f} ms, '
+		      f'p99 {np.percentile(times, 99) * 1000:6.2f} ms, decoded mean {np.mean(sizes) / 2 ** 20:6.2f} MiB, '
+		      f'max {np.max(sizes) / 2 ** 20:6.2f} MiB')
+
+	full_times, full_sizes, full_resized = results['default_loader']
+	draft_times, draft_sizes, draft_resized = results['draft']
+	diff = [np.abs(a - b).mean() for a, b in zip(full_resized, draft_resized)]
+	print(f'draft: speedup {sum(full_times) / sum(draft_times):.2f}x, decoded bytes '
+	      f'{sum(full_sizes) / sum(draft_sizes):.2f}x smaller, '
+	      f'mean abs diff after resize to {size}: {np.mean(diff):.2f} (max {np.max(diff):.2f}) / 255')
+	for name, (times, _, resized) in results.items():
+		if name in ('default_loader', 'draft'):
+			continue
+		diff = [np.abs(a - b).mean() for a, b in zip(full_resized, resized)]
+		print(f'{name}: speedup {sum(full_times) / sum(times):.2f}x, '
+		      f'mean abs diff after resize to {size}: {np.mean(diff):.2f} (max {np.max(diff):.2f}) / 255')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,135 @@
+"""不加载模型，只迭代build_loader构建的数据管线，输出JSON格式的吞吐与各阶段耗时
+
+用法（在MPSA目录下运行）：
+	python tools/bench_pipeline.py --cfg configs/swin-webinat5000.yaml --batches 200 data.num_workers 16
+
+输出字段：
+	samples_per_sec / read_bytes_per_sec: 主进程实际拿到batch的速率与读取图像文件的速率
+	batch_latency_ms: 主进程等待每个batch的时间（p50/p99），接近0说明数据管线不是瓶颈
+	worker_ms_per_sample: worker内解码（含读文件）/变换/collate的平均耗时（CPU时间，跨worker累加）
+	rss_gb: 主进程与全部worker的峰值RSS
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings.setup_functions import LoadConfig
+from utils.autotune import process_rss, process_tree_rss
+from utils.data_loader import build_loader
+from utils.eval_cache import CachedEvalDataset
+from utils.profiling import StageTimer, TimedCall, TimedLoader
+from utils.samplers import BucketedDataset
+
+STAGES = ('decode', 'transform', 'collate')
+
+
+def instrument(loader, timer):
+	"""在worker启动前替换数据集的loader/transform与DataLoader的collate_fn"""
+	data_loader = loader
+	while not isinstance(data_loader, DataLoader):  # gpu_aug/数据回声模式下为DeviceLoader/EchoLoader
+		data_loader = data_loader.loader
+	dataset = data_loader.dataset
+	if isinstance(dataset, BucketedDataset):
+		# 长宽比分桶时每个样本使用所属桶的变换
+		dataset.transforms = [TimedCall(t, timer, 'transform') for t in dataset.transforms]
+		dataset = dataset.dataset
+	elif isinstance(dataset, CachedEvalDataset):
+		dataset = dataset.dataset
+	if hasattr(dataset, 'loader'):
+		dataset.loader = TimedLoader(dataset.loader, timer, 'decode')
+	if getattr(dataset, 'transform', None) is not None:
+		dataset.transform = TimedCall(dataset.transform, timer, 'transform')
+	data_loader.collate_fn = TimedCall(data_loader.collate_fn, timer, 'collate')
+	return data_loader
+
+
+def iterate(loader, batches):
+	"""循环迭代loader共batches个batch（不足一个epoch时重新开始），逐batch产出(等待时间, batch大小)"""
+	produced = 0
+	while produced < batches:
+		tik = time.perf_counter()
+		for x, _ in loader:
+			yield time.perf_counter() - tik, len(x)
+			produced += 1
+			if produced >= batches:
+				return
+			tik = time.perf_counter()
+		if produced == 0:
+			raise RuntimeError('The loader is empty')
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the input pipeline without a model')
+	parser.add_argument('--cfg', required=True, help='Path to the config file.')
+	parser.add_argument('--split', default='train', choices=['train', 'test'])
+	parser.add_argument('--batches', default=100, type=int, help='Number of measured batches.')
+	parser.add_argument('--warmup', default=10, type=int, help='Batches skipped while workers start up.')
+	parser.add_argument('--out', default='', help='Also write the JSON report to this file.')
+	parser.add_argument('opts', nargs=argparse.REMAINDER, help='Extra config options, e.g. data.num_workers 16')
+	args = parser.parse_args()
+
+	config = LoadConfig(args.cfg, args.opts)
+	train_loader, test_loader, *_ = build_loader(config)
+	loader = train_loader if args.split == 'train' else test_loader
+	if loader is None:
+		raise ValueError(f'No {args.split} loader in this configuration')
+	timer = StageTimer(STAGES)
+	data_loader = instrument(loader, timer)
+
+	latencies, samples, peak_main, peak_total = [], 0, 0, 0
+	tik = None
+	for step, (wait, batch_size) in enumerate(iterate(loader, args.warmup + args.batches)):
+		if step < args.warmup:
+			continue
+		if tik is None:
+			# 预热结束：清零worker计时，从本batch的等待开始计时
+			timer.pop()
+			tik = time.perf_counter() - wait
+		latencies.append(wait)
+		samples += batch_size
+		peak_main = max(peak_main, process_rss(os.getpid()))
+		peak_total = max(peak_total, process_tree_rss())
+	elapsed = time.perf_counter() - tik
+	stages = timer.pop()
+
+	worker_seconds = sum(seconds for seconds, _, _ in stages.values())
+	has_decode = stages['decode'][1] > 0
+	report = {
+		'config': args.cfg,
+		'dataset': config.data.dataset,
+		'store': config.data.store,
+		'split': args.split,
+		'batch_size': config.data.batch_size,
+		'num_workers': data_loader.num_workers,
+		'prefetch_factor': data_loader.prefetch_factor,
+		'batches': len(latencies),
+		'samples': samples,
+		'seconds': round(elapsed, 3),
+		'samples_per_sec': round(samples / elapsed, 1),
+		'read_bytes_per_sec': round(stages['decode'][2] / elapsed) if has_decode else None,
+		'batch_latency_ms': {'mean': round(float(np.mean(latencies)) * 1000, 2),
+		                     'p50': round(float(np.percentile(latencies, 50)) * 1000, 2),
+		                     'p99': round(float(np.percentile(latencies, 99)) * 1000, 2)},
+		'worker_ms_per_sample': {stage: round(seconds / samples * 1000, 3) if count else None
+		                         for stage, (seconds, count, _) in stages.items()},
+		'worker_time_share': {stage: round(seconds / worker_seconds, 3) if worker_seconds else None
+		                      for stage, (seconds, _, _) in stages.items()},
+		'rss_gb': {'main': round(peak_main / 2 ** 30, 2),
+		           'workers': round(max(peak_total - peak_main, 0) / 2 ** 30, 2)},
+	}
+	text = json.dumps(report, indent=1)
+	print(text)
+	if args.out:
+		with open(args.out, 'w') as f:
+			f.write(text)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,45 @@
+"""将训练集（已去除验证集部分）转换为约1GB的tar分片，供 data.store: shards 顺序读取
+
+训练时每个分片每个epoch只由一个(rank, worker)读取，分片数须不少于 world_size * data.num_workers；
+按约1GB切分得到的分片数不够时，会相应减少每个分片的样本数。
+
+用法（在MPSA目录下运行）：
+	python tools/make_shards.py --cfg configs/swin-webinat5000.yaml --world-size 4
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings.setup_functions import LoadConfig
+from utils.data_loader import build_datasets, shard_root
+from utils.dataset import get_samples
+from utils.shards import write_shards
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Convert the training split into sequentially readable tar shards')
+	parser.add_argument('--cfg', required=True, help='Path to the config file.')
+	parser.add_argument('--out', default='', help='Output directory, defaults to data.shard_root.')
+	parser.add_argument('--shard-size', default=1024, type=int, help='Approximate shard size in MiB.')
+	parser.add_argument('--world-size', default=1, type=int, help='Number of training processes.')
+	parser.add_argument('--slots', default=0, type=int,
+	                    help='Minimum number of shards, defaults to world size * data.num_workers.')
+	parser.add_argument('opts', nargs=argparse.REMAINDER, help='Extra config options, e.g. data.data_root /data')
+	args = parser.parse_args()
+
+	config = LoadConfig(args.cfg, args.opts + ['data.store', 'raw', 'misc.inference_mode', 'False',
+	                                           'misc.eval_mode', 'False', 'data.prune_index', ''])
+	train_set, _, num_classes = build_datasets(config, None, None)
+	slots = args.slots or args.world_size * config.data.num_workers
+	samples = get_samples(train_set)
+	# 分片中的key为样本在该训练集划分中的序号，训练时按digest确认data.prune_index的分数与之对应
+	meta = {'dataset': config.data.dataset, 'num_classes': num_classes,
+	        'digest': samples.digest() if hasattr(samples, 'digest') else None}
+	write_shards(samples, args.out or shard_root(config), args.shard_size << 20, config.misc.seed, meta,
+	             min_shards=slots)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,44 @@
+"""将数据集预缩放到config.data.resize并打包为内存映射文件
+
+用法（在MPSA目录下运行）：
+	python tools/pack_dataset.py --cfg configs/swin-webinat5000.yaml --workers 32
+训练时在配置中设置 data.store: packed 即可使用打包数据。
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings.setup_functions import LoadConfig
+from utils.data_loader import build_datasets, detect_inference_mode, packed_root
+from utils.dataset import get_samples, build_image_loader
+from utils.packed import pack_dataset
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Pack pre-resized images into a memory-mapped store')
+	parser.add_argument('--cfg', required=True, help='Path to the config file.')
+	parser.add_argument('--out', default='', help='Output directory, defaults to data.packed_root.')
+	parser.add_argument('--workers', default=16, type=int, help='Number of decoding workers.')
+	parser.add_argument('opts', nargs=argparse.REMAINDER, help='Extra config options, e.g. data.data_root /data')
+	args = parser.parse_args()
+
+	config = LoadConfig(args.cfg, args.opts + ['data.store', 'raw', 'data.prune_index', ''])
+	out = args.out or packed_root(config)
+	# 以不带变换的方式构建数据集，保持与训练时完全相同的样本顺序和训练/验证划分
+	train_set, test_set, num_classes = build_datasets(config, None, None)
+	meta = {'dataset': config.data.dataset, 'num_classes': num_classes,
+	        'val_split': getattr(config.data, 'val_split', 0.2), 'inference': detect_inference_mode(config)}
+	loader = build_image_loader(config.data.decode, config.data.resize)
+	for name, dataset in (('train', train_set), ('test', test_set)):
+		if dataset is None:
+			continue
+		# 记录样本表的digest，训练时据此确认data.prune_index的分数与打包的训练集对应
+		samples = get_samples(dataset)
+		pack_dataset(samples, os.path.join(out, name), config.data.resize, args.workers,
+		             dict(meta, digest=samples.digest() if hasattr(samples, 'digest') else None), loader)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,177 @@
+"""在训练集划分上计算逐样本难度分数，写出供 data.prune_index 加载的剪枝索引
+
+分数来自已有检查点（--checkpoint）或从预训练权重开始的短暂预热训练（--epochs），两者可同时使用。指标：
+	el2n: 误差向量的L2范数 ||softmax(logits) - onehot(y)||，训练早期即可区分难易样本（Paul et al., 2021）
+	margin: 其他类别最大logit减真实类别logit（即负的分类间隔）
+	forgetting: 预热训练中样本由分类正确变为错误的次数，从未学会的样本记为epochs（Toneva et al., 2019），需要--epochs
+分数都是越大越难；训练时按 data.prune_keep 在每个类别内保留最难的样本，data.prune_skip 可先去掉最难的一小部分（多为标签噪声）。
+el2n/margin在预热结束后用测试变换对训练集做一次前向得到；单进程运行。
+
+用法（在MPSA目录下运行）：
+	python tools/prune_scores.py --cfg configs/swin-webinat5000.yaml --metric el2n --epochs 2
+	python tools/prune_scores.py --cfg configs/swin-webinat5000.yaml --metric margin --checkpoint output/.../checkpoint.bin
+之后训练时加上 data.prune_index <输出文件> data.prune_keep 0.7
+"""
+import argparse
+import copy
+import os
+import sys
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.build import build_models, freeze_backbone
+from settings.setup_functions import LoadConfig
+from utils.data_loader import build_datasets, build_transforms
+from utils.manifest import cache_path_for, save_arrays
+from utils.optimizer import build_optimizer
+from utils.scheduler import build_scheduler
+
+METRICS = ('el2n', 'margin', 'forgetting')
+
+
+def output_logits(output):
+	"""MPSA模型训练时返回(logits, loss)，其余情况直接返回logits"""
+	return output[0] if isinstance(output, (list, tuple)) else output
+
+
+def difficulty(logits, targets):
+	"""逐样本的(EL2N, 负分类间隔)"""
+	logits = logits.float()
+	el2n = (logits.softmax(-1) - F.one_hot(targets, logits.size(-1))).norm(dim=-1)
+	true = logits.gather(1, targets[:, None]).squeeze(1)
+	other = logits.scatter(1, targets[:, None], float('-inf')).max(1).values
+	return el2n, other - true
+
+
+def train_epoch(config, model, loader, order, optimizer, scheduler, scaler, epoch, forgetting, device):
+	"""按order的顺序训练一个epoch，用训练前向的预测更新forgetting = [上次是否正确, 是否学会过, 遗忘次数]"""
+	model.train()
+	criterion = torch.nn.CrossEntropyLoss()
+	previous, learned, forgets = forgetting
+	batch_size = loader.batch_size
+	for step, (x, y) in enumerate(tqdm(loader, desc=f'Warmup {epoch + 1}', dynamic_ncols=True, ascii=True)):
+		indices = order[step * batch_size:(step + 1) * batch_size]
+		x, y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
+		with torch.autocast(device.type, enabled=config.misc.amp and device.type == 'cuda'):
+			output = model(x) if config.model.baseline_model else model(x, y)
+		logits = output_logits(output)
+		if isinstance(output, (list, tuple)):
+			loss = output[1][0] if isinstance(output[1], (list, tuple)) else output[1]
+		else:
+			loss = criterion(logits.float(), y)
+		optimizer.zero_grad()
+		scaler.scale(loss).backward()
+		if config.train.clip_grad:
+			scaler.unscale_(optimizer)
+			torch.nn.utils.clip_grad_norm_(model.parameters(), config.train.clip_grad)
+		scaler.step(optimizer)
+		scaler.update()
+		scheduler.step_update(epoch * len(loader) + step + 1)
+
+		correct = (logits.argmax(-1) == y).cpu().numpy()
+		forgets[indices] += previous[indices] & ~correct
+		learned[indices] |= correct
+		previous[indices] = correct
+
+
+@torch.no_grad()
+def score(config, model, loader, device):
+	"""按数据集顺序返回每个样本的(EL2N, 负分类间隔)"""
+	model.eval()
+	el2n, margin = [], []
+	for x, y in tqdm(loader, desc='Score', dynamic_ncols=True, ascii=True):
+		x, y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
+		with torch.autocast(device.type, enabled=config.misc.amp and device.type == 'cuda'):
+			logits = output_logits(model(x))
+		batch_el2n, batch_margin = difficulty(logits, y)
+		el2n.append(batch_el2n.cpu().numpy())
+		margin.append(batch_margin.cpu().numpy())
+	return np.concatenate(el2n), np.concatenate(margin)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Score training samples by difficulty and write a pruning index')
+	parser.add_argument('--cfg', required=True, help='Path to the config file.')
+	parser.add_argument('--metric', default='el2n', choices=METRICS)
+	parser.add_argument('--checkpoint', default='', help='Score with (or warm up from) this checkpoint.')
+	parser.add_argument('--epochs', default=0, type=int, help='Warm-up epochs trained before scoring.')
+	parser.add_argument('--out', default='', help='Output file, defaults to a file next to the data directory.')
+	parser.add_argument('opts', nargs=argparse.REMAINDER, help='Extra config options, e.g. data.batch_size 64')
+	args = parser.parse_args()
+	if args.metric == 'forgetting' and args.epochs <= 0:
+		parser.error('--metric forgetting counts events during warm-up training and needs --epochs')
+	if not args.checkpoint and args.epochs <= 0:
+		parser.error('Either --checkpoint or --epochs is required')
+
+	# 分数必须对应完整（未剪枝）的训练集划分；预热训练使用CPU端的完整增强
+	config = LoadConfig(args.cfg, args.opts + ['data.store', 'raw', 'misc.inference_mode', 'False',
+	                                           'misc.eval_mode', 'False', 'data.prune_index', '',
+	                                           'data.gpu_aug', 'False', 'data.cache_warmup', 'False'])
+	config.defrost()
+	config.train.epochs = max(args.epochs, 1)
+	config.train.warmup_epochs = min(config.train.warmup_epochs, args.epochs / 2)
+	config.freeze()
+	torch.manual_seed(config.misc.seed)
+
+	train_transform, test_transform = build_transforms(config)
+	train_set, _, num_classes = build_datasets(config, train_transform, test_transform)
+	if not hasattr(train_set, 'prune'):
+		parser.error(f'{config.data.dataset} does not support data.prune_index')
+	score_set = copy.copy(train_set)
+	score_set.transform = test_transform
+	score_set.transforms = copy.copy(train_set.transforms)
+	score_set.transforms.transform = test_transform
+
+	device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+	model = build_models(config, num_classes)
+	if args.checkpoint:
+		checkpoint = torch.load(args.checkpoint, map_location='cpu', weights_only=False)
+		state_dicts = {k.replace('module.', '').replace('_orig_mod.', ''): v for k, v in checkpoint['model'].items()}
+		print(model.load_state_dict(state_dicts, strict=True))
+		del checkpoint
+	model.to(device)
+	freeze_backbone(model, config.train.freeze_backbone)
+
+	num_samples = len(train_set)
+	forgetting = [np.zeros(num_samples, dtype=bool), np.zeros(num_samples, dtype=bool),
+	              np.zeros(num_samples, dtype=np.int64)]
+	if args.epochs > 0:
+		steps = num_samples // config.data.batch_size
+		optimizer = build_optimizer(config, model)
+		scheduler = build_scheduler(config, optimizer, steps)
+		scaler = torch.cuda.amp.GradScaler(enabled=config.misc.amp and device.type == 'cuda')
+		generator = torch.Generator()
+		for epoch in range(args.epochs):
+			generator.manual_seed(config.misc.seed + epoch)
+			order = torch.randperm(num_samples, generator=generator).numpy()
+			loader = DataLoader(train_set, sampler=order.tolist(), batch_size=config.data.batch_size,
+			                    num_workers=config.data.num_workers, drop_last=True, pin_memory=True)
+			train_epoch(config, model, loader, order, optimizer, scheduler, scaler, epoch, forgetting, device)
+
+	if args.metric == 'forgetting':
+		previous, learned, forgets = forgetting
+		scores = np.where(learned, forgets, args.epochs).astype(np.float32)
+	else:
+		loader = DataLoader(score_set, batch_size=config.data.batch_size, shuffle=False,
+		                    num_workers=config.data.num_workers, pin_memory=True)
+		el2n, margin = score(config, model, loader, device)
+		scores = (el2n if args.metric == 'el2n' else margin).astype(np.float32)
+
+	digest = train_set.samples.digest()
+	out = args.out or cache_path_for(train_set.data_dir, f'prune_{args.metric}_{digest[:12]}')
+	save_arrays(out, {'scores': scores}, {'digest': digest, 'metric': args.metric, 'epochs': args.epochs,
+	                                      'checkpoint': args.checkpoint, 'dataset': config.data.dataset})
+	quantiles = np.percentile(scores, [10, 50, 90])
+	print(f'{num_samples} 个样本的{args.metric}分数 P10/P50/P90 = {quantiles[0]:.4f} / {quantiles[1]:.4f} / '
+	      f'{quantiles[2]:.4f}，已写入 {out}')
+	print(f'训练时使用: data.prune_index {out} data.prune_keep 0.7')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import socket
+import time
+
+from torch.utils.data import DataLoader, IterableDataset
+
+AUTOTUNE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'mpsa', 'autotune.json')
+
+
+def available_cpus():
+	try:
+		return len(os.sched_getaffinity(0))
+	except AttributeError:
+		return os.cpu_count() or 1
+
+
+def _children(pid):
+	try:
+		with open(f'/proc/{pid}/task/{pid}/children', 'r') as f:
+			return [int(child) for child in f.read().split()]
+	except OSError:
+		return []
+
+
+def process_rss(pid):
+	try:
+		with open(f'/proc/{pid}/status', 'r') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return 0
+
+
+def process_tree_rss(pid=None):
+	"""当前进程及其所有子进程（DataLoader worker）的RSS之和，单位字节；非Linux下返回0"""
+	pid = pid or os.getpid()
+	pending, total = [pid], 0
+	while pending:
+		pid = pending.pop()
+		total += process_rss(pid)
+		pending += _children(pid)
+	return total
+
+
+def worker_candidates(local_world_size=1, max_workers=None):
+	"""按每个进程可用的CPU核数给出worker候选值，max_workers为数据集允许的上限（如tar分片数）"""
+	per_rank = max(available_cpus() // max(local_world_size, 1), 1)
+	if max_workers is not None:
+		per_rank = min(per_rank, max_workers)
+	return sorted({max(per_rank * k // 8, 1) for k in (1, 2, 4, 6, 8)})
+
+
+def benchmark_loader(dataset, batch_size, num_workers, prefetch_factor, batches=20, warmup=3, rounds=3):
+	"""用真实的数据集与变换测量稳态吞吐，返回(samples/s, 峰值RSS字节)
+
+	启动时各worker会预取 num_workers * prefetch_factor 个batch，这些batch在计时之前就已经做好：
+	预热阶段至少取完这一轮预取，计时阶段至少取rounds轮（与batches取大者），测到的是worker持续产出的速度。
+	"""
+	in_flight = max(num_workers, 1) * (prefetch_factor if num_workers > 0 else 1)
+	warmup, batches = max(warmup, in_flight), max(batches, rounds * in_flight)
+	loader = DataLoader(dataset, batch_size=batch_size, shuffle=not isinstance(dataset, IterableDataset),
+	                    num_workers=num_workers, drop_last=True,
+	                    prefetch_factor=prefetch_factor if num_workers > 0 else None)
+	iterator = iter(loader)
+	peak_rss, count, tik = 0, 0, None
+	try:
+		for step in range(warmup + batches):
+			if step == warmup:
+				# 预热阶段包含worker启动与首轮预取，不计入吞吐
+				tik = time.perf_counter()
+			x, _ = next(iterator)
+			if step >= warmup:
+				count += len(x)
+			peak_rss = max(peak_rss, process_tree_rss())
+	except StopIteration:
+		pass
+	elapsed = time.perf_counter() - tik if tik is not None else 0.
+	del iterator
+	return (count / elapsed if elapsed > 0 else 0.), peak_rss
+
+
+def autotune_key(config, world_size):
+	"""同一主机上，影响数据管线开销的配置相同即复用调优结果"""
+	data = config.data
+	items = [data.dataset, data.store, data.decode, data.gpu_aug, data.batch_size, data.img_size, data.resize,
+	         data.no_crop, data.fused_crop, data.autoaug, data.blur, data.color, data.rotate, world_size, available_cpus()]
+	return f'{socket.gethostname()}|' + hashlib.md5(json.dumps(items).encode('utf-8')).hexdigest()
+
+
+def load_autotune(key, cache_file=AUTOTUNE_FILE):
+	try:
+		with open(cache_file, 'r') as f:
+			return json.load(f).get(key)
+	except (OSError, ValueError):
+		return None
+
+
+def save_autotune(key, result, cache_file=AUTOTUNE_FILE):
+	os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+	try:
+		with open(cache_file, 'r') as f:
+			records = json.load(f)
+	except (OSError, ValueError):
+		records = {}
+	records[key] = result
+	with open(f'{cache_file}.tmp{os.getpid()}', 'w') as f:
+		json.dump(records, f, indent=1)
+	os.replace(f'{cache_file}.tmp{os.getpid()}', cache_file)
+
+
+def autotune_loader(dataset, batch_size, local_world_size=1, prefetch_factors=(2, 4, 8), batches=20,
+                    tolerance=0.05, max_workers=None):
+	"""先在prefetch_factor=4下扫描worker数，再在最佳worker数下扫描prefetch_factor
+
+	吞吐在最佳值tolerance以内的设置中选RSS最小的一个，避免为几个百分点的吞吐占用大量内存。
+	Returns:
+		dict(num_workers, prefetch_factor, samples_per_sec, rss_gb, trials)
+	"""
+	trials = []
+
+	def _run(num_workers, prefetch_factor):
+		speed, rss = benchmark_loader(dataset, batch_size, num_workers, prefetch_factor, batches)
+		trials.append({'num_workers': num_workers, 'prefetch_factor': prefetch_factor,
+		               'samples_per_sec': round(speed, 1), 'rss_gb': round(rss / 2 ** 30, 2)})
+		print(f'[Autotune] workers={num_workers:<3} prefetch={prefetch_factor:<2} '
+		      f'{speed:8.1f} samples/s  RSS {rss / 2 ** 30:6.2f} GiB')
+
+	for num_workers in worker_candidates(local_world_size, max_workers):
+		_run(num_workers, 4)
+	best_workers = max(trials, key=lambda t: t['samples_per_sec'])['num_workers']
+	for prefetch_factor in prefetch_factors:
+		if prefetch_factor != 4:
+			_run(best_workers, prefetch_factor)
+
+	best_speed = max(t['samples_per_sec'] for t in trials)
+	candidates = [t for t in trials if t['samples_per_sec'] >= best_speed * (1 - tolerance)]
+	choice = min(candidates, key=lambda t: (t['rss_gb'], -t['samples_per_sec']))
+	return dict(choice, trials=trials)
@@ -1,61 +1,178 @@
 # import ml_collections
+import datetime
+import random
 import sys
+import torch.distributed as dist
 from timm.data import Mixup
-from torch.utils.data import DataLoader, RandomSampler, DistributedSampler, SequentialSampler
+from torch.utils.data import DataLoader, IterableDataset, DistributedSampler, SequentialSampler
 from torchvision import transforms
 from torchvision.transforms import InterpolationMode
 from settings.setup_functions import get_world_size
 from utils.dataset import *
+from utils.autotune import autotune_key, autotune_loader, load_autotune, save_autotune
+from utils.decoders import select_decoder
+from utils.eval_cache import CachedEvalDataset, split_transform
+from utils.echo import EchoLoader
+from utils.file_cache import CachedLoader, FileCache
+from utils.fused_crop import FusedResizeCrop
+from utils.mixup import MixupCollate
+from utils.gpu_aug import BatchAugment, DeviceLoader, ToUint8Tensor
+from utils.profiling import InstrumentedCompose, pop_timings
+from utils.samplers import AspectRatioBatchSampler, BucketedDataset, ResumableSampler, aspect_bucket_shapes, \
+	assign_buckets
+from utils.packed import PackedImageDataset
+from utils.shards import SHARD_INDEX, ShardedImageDataset
 
 
-def build_transforms(config):
-	resize = int(config.data.img_size / 0.75)
+def build_transforms(config, size=None):
+	"""size: 裁剪尺寸(高, 宽)，默认为方形img_size；缩放尺寸按resize / img_size的比例随之变化（长宽比分桶时使用）"""
+	size = tuple(size) if size else (config.data.img_size, config.data.img_size)
+	resize = tuple(int(round(s * config.data.resize / config.data.img_size)) for s in size)
 	normalized_info = normalized()
+	# gpu_aug模式下翻转与颜色抖动移到BatchAugment中按batch执行
+	flip = [] if config.data.gpu_aug else [transforms.RandomHorizontalFlip()]
 	if config.data.no_crop:
-		train_base = [transforms.Resize(config.data.img_size, InterpolationMode.BICUBIC),
-		              transforms.RandomHorizontalFlip()]
+		train_base = [transforms.Resize(config.data.img_size, InterpolationMode.BICUBIC), *flip]
 		test_base = [transforms.Resize(config.data.img_size, InterpolationMode.BICUBIC),
 		             transforms.CenterCrop(config.data.img_size)]
+	elif config.data.store == 'packed':
+		# 打包数据已预先缩放到(resize, resize)，省去Resize
+		train_base = [*flip]
+		test_base = [transforms.CenterCrop(config.data.img_size)]
 	else:
-		train_base = [transforms.Resize((config.data.resize, config.data.resize), InterpolationMode.BICUBIC),
-		              transforms.RandomHorizontalFlip()]
-		test_base = [transforms.Resize((config.data.resize, config.data.resize), InterpolationMode.BICUBIC),
-		             transforms.CenterCrop(config.data.img_size)]
-	to_tensor = [transforms.ToTensor(),
-	             transforms.Normalize(normalized_info['standard'][:3],
-	                                  normalized_info['standard'][3:])]
+		train_base = [transforms.Resize(resize, InterpolationMode.BICUBIC), *flip]
+		test_base = [transforms.Resize(resize, InterpolationMode.BICUBIC), transforms.CenterCrop(size)]
+	# 融合裁剪只重采样最终保留的区域；训练集须在裁剪之前没有其他变换才能把裁剪提前，
+	# ColorJitter的对比度按整幅图像的灰度均值混合，裁剪后均值不同，因此CPU颜色抖动开启时训练集不融合
+	fused = config.data.fused_crop and not config.data.no_crop and config.data.store != 'packed'
+	fused_train = fused and config.data.padding == 0 and config.data.blur <= 0 and config.data.rotate <= 0 \
+	              and not config.data.autoaug and (config.data.color <= 0 or config.data.gpu_aug)
+	if fused:
+		test_base = [FusedResizeCrop(resize, size, train=False, flip=False)]
+	if fused_train:
+		train_base = [FusedResizeCrop(resize, size, train=True, flip=bool(flip))]
+	if config.data.gpu_aug:
+		to_tensor = [ToUint8Tensor()]
+	else:
+		to_tensor = [transforms.ToTensor(),
+		             transforms.Normalize(normalized_info['standard'][:3],
+		                                  normalized_info['standard'][3:])]
 
 	if config.data.blur > 0:
 		train_base += [
 			transforms.RandomApply([transforms.GaussianBlur(kernel_size=(5, 5), sigma=(0.1, 5))], p=config.data.blur),
 			transforms.RandomAdjustSharpness(sharpness_factor=1.5, p=config.data.blur)]
-	if config.data.color > 0:
+	if config.data.color > 0 and not config.data.gpu_aug:
 		train_base += [transforms.ColorJitter(config.data.color, config.data.color, config.data.color, config.data.hue)]
 	if config.data.rotate > 0:
 		train_base += [transforms.RandomRotation(config.data.rotate, InterpolationMode.BICUBIC)]
 	if config.data.autoaug:
 		train_base += [transforms.AutoAugment(interpolation=InterpolationMode.BICUBIC)]
-	train_base += [transforms.RandomCrop(config.data.img_size, padding=config.data.padding)]
+	if not fused_train:
+		train_base += [transforms.RandomCrop(size, padding=config.data.padding)]
 
-	train_transform = transforms.Compose([*train_base, *to_tensor])
-	test_transform = transforms.Compose([*test_base, *to_tensor])
+	# 开启profile_transforms时逐个变换计时，关闭时仍为普通Compose，没有额外开销
+	compose = InstrumentedCompose if config.data.profile_transforms else transforms.Compose
+	train_transform = compose([*train_base, *to_tensor])
+	test_transform = compose([*test_base, *to_tensor])
 	return train_transform, test_transform
 
 
-def build_loader(config):
-	train_transform, test_transform = build_transforms(config)
-	
+def build_batch_augment(config):
+	"""与build_transforms中移出worker的部分对应的batch级增强"""
+	normalized_info = normalized()
+	color = config.data.color
+	return BatchAugment(normalized_info['standard'][:3], normalized_info['standard'][3:], flip=True,
+	                    brightness=color, contrast=color, saturation=color,
+	                    hue=config.data.hue if color > 0 else 0.)
+
+
+def decode_size(config):
+	"""draft解码的目标尺寸：与训练/测试变换中第一次Resize的输出尺寸一致"""
+	return config.data.img_size if config.data.no_crop else config.data.resize
+
+
+def packed_root(config):
+	if config.data.packed_root:
+		return config.data.packed_root
+	return os.path.join(config.data.data_root, f'{config.data.dataset}_packed_{config.data.resize}')
+
+
+def build_packed_datasets(config, train_transform, test_transform, is_inference):
+	if config.data.no_crop:
+		raise ValueError('Packed store only supports fixed (resize, resize) inputs, disable data.no_crop')
+	root = packed_root(config)
+	train_set = None
+	if not is_inference:
+		train_set = PackedImageDataset(os.path.join(root, 'train'), train_transform)
+	test_set = PackedImageDataset(os.path.join(root, 'test'), test_transform)
+	if test_set.meta.get('resize') != config.data.resize:
+		raise ValueError(f"Packed images in {root} have resize={test_set.meta.get('resize')}, "
+		                 f"but config.data.resize={config.data.resize}, please re-run tools/pack_dataset.py")
+	print(f"📦 使用预缩放打包数据: {root}")
+	return train_set, test_set, test_set.meta['num_classes']
+
+
+def shard_root(config):
+	if config.data.shard_root:
+		return config.data.shard_root
+	return os.path.join(config.data.data_root, f'{config.data.dataset}_shards')
+
+
+def build_sharded_train_set(config, train_transform, keep=None, digest=None):
+	"""训练集改为顺序读取tar分片，验证集仍使用原始数据集的划分
+
+	keep为剪枝后保留的样本在原始训练集划分中的序号，digest为该划分的样本表digest，须与生成分片时的一致。
+	"""
+	root = shard_root(config)
+	if keep is not None:
+		with open(os.path.join(root, SHARD_INDEX), 'r') as f:
+			shard_digest = json.load(f).get('digest')
+		if shard_digest != digest:
+			raise ValueError(f'{root} 不是由当前训练集划分生成的（或生成时未记录digest），无法按data.prune_index剪枝，'
+			                 f'请重新运行tools/make_shards.py')
+	train_set = ShardedImageDataset(root, train_transform, batch_size=config.data.batch_size,
+	                                rank=config.local_rank, world_size=get_world_size(),
+	                                shuffle_buffer=config.data.shuffle_buffer, seed=config.misc.seed,
+	                                draft_size=decode_size(config) if config.data.decode == 'draft' else None,
+	                                keep=keep)
+	print(f"📦 使用tar分片训练集: {root} ({len(train_set.shards)} 个分片)")
+	return train_set
+
+
+def select_backend(config, train_set, test_set, num_samples=64):
+	"""decoder为auto时在数据集的随机样本上测试各解码后端并选用最快的一个"""
+	if config.data.decoder != 'auto':
+		return config.data.decoder
+	dataset = train_set if train_set is not None else test_set
+	try:
+		samples = get_samples(dataset)
+	except AttributeError:
+		return 'pil'
+	if len(samples) == 0:
+		return 'pil'
+	indices = random.Random(config.misc.seed).sample(range(len(samples)), min(num_samples, len(samples)))
+	return select_decoder([samples[i][0] for i in indices])
+
+
+def build_datasets(config, train_transform, test_transform):
 	# 推理模式智能检测
 	is_inference = detect_inference_mode(config)
 	if is_inference:
 		print(f"🔍 检测到推理模式，将加载竞赛测试集")
 
+	if config.data.store == 'packed':
+		train_set, test_set, num_classes = build_packed_datasets(config, train_transform, test_transform, is_inference)
+		if config.data.prune_index and train_set is not None:
+			train_set.prune(config.data.prune_index, config.data.prune_keep, config.data.prune_skip)
+		return train_set, test_set, num_classes
+
 	train_set, test_set, num_classes = None, None, None
 	if config.data.dataset == 'cub':
 		root = os.path.join(config.data.data_root, 'CUB_200_2011')
 		print(root)
-		train_set = CUB(root, True, train_transform)
-		test_set = CUB(root, False, test_transform)
+		train_set = CUB(root, True, train_transform, verify=config.data.verify)
+		test_set = CUB(root, False, test_transform, verify=config.data.verify)
 		num_classes = 200
 
 	elif config.data.dataset == 'cars':
@@ -111,14 +228,9 @@ def build_loader(config):
 			# 训练模式：保持现有验证集划分逻辑
 			val_split = getattr(config.data, 'val_split', 0.2)
 			
-			# 训练集（80%的原训练数据）
-			train_set = WebFG496(root, True, train_transform, val_split=val_split)
-			train_set._split_train_val()  # 调用划分方法获取训练集部分
-			
-			# 验证集（20%的原训练数据）- 作为test_set返回以复用原有验证逻辑
-			test_set = WebFG496(root, True, test_transform, val_split=val_split)
-			test_set.is_validation = True  # 标记为验证集
-			test_set._split_train_val()   # 重新划分获取验证集样本
+			# 只扫描一次、划分一次：训练集与验证集（作为test_set返回以复用原有验证逻辑）是同一样本表的两个视图
+			dataset = WebFG496(root, True, val_split=val_split)
+			train_set, test_set = dataset.split(train_transform, test_transform)
 		
 		num_classes = 496
 
@@ -133,14 +245,9 @@ def build_loader(config):
 			# 训练模式：保持现有验证集划分逻辑（复用WebFG496逻辑）
 			val_split = getattr(config.data, 'val_split', 0.2)
 			
-			# 训练集（80%的原训练数据）
-			train_set = WebFG400(root, True, train_transform, val_split=val_split)
-			train_set._split_train_val()  # 调用划分方法获取训练集部分
-			
-			# 验证集（20%的原训练数据）- 作为test_set返回以复用原有验证逻辑
-			test_set = WebFG400(root, True, test_transform, val_split=val_split)
-			test_set.is_validation = True  # 标记为验证集
-			test_set._split_train_val()   # 重新划分获取验证集样本
+			# 只扫描一次、划分一次：训练集与验证集（作为test_set返回以复用原有验证逻辑）是同一样本表的两个视图
+			dataset = WebFG400(root, True, val_split=val_split, quarantine=config.data.quarantine)
+			train_set, test_set = dataset.split(train_transform, test_transform)
 		
 		num_classes = 400
 
@@ -155,14 +262,9 @@ def build_loader(config):
 			# 训练模式：保持现有验证集划分逻辑（复用WebiNat5089长尾策略）
 			val_split = getattr(config.data, 'val_split', 0.2)
 			
-			# 训练集
-			train_set = WebiNat5000(root, True, train_transform, val_split=val_split)
-			train_set._split_train_val()  # 调用划分方法获取训练集部分
-			
-			# 验证集 - 作为test_set返回以复用原有验证逻辑
-			test_set = WebiNat5000(root, True, test_transform, val_split=val_split)
-			test_set.is_validation = True  # 标记为验证集
-			test_set._split_train_val()   # 重新划分获取验证集样本
+			# 只扫描一次、划分一次：训练集与验证集（作为test_set返回以复用原有验证逻辑）是同一样本表的两个视图
+			dataset = WebiNat5000(root, True, val_split=val_split, quarantine=config.data.quarantine)
+			train_set, test_set = dataset.split(train_transform, test_transform)
 		
 		num_classes = 5000
 
@@ -177,44 +279,237 @@ def build_loader(config):
 			# 训练模式：保持现有验证集划分逻辑
 			val_split = getattr(config.data, 'val_split', 0.2)
 			
-			# 训练集（80%的原训练数据）
-			train_set = WebiNat5089(root, True, train_transform, val_split=val_split)
-			train_set._split_train_val()  # 调用划分方法获取训练集部分
-			
-			# 验证集（20%的原训练数据）- 作为test_set返回以复用原有验证逻辑
-			test_set = WebiNat5089(root, True, test_transform, val_split=val_split)
-			test_set.is_validation = True  # 标记为验证集
-			test_set._split_train_val()   # 重新划分获取验证集样本
+			# 只扫描一次、划分一次：训练集与验证集（作为test_set返回以复用原有验证逻辑）是同一样本表的两个视图
+			dataset = WebiNat5089(root, True, val_split=val_split)
+			train_set, test_set = dataset.split(train_transform, test_transform)
 		
 		num_classes = 5089
-	# 针对H800+大规模数据集优化的worker配置
-	# 基于176核CPU的最优配置：GPU核心数比例 + 数据增强复杂度考虑
-	num_workers = 32 if sys.platform != 'win32' else 0  # 大幅提升并发worker数
+
+	keep, digest = None, None
+	if config.data.prune_index and train_set is not None:
+		# 训练集变小后step_per_epoch = len(train_loader)随之减少，build_scheduler的总步数与warmup步数按此自动缩放
+		if not hasattr(train_set, 'prune'):
+			print(f'[Prune] {train_set.__class__.__name__} 不支持data.prune_index，使用完整训练集')
+		elif config.data.store == 'shards':
+			# 分片训练集在下面替换原训练集，保留的样本序号交给分片读取时跳过其余样本
+			digest = train_set.samples.digest()
+			keep = train_set.pruned_indices(config.data.prune_index, config.data.prune_keep, config.data.prune_skip)
+		else:
+			train_set.prune(config.data.prune_index, config.data.prune_keep, config.data.prune_skip)
+	if config.data.decode != 'full' or config.data.decoder != 'pil':
+		loader = build_image_loader(config.data.decode, decode_size(config), select_backend(config, train_set, test_set))
+		for dataset in (train_set, test_set):
+			if dataset is not None and hasattr(dataset, 'loader'):
+				dataset.loader = loader
+	if config.data.cache_dir and config.data.store == 'raw':
+		build_file_cache(config, train_set, test_set)
+	if config.data.store == 'shards' and train_set is not None:
+		train_set = build_sharded_train_set(config, train_transform, keep, digest)
+	return train_set, test_set, num_classes
+
+
+def build_file_cache(config, train_set, test_set):
+	"""数据目录在网络盘上时，把各数据集的图像加载函数换成经本地缓存读取的CachedLoader，训练/验证集共用一个缓存"""
+	cache = FileCache(config.data.cache_dir, config.data.cache_gb * 2 ** 30)
+	datasets = [dataset for dataset in (train_set, test_set) if dataset is not None and hasattr(dataset, 'loader')]
+	for dataset in datasets:
+		dataset.loader = CachedLoader(dataset.loader, cache)
+	if config.data.cache_warmup:
+		# 同一主机上的各rank共享缓存目录，按rank交错分担预热
+		rank, world_size = max(config.local_rank, 0), get_world_size()
+		tables = [get_samples(dataset) for dataset in datasets]
+		cache.warmup(table[i][0] for table in tables for i in range(rank, len(table), world_size))
+	return cache
+
+
+def build_eval_cache(config, test_set, test_sampler):
+	"""把验证集的确定性PIL变换结果缓存为uint8，之后的验证只做张量化
+
+	data.eval_cache_gb是本机所有rank合计的大小，每个rank缓存自己的验证样本，各分得1 / local_world_size。
+	"""
+	pre_transform, post_transform = split_transform(test_set.transform)
+	test_set.transform = pre_transform
+	indices = list(test_sampler) if test_sampler is not None else None
+	local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', get_world_size()))
+	cached = CachedEvalDataset(test_set, post_transform, (config.data.img_size, config.data.img_size, 3),
+	                           int(config.data.eval_cache_gb * 2 ** 30 / local_world_size),
+	                           config.data.eval_cache_dir, indices, config.local_rank)
+	print(f"🗄️ 验证集缓存: {cached.capacity}/{len(indices) if indices is not None else len(test_set)} 样本 "
+	      f"({cached.data_file})")
+	return cached
+
+
+def build_aspect_buckets(config, train_set):
+	"""长宽比分桶：按样本表中记录的图像尺寸为训练样本分桶，每个桶使用自己的非方形裁剪尺寸
+
+	Returns:
+		(BucketedDataset, 各样本所属桶的序号)
+	"""
+	if not hasattr(train_set, 'image_sizes') or config.data.no_crop:
+		raise ValueError('data.aspect_buckets requires a raw WebFG/WebiNat training set and data.no_crop False')
+	shapes = aspect_bucket_shapes(config.data.img_size, config.data.aspect_buckets)
+	buckets = assign_buckets(train_set.image_sizes(), shapes)
+	counts = np.bincount(buckets, minlength=len(shapes))
+	print('[Buckets] ' + '  '.join(f'{h}x{w}: {n}' for (h, w), n in zip(shapes, counts)))
+	return BucketedDataset(train_set, [build_transforms(config, shape)[0] for shape in shapes]), buckets
+
+
+def loader_settings(config, dataset):
+	"""返回(num_workers, prefetch_factor)：autotune开启时读取本机缓存的调优结果，没有则现场测一次并缓存
+
+	多卡时只由rank 0测试并广播结果：各rank同时测试会互相争抢CPU，且各自选出的结果可能不同。
+	"""
+	if sys.platform == 'win32':
+		return 0, None
+	if not config.data.autotune:
+		return config.data.num_workers, config.data.prefetch_factor
+	key = autotune_key(config, get_world_size())
+	distributed = dist.is_available() and dist.is_initialized()
+	# 调优可能持续数分钟，等待广播的rank使用超时更长的gloo通信组
+	group = dist.new_group(backend='gloo', timeout=datetime.timedelta(hours=2)) if distributed else None
+	result = None
+	if config.local_rank in [-1, 0]:
+		result = load_autotune(key)
+		if result is None:
+			print(f"🔧 DataLoader自动调优: {key}")
+			local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', get_world_size()))
+			max_workers = dataset.max_workers() if hasattr(dataset, 'max_workers') else None
+			result = autotune_loader(dataset, config.data.batch_size, local_world_size, max_workers=max_workers)
+			try:
+				save_autotune(key, result)
+			except OSError as e:
+				print(f"⚠️ 无法保存自动调优结果: {e}")
+	if distributed:
+		shared = [result]
+		dist.broadcast_object_list(shared, src=0, group=group)
+		result = shared[0]
+		dist.destroy_process_group(group)
+	if config.local_rank in [-1, 0]:
+		print(f"🔧 DataLoader: num_workers={result['num_workers']}, prefetch_factor={result['prefetch_factor']} "
+		      f"({result['samples_per_sec']} samples/s)")
+	return result['num_workers'], result['prefetch_factor']
+
+
+def build_loader(config):
+	train_transform, test_transform = build_transforms(config)
+	train_set, test_set, num_classes = build_datasets(config, train_transform, test_transform)
+
+	# worker数与预取深度：默认沿用config.data中的固定值（针对176核H800主机），data.autotune开启时按本机实测结果
+	num_workers, prefetch_factor = loader_settings(config, train_set if train_set is not None else test_set)
+	prefetch_factor = prefetch_factor if num_workers > 0 else None
+	if isinstance(train_set, ShardedImageDataset):
+		# 每个分片只由一个worker读取，分片不够分时在这里报错
+		train_set.set_num_workers(num_workers)
+	# 训练sampler可保存排列与位置，用于从step级检查点恢复；单卡时即num_replicas=1的DistributedSampler
+	train_sampler = ResumableSampler(train_set, num_replicas=get_world_size(), rank=config.local_rank,
+	                                 shuffle=True, seed=config.misc.seed) if train_set is not None else None
 	if config.local_rank == -1:
-		train_sampler = RandomSampler(train_set) if train_set is not None else None
 		test_sampler = SequentialSampler(test_set)
 	else:
-		train_sampler = DistributedSampler(train_set, num_replicas=get_world_size(),
-		                                   rank=config.local_rank, shuffle=True) if train_set is not None else None
 		test_sampler = DistributedSampler(test_set)
-	
-	train_loader = DataLoader(train_set, sampler=train_sampler, batch_size=config.data.batch_size,
-	                          num_workers=num_workers, drop_last=True, pin_memory=True, 
-	                          persistent_workers=True, prefetch_factor=4) if train_set is not None else None
-	test_loader = DataLoader(test_set, sampler=test_sampler, batch_size=config.data.batch_size,
-	                         num_workers=num_workers, shuffle=False, drop_last=False, pin_memory=True,
-	                         persistent_workers=True, prefetch_factor=4)
+	if config.data.eval_cache_gb > 0:
+		# 验证sampler不调用set_epoch，每轮的访问顺序固定，可据此确定缓存位置
+		test_set = build_eval_cache(config, test_set, test_sampler)
+		test_sampler = SequentialSampler(test_set) if config.local_rank == -1 else DistributedSampler(test_set)
+	if isinstance(train_set, IterableDataset):
+		# 分片数据集自行完成打乱与rank/worker划分
+		train_sampler = None
 
-	mixup_fn = None
+	mixup_fn, mixup_collate = None, None
 	mixup_active = config.data.mixup > 0. or config.data.cutmix > 0.
-	if mixup_active:
+	if mixup_active and config.data.mixup_collate:
+		# worker在collate时完成混合并输出软标签，主循环与前向/反向不再串行执行mixup
+		mixup_collate = MixupCollate(config.data.mixup, config.data.cutmix, num_classes, config.model.label_smooth,
+		                             seed=config.misc.seed, rank=max(config.local_rank, 0),
+		                             channels_last=config.data.gpu_aug)
+	elif mixup_active:
 		mixup_fn = Mixup(
 			mixup_alpha=config.data.mixup, cutmix_alpha=config.data.cutmix,
 			label_smoothing=config.model.label_smooth, num_classes=num_classes)
+	
+	if config.data.aspect_buckets and train_set is not None:
+		# 长宽比分桶：同一batch共用一个非方形裁剪尺寸，模型按输入尺寸插值位置参数、填充窗口；验证集仍为方形
+		train_set, buckets = build_aspect_buckets(config, train_set)
+		train_loader = DataLoader(train_set, batch_sampler=AspectRatioBatchSampler(train_sampler, buckets,
+		                                                                           config.data.batch_size),
+		                          num_workers=num_workers, pin_memory=True, persistent_workers=num_workers > 0,
+		                          prefetch_factor=prefetch_factor, collate_fn=mixup_collate)
+	else:
+		train_loader = DataLoader(train_set, sampler=train_sampler, batch_size=config.data.batch_size,
+		                          num_workers=num_workers, drop_last=True, pin_memory=True, 
+		                          persistent_workers=num_workers > 0, prefetch_factor=prefetch_factor,
+		                          collate_fn=mixup_collate) if train_set is not None else None
+	# 验证集每eval_every个epoch才遍历一次：lazy模式下验证worker只在验证期间存在，结束后随迭代器退出，
+	# 训练期间常驻的worker（及其数据集副本）减少一半，代价是每次验证都要重新启动worker
+	eval_persistent = config.data.eval_workers == 'persistent' and num_workers > 0
+	test_loader = DataLoader(test_set, sampler=test_sampler, batch_size=config.data.batch_size,
+	                         num_workers=num_workers, shuffle=False, drop_last=False, pin_memory=True,
+	                         persistent_workers=eval_persistent, prefetch_factor=prefetch_factor)
+	if config.data.gpu_aug:
+		# worker只返回uint8像素，归一化/翻转/颜色抖动在模型所在设备上按batch完成
+		batch_augment = build_batch_augment(config)
+		train_loader = DeviceLoader(train_loader, batch_augment, train=True) if train_loader is not None else None
+		test_loader = DeviceLoader(test_loader, batch_augment, train=False)
+	if config.data.echo_factor != 1 and train_loader is not None:
+		# 数据管线是瓶颈时重复使用已解码的batch，回声batch在设备上做翻转/平移；mixup在主循环中时自然重新配对，
+		# 在worker中已混合时回声batch按data.mixup重新混合一次
+		echo_mixup = config.data.mixup if mixup_collate is not None else 0.
+		train_loader = EchoLoader(train_loader, config.data.echo_factor, config.data.echo_max, config.data.echo_shift,
+		                          mixup_alpha=echo_mixup)
 
 	return train_loader, test_loader, num_classes, len(train_set) if train_set is not None else 0, len(test_set), mixup_fn
 
 
+def loader_sampler(loader):
+	"""负责set_epoch与step级恢复的sampler：长宽比分桶时为AspectRatioBatchSampler（保存桶内容与内部sampler的实际位置），
+	tar分片训练集为数据集本身（保存已训练的batch数），否则为DataLoader的ResumableSampler"""
+	if isinstance(loader.dataset, ShardedImageDataset):
+		return loader.dataset
+	if isinstance(loader.batch_sampler, AspectRatioBatchSampler):
+		return loader.batch_sampler
+	return loader.batch_sampler.sampler
+
+
+def pop_cache_stats(*loaders):
+	"""读取并清零本地文件缓存的(命中次数, 未命中次数, 复制字节数)，未开启data.cache_dir时返回None"""
+	for loader in loaders:
+		image_loader = getattr(loader.dataset, 'loader', None) if loader is not None else None
+		if isinstance(image_loader, CachedLoader):
+			return image_loader.cache.pop()
+	return None
+
+
+def pop_image_errors(*loaders):
+	"""读取并清零各数据集在上一个epoch中的图像读取失败次数"""
+	count = 0
+	for loader in loaders:
+		if loader is not None and hasattr(loader.dataset, 'image_errors'):
+			count += loader.dataset.image_errors.pop()
+	return count
+
+
+def instrumented_transforms(dataset):
+	"""数据集实际使用的InstrumentedCompose及其阶段序号的偏移
+
+	长宽比分桶时worker按桶切换transform，主进程中的dataset.transform是未使用的方形变换，应读取各桶的变换；
+	验证集缓存时除缓存前的transform外还有读取缓存后执行的post_transform。
+	"""
+	if isinstance(dataset, BucketedDataset):
+		composes = [(transform, 0) for transform in dataset.transforms]
+	else:
+		transform = getattr(dataset, 'transform', None)
+		composes = [(transform, 0)]
+		if isinstance(dataset, CachedEvalDataset):
+			offset = len(transform.transforms) if isinstance(transform, transforms.Compose) else 0
+			composes.append((dataset.post_transform, offset))
+	return [(compose, offset) for compose, offset in composes if isinstance(compose, InstrumentedCompose)]
+
+
+def pop_transform_timings(loader):
+	"""读取并清零数据集变换中各阶段的平均耗时（毫秒），未开启data.profile_transforms时返回空字典"""
+	return pop_timings(instrumented_transforms(loader.dataset)) if loader is not None else {}
+
+
 def normalized():
 	normalized_info = dict()
 	normalized_info['standard'] = (0.485, 0.456, 0.406, 0.229, 0.224, 0.225)
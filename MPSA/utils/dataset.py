@@ -1,22 +1,165 @@
+import copy
+import functools
 import json
+import multiprocessing
 import os
-import random
+import warnings
 from os.path import join
 from typing import Union, Sequence
 from pathlib import Path
 from typing import Tuple
-from collections import defaultdict
 import PIL
 import numpy as np
-import pandas as pd
 import scipy
 from PIL import Image
 from scipy import io
 from torch.utils.data import Dataset
 from torchvision.datasets import VisionDataset
+from torchvision.datasets.vision import StandardTransform
 from torchvision.datasets.folder import default_loader
 from torchvision.datasets.utils import *
 
+from utils.decoders import get_decoder
+from utils.manifest import load_image_folder, cache_path_for
+from utils.sample_table import SampleTable, load_cached_table, load_image_sizes, load_pruned_indices, load_split, \
+	read_columns
+from utils.verify import verify_samples, quarantine_table, scan_quarantine
+
+DECODE_MODES = ('full', 'draft')
+
+
+def draft_loader(path, size):
+	"""JPEG按DCT缩放解码：选取仍不小于(size, size)的最小缩放比例（1/2、1/4、1/8），其他格式按原尺寸解码
+
+	大图的解码耗时与worker内存占用随之成倍下降；之后的Resize只是从更小的图像重采样，结果仅有插值差异。
+	"""
+	with open(path, 'rb') as f:
+		img = Image.open(f)
+		if img.format == 'JPEG':
+			img.draft('RGB', (size, size))
+		return img.convert('RGB')
+
+
+def build_image_loader(decode='full', size=None, backend='pil'):
+	"""按config.data.decode与config.data.decoder返回图像加载函数
+
+	draft模式依赖PIL的JPEG缩放解码，只对pil后端生效；draft加载函数使用functools.partial以便传给worker进程。
+	"""
+	assert decode in DECODE_MODES, f'Unknown decode mode: {decode}'
+	if backend != 'pil':
+		if decode == 'draft':
+			warnings.warn(f'data.decode=draft is only supported by the pil decoder, {backend} decodes at full size')
+		return get_decoder(backend)
+	if decode == 'draft' and size:
+		return functools.partial(draft_loader, size=size)
+	return default_loader
+
+
+class ImageErrorCounter:
+	"""图像读取失败次数，计数放在共享内存中，DataLoader各worker累加、主进程每个epoch读取并清零"""
+
+	def __init__(self):
+		self._count = multiprocessing.Value('i', 0)
+
+	def add(self, n=1):
+		with self._count.get_lock():
+			self._count.value += n
+
+	def pop(self):
+		with self._count.get_lock():
+			count, self._count.value = self._count.value, 0
+		return count
+
+
+def webfg_val_ratio(class_size):
+	"""WebFG-400/496的分层比例：小类别保护训练数据，大类别充分验证"""
+	if class_size <= 80:
+		return 0.15
+	elif class_size >= 120:
+		return 0.22
+	return 0.20
+
+
+def webinat_val_ratio(class_size):
+	"""WebiNat长尾分布的分层比例：长尾类别更保守，头部类别充分验证"""
+	if class_size <= 50:
+		return 0.12
+	elif class_size <= 200:
+		return 0.18
+	return 0.25
+
+
+class StratifiedSplitMixin:
+	"""WebFG/WebiNat训练集共用的分层训练/验证划分
+
+	划分索引按(seed, val_split)缓存在数据目录旁，样本表不变时直接读取；split()只扫描一次目录，
+	返回共享同一样本表的训练/验证数据集视图。子类通过val_ratio指定各类别的验证比例。
+	"""
+	val_ratio = staticmethod(webfg_val_ratio)
+	quarantine = 'none'
+	quarantined = ()
+
+	def _split_indices(self):
+		cache_file = cache_path_for(self.data_dir, f'split_{self.random_seed}_{self.val_split}')
+		return load_split(cache_file, self.samples, self.random_seed, self.val_split, self.val_ratio)
+
+	def _apply_quarantine(self, is_validation):
+		"""划分之后隔离损坏样本：训练子集按data.quarantine排除或在子集内替换，验证子集总是排除
+
+		划分在完整样本表上进行，与不隔离时相同；remap替换出的重复样本只在训练子集内，不会同时出现在验证集中。
+		"""
+		if self.quarantine != 'none' and self.quarantined:
+			policy = 'exclude' if is_validation else self.quarantine
+			self.samples = quarantine_table(self.samples, self.quarantined, policy, self.random_seed)
+
+	def _apply_split(self, indices, is_validation):
+		self.samples = self.samples.subset(indices)
+		self._apply_quarantine(is_validation)
+		print(f"{self.__class__.__name__}{'验证集' if is_validation else '训练集'}划分完成: {len(self.samples)} 样本")
+
+	def _split_train_val(self):
+		is_validation = getattr(self, 'is_validation', False)
+		if not self.train or self.val_split <= 0:
+			self._apply_quarantine(is_validation)
+			return
+		train_indices, val_indices = self._split_indices()
+		self._apply_split(val_indices if is_validation else train_indices, is_validation)
+
+	def image_sizes(self):
+		"""各样本图像的(宽, 高)，按样本表内容缓存在数据目录旁，供长宽比分桶使用"""
+		return load_image_sizes(cache_path_for(self.data_dir, f'sizes_{self.samples.digest()[:12]}'), self.samples)
+
+	def pruned_indices(self, index_file, keep, skip=0.):
+		"""按tools/prune_scores.py写出的逐样本难度分数计算剪枝后保留的样本索引，分数文件须由同一训练集划分生成，否则返回None"""
+		indices, meta = load_pruned_indices(index_file, self.samples.digest(), self.samples.labels, keep, skip)
+		if indices is None:
+			print(f'[Prune] {index_file} 不是由当前训练集划分生成的（数据、seed、val_split或quarantine已变化），不剪枝')
+			return None
+		print(f"{self.__class__.__name__}训练集按{meta.get('metric')}剪枝: {len(self.samples)} -> {len(indices)} 样本")
+		return indices
+
+	def prune(self, index_file, keep, skip=0.):
+		"""剪枝训练集，见pruned_indices"""
+		indices = self.pruned_indices(index_file, keep, skip)
+		if indices is not None:
+			self.samples = self.samples.subset(indices)
+
+	def split(self, train_transform=None, test_transform=None):
+		"""返回(训练集, 验证集)两个视图，样本路径缓冲与读取失败计数在两者之间共享"""
+		train_set, val_set = copy.copy(self), copy.copy(self)
+		for dataset, transform in ((train_set, train_transform), (val_set, test_transform)):
+			dataset.transform = transform
+			dataset.transforms = StandardTransform(transform, self.target_transform)
+		val_set.is_validation = True
+		if self.train and self.val_split > 0:
+			train_indices, val_indices = self._split_indices()
+			train_set._apply_split(train_indices, False)
+			val_set._apply_split(val_indices, True)
+		else:
+			train_set._apply_quarantine(False)
+			val_set._apply_quarantine(True)
+		return train_set, val_set
+
 
 class CUB(VisionDataset):
 	"""`CUB-200-2011 <http://www.vision.caltech.edu/visipedia/CUB-200-2011.html>`_ Dataset.
@@ -31,6 +174,9 @@ class CUB(VisionDataset):
 			download (bool, optional): If true, downloads the dataset from the internet and
 			   puts it in root directory. If dataset is already downloaded, it is not
 			   downloaded again.
+			verify (string, optional): Integrity check mode, ``'none'``, ``'fast'`` (files exist)
+			   or ``'full'`` (also parse image headers and detect truncated JPEGs). Results are
+			   cached and re-used while the metadata and image directories are unchanged.
 	"""
 	base_folder = 'CUB_200_2011/images'
 	# url = 'http://www.vision.caltech.edu/visipedia-data/CUB-200-2011/CUB_200_2011.tgz'
@@ -38,11 +184,12 @@ class CUB(VisionDataset):
 	filename = 'CUB_200_2011.tgz'
 	tgz_md5 = '97eceeb196236b17998738112f37df78'
 
-	def __init__(self, root, train=True, transform=None, target_transform=None, download=False):
+	def __init__(self, root, train=True, transform=None, target_transform=None, download=False, verify='fast'):
 		super(CUB, self).__init__(root, transform=transform, target_transform=target_transform)
 
 		self.loader = default_loader
 		self.train = train
+		self.verify = verify
 		if download:
 			self._download()
 
@@ -50,23 +197,27 @@ class CUB(VisionDataset):
 			raise RuntimeError('Dataset not found or corrupted. You can use download=True to download it')
 
 	def _load_metadata(self):
-		images = pd.read_csv(os.path.join(self.root, 'CUB_200_2011', 'images.txt'), sep=' ',
-		                     names=['img_id', 'filepath'])
-		image_class_labels = pd.read_csv(os.path.join(self.root, 'CUB_200_2011', 'image_class_labels.txt'),
-		                                 sep=' ', names=['img_id', 'target'])
-		train_test_split = pd.read_csv(os.path.join(self.root, 'CUB_200_2011', 'train_test_split.txt'),
-		                               sep=' ', names=['img_id', 'is_training_img'])
-
-		data = images.merge(image_class_labels, on='img_id')
-		self.data = data.merge(train_test_split, on='img_id')
-
-		class_names = pd.read_csv(os.path.join(self.root, 'CUB_200_2011', 'classes.txt'),
-		                          sep=' ', names=['class_name'], usecols=[1])
-		self.class_names = class_names['class_name'].to_list()
-		if self.train:
-			self.data = self.data[self.data.is_training_img == 1]
-		else:
-			self.data = self.data[self.data.is_training_img == 0]
+		meta_dir = os.path.join(self.root, 'CUB_200_2011')
+		sources = [os.path.join(meta_dir, name) for name in
+		           ('images.txt', 'image_class_labels.txt', 'train_test_split.txt', 'classes.txt')]
+		cache_file = cache_path_for(sources[0], 'train.samples' if self.train else 'test.samples')
+		self.samples, extra = load_cached_table(cache_file, sources, lambda: self._parse_metadata(meta_dir),
+		                                        os.path.join(self.root, self.base_folder))
+		self.class_names = extra['class_names']
+		self._metadata_sources = sources
+
+	def _parse_metadata(self, meta_dir):
+		images = read_columns(os.path.join(meta_dir, 'images.txt'))
+		targets = dict(read_columns(os.path.join(meta_dir, 'image_class_labels.txt')))
+		is_training_img = dict(read_columns(os.path.join(meta_dir, 'train_test_split.txt')))
+		class_names = [row[1] for row in read_columns(os.path.join(meta_dir, 'classes.txt'))]
+
+		paths, labels = [], []
+		for img_id, filepath in images:
+			if (is_training_img[img_id] == '1') == self.train:
+				paths.append(filepath)
+				labels.append(int(targets[img_id]) - 1)  # Targets start at 1 by default, so shift to 0
+		return paths, labels, {'class_names': class_names}
 
 	def _check_integrity(self):
 		try:
@@ -74,12 +225,11 @@ class CUB(VisionDataset):
 		except Exception:
 			return False
 
-		for index, row in self.data.iterrows():
-			filepath = os.path.join(self.root, self.base_folder, row.filepath)
-			if not os.path.isfile(filepath):
-				print(filepath)
-				return False
-		return True
+		record_file = cache_path_for(self._metadata_sources[0], 'train.verified' if self.train else 'test.verified')
+		bad_files = verify_samples(self.samples, record_file, self._metadata_sources, self.verify)
+		for filepath in bad_files[:10]:
+			print(filepath)
+		return not bad_files
 
 	def _download(self):
 		import tarfile
@@ -94,12 +244,10 @@ class CUB(VisionDataset):
 			tar.extractall(path=self.root)
 
 	def __len__(self):
-		return len(self.data)
+		return len(self.samples)
 
 	def __getitem__(self, idx):
-		sample = self.data.iloc[idx]
-		path = os.path.join(self.root, self.base_folder, sample.filepath)
-		target = sample.target - 1  # Targets start at 1 by default, so shift to 0
+		path, target = self.samples[idx]
 		img = self.loader(path)
 
 		if self.transform is not None:
@@ -142,18 +290,23 @@ class Cars(VisionDataset):
 		# 	raise RuntimeError(
 		# 		'Dataset not found. You can use download=True to download it.')
 
-		loaded_mat = scipy.io.loadmat(os.path.join(self.root, self.file_list['annos'][1]))
+		annos_file = os.path.join(self.root, self.file_list['annos'][1])
+		cache_file = cache_path_for(annos_file, 'train.samples' if self.train else 'test.samples')
+		self.samples, _ = load_cached_table(cache_file, [annos_file], lambda: self._parse_annotations(annos_file),
+		                                    self.root)
+
+	def _parse_annotations(self, annos_file):
+		loaded_mat = scipy.io.loadmat(annos_file)
 		loaded_mat = loaded_mat['annotations'][0]
-		self.samples = []
+		paths, labels = [], []
 		for item in loaded_mat:
 			if self.train != bool(item[-1][0]):
-				path = str(item[0][0])
-				label = int(item[-2][0]) - 1
-				self.samples.append((path, label))
+				paths.append(str(item[0][0]))
+				labels.append(int(item[-2][0]) - 1)
+		return paths, labels, {}
 
 	def __getitem__(self, index):
 		path, target = self.samples[index]
-		path = os.path.join(self.root, path)
 
 		image = self.loader(path)
 		if self.transform is not None:
@@ -265,13 +418,13 @@ class Dogs(VisionDataset):
 		if download:
 			self.download()
 
-		split = self.load_split()
-
 		self.images_folder = join(self.root, 'Images')
 		self.annotations_folder = join(self.root, 'Annotation')
 		self._breeds = list_dir(self.images_folder)
 
-		self._breed_images = [(annotation + '.jpg', idx) for annotation, idx in split]
+		list_file = join(self.root, 'train_list.mat' if self.train else 'test_list.mat')
+		self._breed_images, _ = load_cached_table(cache_path_for(list_file, 'samples'), [list_file],
+		                                          lambda: self.load_split(list_file), self.images_folder)
 
 		self._flat_breed_images = self._breed_images
 
@@ -279,8 +432,7 @@ class Dogs(VisionDataset):
 		return len(self._flat_breed_images)
 
 	def __getitem__(self, index):
-		image_name, target = self._flat_breed_images[index]
-		image_path = join(self.images_folder, image_name)
+		image_path, target = self._flat_breed_images[index]
 		image = self.loader(image_path)
 
 		if self.transform is not None:
@@ -306,22 +458,15 @@ class Dogs(VisionDataset):
 				tar_file.extractall(self.root)
 			os.remove(join(self.root, tar_filename))
 
-	def load_split(self):
-		if self.train:
-			split = scipy.io.loadmat(join(self.root, 'train_list.mat'))['annotation_list']
-			labels = scipy.io.loadmat(join(self.root, 'train_list.mat'))['labels']
-		else:
-			split = scipy.io.loadmat(join(self.root, 'test_list.mat'))['annotation_list']
-			labels = scipy.io.loadmat(join(self.root, 'test_list.mat'))['labels']
-
-		split = [item[0][0] for item in split]
-		labels = [item[0] - 1 for item in labels]
-		return list(zip(split, labels))
+	def load_split(self, list_file):
+		loaded_mat = scipy.io.loadmat(list_file)
+		split = [item[0][0] + '.jpg' for item in loaded_mat['annotation_list']]
+		labels = [int(item[0]) - 1 for item in loaded_mat['labels']]
+		return split, labels, {}
 
 	def stats(self):
 		counts = {}
-		for index in range(len(self._flat_breed_images)):
-			image_name, target_class = self._flat_breed_images[index]
+		for target_class in self._flat_breed_images.labels.tolist():
 			if target_class not in counts.keys():
 				counts[target_class] = 1
 			else:
@@ -346,14 +491,14 @@ class Aircraft(Dataset):
 		                                 'images_%s_%s.txt' % (self.class_type, self.split))
 		self.transform = transform
 
-		(image_ids, targets, classes, class_to_idx) = self.find_classes()
-		samples = self.make_dataset(image_ids, targets)
+		cache_file = cache_path_for(self.classes_file, 'samples')
+		self.samples, extra = load_cached_table(cache_file, [self.classes_file], self.make_dataset,
+		                                        os.path.join(self.root, self.img_folder))
 
 		self.loader = default_loader
 
-		self.samples = samples
-		self.classes = classes
-		self.class_to_idx = class_to_idx
+		self.classes = np.asarray(extra['classes'])
+		self.class_to_idx = {c: i for i, c in enumerate(extra['classes'])}
 
 	def __getitem__(self, index):
 		path, target = self.samples[index]
@@ -381,14 +526,11 @@ class Aircraft(Dataset):
 
 		return image_ids, targets, classes, class_to_idx
 
-	def make_dataset(self, image_ids, targets):
+	def make_dataset(self):
+		(image_ids, targets, classes, class_to_idx) = self.find_classes()
 		assert (len(image_ids) == len(targets))
-		images = []
-		for i in range(len(image_ids)):
-			item = (os.path.join(self.root, self.img_folder,
-			                     '%s.jpg' % image_ids[i]), targets[i])
-			images.append(item)
-		return images
+		paths = ['%s.jpg' % image_id for image_id in image_ids]
+		return paths, targets, {'classes': classes.tolist()}
 
 
 class NABirds(VisionDataset):
@@ -429,33 +571,22 @@ class NABirds(VisionDataset):
 		self.loader = default_loader
 		self.train = train
 
-		image_paths = pd.read_csv(os.path.join(dataset_path, 'images.txt'),
-		                          sep=' ', names=['img_id', 'filepath'])
-		image_class_labels = pd.read_csv(os.path.join(dataset_path, 'image_class_labels.txt'),
-		                                 sep=' ', names=['img_id', 'target'])
-		# Since the raw labels are non-continuous, map them to new ones
-		self.label_map = self.get_continuous_class_map(image_class_labels['target'])
-		train_test_split = pd.read_csv(os.path.join(dataset_path, 'train_test_split.txt'),
-		                               sep=' ', names=['img_id', 'is_training_img'])
-		data = image_paths.merge(image_class_labels, on='img_id')
-		self.data = data.merge(train_test_split, on='img_id')
-		# Load in the train / test split
-		if self.train:
-			self.data = self.data[self.data.is_training_img == 1]
-		else:
-			self.data = self.data[self.data.is_training_img == 0]
+		sources = [os.path.join(dataset_path, name) for name in
+		           ('images.txt', 'image_class_labels.txt', 'train_test_split.txt')]
+		cache_file = cache_path_for(sources[0], 'train.samples' if self.train else 'test.samples')
+		self.samples, extra = load_cached_table(cache_file, sources, lambda: self._parse_metadata(dataset_path),
+		                                        os.path.join(self.root, self.base_folder))
+		self.label_map = dict(extra['label_map'])
 
 		# Load in the class data
 		self.class_names = self.load_class_names(dataset_path)
 		self.class_hierarchy = self.load_hierarchy(dataset_path)
 
 	def __len__(self):
-		return len(self.data)
+		return len(self.samples)
 
 	def __getitem__(self, idx):
-		sample = self.data.iloc[idx]
-		path = os.path.join(self.root, self.base_folder, sample.filepath)
-		target = self.label_map[sample.target]
+		path, target = self.samples[idx]
 		img = self.loader(path)
 
 		if self.transform is not None:
@@ -464,6 +595,22 @@ class NABirds(VisionDataset):
 			target = self.target_transform(target)
 		return img, target
 
+	def _parse_metadata(self, dataset_path):
+		image_paths = read_columns(os.path.join(dataset_path, 'images.txt'))
+		targets = {img_id: int(target) for img_id, target in
+		           read_columns(os.path.join(dataset_path, 'image_class_labels.txt'))}
+		# Since the raw labels are non-continuous, map them to new ones
+		label_map = self.get_continuous_class_map(targets.values())
+		is_training_img = dict(read_columns(os.path.join(dataset_path, 'train_test_split.txt')))
+
+		# Load in the train / test split
+		paths, labels = [], []
+		for img_id, filepath in image_paths:
+			if (is_training_img[img_id] == '1') == self.train:
+				paths.append(filepath)
+				labels.append(label_map[targets[img_id]])
+		return paths, labels, {'label_map': list(label_map.items())}
+
 	def get_continuous_class_map(self, class_labels):
 		label_set = set(class_labels)
 		return {k: i for i, k in enumerate(label_set)}
@@ -496,19 +643,16 @@ class OxfordFlowers(Dataset):
 		self.transform = transform
 		self.root = root
 		self.loader = default_loader
-		train_set = pd.read_csv(os.path.join(self.root, 'train.txt'),
-		                        sep=' ', names=['img_path', 'target'])
-		test_set = pd.read_csv(os.path.join(self.root, 'test.txt'),
-		                       sep=' ', names=['img_path', 'target'])
-		if train:
-			self.data = train_set
-		else:
-			self.data = test_set
+		list_file = os.path.join(self.root, 'train.txt' if train else 'test.txt')
+		self.samples, _ = load_cached_table(cache_path_for(list_file, 'samples'), [list_file],
+		                                    lambda: self._parse_list(list_file), self.root)
+
+	def _parse_list(self, list_file):
+		rows = read_columns(list_file, ' ')
+		return [row[0] for row in rows], [int(row[1]) for row in rows], {}
 
 	def __getitem__(self, idx):
-		sample = self.data.iloc[idx]
-		path = os.path.join(self.root, sample.img_path)
-		target = sample.target
+		path, target = self.samples[idx]
 		img = self.loader(path)
 
 		if self.transform is not None:
@@ -516,7 +660,7 @@ class OxfordFlowers(Dataset):
 		return img, target
 
 	def __len__(self):
-		return len(self.data)
+		return len(self.samples)
 
 
 class OxfordIIITPet(VisionDataset):
@@ -570,6 +714,7 @@ class OxfordIIITPet(VisionDataset):
 		self._images_folder = os.path.join(self.root, "images")
 		self._anns_folder = os.path.join(self.root, "annotations")
 		self._segs_folder = os.path.join(self.root, "trimaps")
+		self.loader = default_loader
 
 		if download:
 			self._download()
@@ -577,38 +722,46 @@ class OxfordIIITPet(VisionDataset):
 		if not self._check_exists():
 			raise RuntimeError("Dataset not found. You can use download=True to download it")
 
+		split_file = os.path.join(self._anns_folder, f"{self._split}.txt")
+		self._images, extra = load_cached_table(cache_path_for(split_file, 'samples'), [split_file],
+		                                        lambda: self._parse_split(split_file), self._images_folder)
+		self._labels = self._images.labels
+
+		self.classes = extra['classes']
+		self.class_to_idx = dict(zip(self.classes, range(len(self.classes))))
+
+	def _parse_split(self, split_file):
 		image_ids = []
-		self._labels = []
-		with open(os.path.join(self._anns_folder, f"{self._split}.txt")) as file:
+		labels = []
+		with open(split_file) as file:
 			for line in file:
 				image_id, label, *_ = line.strip().split()
 				image_ids.append(image_id)
-				self._labels.append(int(label) - 1)
+				labels.append(int(label) - 1)
 
-		self.classes = [
+		classes = [
 			" ".join(part.title() for part in raw_cls.split("_"))
 			for raw_cls, _ in sorted(
-				{(image_id.rsplit("_", 1)[0], label) for image_id, label in zip(image_ids, self._labels)},
+				{(image_id.rsplit("_", 1)[0], label) for image_id, label in zip(image_ids, labels)},
 				key=lambda image_id_and_label: image_id_and_label[1],
 			)
 		]
-		self.class_to_idx = dict(zip(self.classes, range(len(self.classes))))
-
-		self._images = [os.path.join(self._images_folder, f"{image_id}.jpg") for image_id in image_ids]
-		self._segs = [os.path.join(self._segs_folder, f"{image_id}.png") for image_id in image_ids]
+		return [f"{image_id}.jpg" for image_id in image_ids], labels, {'classes': classes}
 
 	def __len__(self) -> int:
 		return len(self._images)
 
 	def __getitem__(self, idx: int) -> Tuple[Any, Any]:
-		image = Image.open(self._images[idx]).convert("RGB")
+		image_path, label = self._images[idx]
+		image = self.loader(image_path)
 
 		target: Any = []
 		for target_type in self._target_types:
 			if target_type == "category":
-				target.append(self._labels[idx])
+				target.append(label)
 			else:  # target_type == "segmentation"
-				target.append(Image.open(self._segs[idx]))
+				image_id = os.path.splitext(os.path.basename(image_path))[0]
+				target.append(Image.open(os.path.join(self._segs_folder, f"{image_id}.png")))
 
 		if not target:
 			target = None
@@ -675,6 +828,7 @@ class Food101(VisionDataset):
 		self._base_folder = Path(self.root) / "food-101"
 		self._meta_folder = self._base_folder / "meta"
 		self._images_folder = self._base_folder / "images"
+		self.loader = default_loader
 
 		if download:
 			self._download()
@@ -682,26 +836,33 @@ class Food101(VisionDataset):
 		if not self._check_exists():
 			raise RuntimeError("Dataset not found. You can use download=True to download it")
 
-		self._labels = []
-		self._image_files = []
-		with open(self._meta_folder / f"{split}.json") as f:
-			metadata = json.loads(f.read())
+		meta_file = str(self._meta_folder / f"{split}.json")
+		self._image_files, extra = load_cached_table(cache_path_for(meta_file, 'samples'), [meta_file],
+		                                             lambda: self._parse_metadata(meta_file), str(self._images_folder))
+		self._labels = self._image_files.labels
 
-		self.classes = sorted(metadata.keys())
+		self.classes = extra['classes']
 		self.class_to_idx = dict(zip(self.classes, range(len(self.classes))))
 
+	def _parse_metadata(self, meta_file):
+		with open(meta_file) as f:
+			metadata = json.loads(f.read())
+
+		classes = sorted(metadata.keys())
+		class_to_idx = dict(zip(classes, range(len(classes))))
+
+		labels, image_files = [], []
 		for class_label, im_rel_paths in metadata.items():
-			self._labels += [self.class_to_idx[class_label]] * len(im_rel_paths)
-			self._image_files += [
-				self._images_folder.joinpath(*f"{im_rel_path}.jpg".split("/")) for im_rel_path in im_rel_paths
-			]
+			labels += [class_to_idx[class_label]] * len(im_rel_paths)
+			image_files += [os.path.join(*f"{im_rel_path}.jpg".split("/")) for im_rel_path in im_rel_paths]
+		return image_files, labels, {'classes': classes}
 
 	def __len__(self) -> int:
 		return len(self._image_files)
 
 	def __getitem__(self, idx) -> Tuple[Any, Any]:
-		image_file, label = self._image_files[idx], self._labels[idx]
-		image = PIL.Image.open(image_file).convert("RGB")
+		image_file, label = self._image_files[idx]
+		image = self.loader(image_file)
 
 		if self.transform:
 			image = self.transform(image)
@@ -723,7 +884,7 @@ class Food101(VisionDataset):
 		download_and_extract_archive(self._URL, download_root=self.root, md5=self._MD5)
 
 
-class WebFG496(VisionDataset):
+class WebFG496(StratifiedSplitMixin, VisionDataset):
 	"""WebFG-496 Competition Dataset.
 	Args:
 		root (string): Root directory of the dataset.
@@ -739,6 +900,7 @@ class WebFG496(VisionDataset):
 		super(WebFG496, self).__init__(root, transform=transform, target_transform=target_transform)
 		
 		self.loader = default_loader
+		self.image_errors = ImageErrorCounter()
 		self.train = train
 		self.val_split = val_split  # 验证集划分比例，0表示不划分
 		self.random_seed = random_seed
@@ -752,7 +914,7 @@ class WebFG496(VisionDataset):
 			label_file = os.path.join(self.root, 'test_WebFG496', 'new_val-list_unlabeled.txt')
 			self.data_dir = os.path.join(self.root, 'test_WebFG496')
 		
-		self.samples = []
+		paths, labels = [], []
 		
 		with open(label_file, 'r') as f:
 			for line in f:
@@ -764,60 +926,19 @@ class WebFG496(VisionDataset):
 					# Format: "train/707-320/707-320_00001.jpg: 0"
 					img_path, label = line.split(': ')
 					img_path = os.path.join(self.data_dir, img_path)
-					label = int(label)
-					self.samples.append((img_path, label))
+					paths.append(img_path)
+					labels.append(int(label))
 				else:
 					# Test format: "test/new_val/0000.jpg"
 					img_path = line
 					img_path = os.path.join(self.data_dir, img_path.replace('test/', ''))
 					# Use -1 as placeholder for test labels
-					self.samples.append((img_path, -1))
+					paths.append(img_path)
+					labels.append(-1)
 
-		# 注意：不在初始化时自动划分，避免嵌套划分问题
+		self.samples = SampleTable.from_lists(paths, labels)
 
-	def _split_train_val(self):
-		"""修复后的训练验证集划分：统一数据源，简化智能分层策略"""
-		if not self.train or self.val_split <= 0:
-			return
-		
-		# 设置随机种子确保可重现性
-		random.seed(self.random_seed)
-		np.random.seed(self.random_seed)
-		
-		# 按类别组织数据
-		class_samples = defaultdict(list)
-		for i, (path, label) in enumerate(self.samples):
-			class_samples[label].append(i)
-		
-		train_indices = []
-		val_indices = []
-		
-		# 基于WebFG-496分布特征的分层策略
-		for label, indices in class_samples.items():
-			class_size = len(indices)
-			
-			# 简化的分层比例策略
-			if class_size <= 80:      # 小类别
-				val_ratio = 0.15     # 保护训练数据
-			elif class_size >= 120:   # 大类别
-				val_ratio = 0.22     # 充分验证
-			else:                     # 中等类别
-				val_ratio = 0.20     # 标准比例
-			
-			val_size = max(1, int(class_size * val_ratio))
-			
-			# 简单随机划分
-			random.shuffle(indices)
-			val_indices.extend(indices[:val_size])
-			train_indices.extend(indices[val_size:])
-		
-		# 根据标记选择对应数据集
-		if hasattr(self, 'is_validation') and self.is_validation:
-			self.samples = [self.samples[i] for i in val_indices]
-			print(f"WebFG496验证集划分完成: {len(self.samples)} 样本")
-		else:
-			self.samples = [self.samples[i] for i in train_indices] 
-			print(f"WebFG496训练集划分完成: {len(self.samples)} 样本")
+		# 注意：不在初始化时自动划分，避免嵌套划分问题
 
 	def __len__(self):
 		return len(self.samples)
@@ -826,10 +947,9 @@ class WebFG496(VisionDataset):
 		path, target = self.samples[idx]
 		try:
 			img = self.loader(path)
-		except (OSError, IOError, PIL.UnidentifiedImageError) as e:
-			# 将错误信息写入日志文件而不是终端输出
-			error_msg = f"Corrupted image at index {idx}: {path} - {e}"
-			self._log_image_error(error_msg)
+		except (OSError, IOError, PIL.UnidentifiedImageError):
+			# 只累计次数，每个epoch汇总输出一次；损坏文件可用data.quarantine在构建数据集时预先隔离
+			self.image_errors.add()
 			
 			# 使用ImageNet RGB均值创建替代图像，确保数值稳定性
 			# ImageNet均值: [0.485, 0.456, 0.406] * 255 = [123.675, 116.28, 103.53]
@@ -841,34 +961,8 @@ class WebFG496(VisionDataset):
 			target = self.target_transform(target)
 		return img, target
 
-	def _log_image_error(self, error_msg):
-		"""将图像错误信息记录到日志文件中，而不输出到终端"""
-		import os
-		import time
-		
-		# 获取当前时间戳
-		timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-		
-		# 构建日志文件路径 - 使用与训练日志相同的目录
-		log_dir = './output'  # 默认输出目录
-		if hasattr(self, 'root'):
-			# 尝试构建更合适的日志目录
-			dataset_name = 'webfg496' if 'WebFG' in self.__class__.__name__ else 'dataset'
-			log_dir = f'./output/{dataset_name}'
-		
-		os.makedirs(log_dir, exist_ok=True)
-		
-		# 写入图像错误日志文件
-		error_log_file = os.path.join(log_dir, 'image_errors.log')
-		try:
-			with open(error_log_file, 'a', encoding='utf-8') as f:
-				f.write(f"[{timestamp}] {error_msg}\n")
-		except:
-			# 如果写入失败，静默忽略，确保训练不中断
-			pass
-
 
-class WebFG400(VisionDataset):
+class WebFG400(StratifiedSplitMixin, VisionDataset):
 	"""WebFG-400 Competition Dataset (ImageFolder格式).
 	Args:
 		root (string): Root directory of the dataset.
@@ -880,10 +974,12 @@ class WebFG400(VisionDataset):
 			target and transforms it.
 	"""
 
-	def __init__(self, root, train=True, transform=None, target_transform=None, val_split=0.0, random_seed=42):
+	def __init__(self, root, train=True, transform=None, target_transform=None, val_split=0.0, random_seed=42,
+	             quarantine='none'):
 		super(WebFG400, self).__init__(root, transform=transform, target_transform=target_transform)
 		
 		self.loader = default_loader
+		self.image_errors = ImageErrorCounter()
 		self.train = train
 		self.val_split = val_split  # 验证集划分比例，0表示不划分
 		self.random_seed = random_seed
@@ -892,76 +988,19 @@ class WebFG400(VisionDataset):
 			# Training data - ImageFolder格式
 			self.data_dir = os.path.join(self.root, 'webfg400_train', 'train')
 			
-			# 读取所有图片和标签
-			self.samples = []
-			class_folders = sorted(os.listdir(self.data_dir))
-			
-			for class_idx, class_folder in enumerate(class_folders):
-				class_path = os.path.join(self.data_dir, class_folder)
-				if not os.path.isdir(class_path):
-					continue
-				
-				# 遍历该类别下的所有图片
-				for img_name in os.listdir(class_path):
-					if img_name.lower().endswith(('.jpg', '.jpeg', '.png')):
-						img_path = os.path.join(class_path, img_name)
-						self.samples.append((img_path, class_idx))
+			# 读取所有图片和标签（样本清单缓存在数据目录旁，目录未变化时不再逐个listdir）
+			self.samples = SampleTable.from_manifest(load_image_folder(self.data_dir))
+			# 预扫描损坏图像，隔离列表保存在样本清单旁，数据未变化时直接复用；隔离在划分训练/验证集之后进行
+			self.quarantine = quarantine
+			self.quarantined = scan_quarantine(self.samples, cache_path_for(self.data_dir, 'quarantine'), quarantine)
 		else:
 			# Test data - 竞赛测试集（B榜，无标签）
 			self.data_dir = os.path.join(self.root, 'webfg400_test_B', 'test_B')
-			self.samples = []
+			self.samples = SampleTable.from_lists([], [])
 			
-			# 直接读取test_B目录下的所有图片（无子文件夹）
+			# 直接读取test_B目录下的所有图片（无子文件夹），使用-1作为占位符标签（测试集无真实标签）
 			if os.path.exists(self.data_dir):
-				for img_name in sorted(os.listdir(self.data_dir)):
-					if img_name.lower().endswith(('.jpg', '.jpeg', '.png')):
-						img_path = os.path.join(self.data_dir, img_name)
-						# 使用-1作为占位符标签（测试集无真实标签）
-						self.samples.append((img_path, -1))
-
-	def _split_train_val(self):
-		"""修复后的训练验证集划分：复用WebFG496的智能分层策略"""
-		if not self.train or self.val_split <= 0:
-			return
-		
-		# 设置随机种子确保可重现性
-		random.seed(self.random_seed)
-		np.random.seed(self.random_seed)
-		
-		# 按类别组织数据
-		class_samples = defaultdict(list)
-		for i, (path, label) in enumerate(self.samples):
-			class_samples[label].append(i)
-		
-		train_indices = []
-		val_indices = []
-		
-		# 基于WebFG-400分布特征的分层策略（和WebFG496相同）
-		for label, indices in class_samples.items():
-			class_size = len(indices)
-			
-			# 简化的分层比例策略
-			if class_size <= 80:      # 小类别
-				val_ratio = 0.15     # 保护训练数据
-			elif class_size >= 120:   # 大类别
-				val_ratio = 0.22     # 充分验证
-			else:                     # 中等类别
-				val_ratio = 0.20     # 标准比例
-			
-			val_size = max(1, int(class_size * val_ratio))
-			
-			# 简单随机划分
-			random.shuffle(indices)
-			val_indices.extend(indices[:val_size])
-			train_indices.extend(indices[val_size:])
-		
-		# 根据标记选择对应数据集
-		if hasattr(self, 'is_validation') and self.is_validation:
-			self.samples = [self.samples[i] for i in val_indices]
-			print(f"WebFG400验证集划分完成: {len(self.samples)} 样本")
-		else:
-			self.samples = [self.samples[i] for i in train_indices] 
-			print(f"WebFG400训练集划分完成: {len(self.samples)} 样本")
+				self.samples = SampleTable.from_manifest(load_image_folder(self.data_dir, flat=True))
 
 	def __len__(self):
 		return len(self.samples)
@@ -970,10 +1009,9 @@ class WebFG400(VisionDataset):
 		path, target = self.samples[idx]
 		try:
 			img = self.loader(path)
-		except (OSError, IOError, PIL.UnidentifiedImageError) as e:
-			# 将错误信息写入日志文件而不是终端输出
-			error_msg = f"Corrupted image at index {idx}: {path} - {e}"
-			self._log_image_error(error_msg)
+		except (OSError, IOError, PIL.UnidentifiedImageError):
+			# 只累计次数，每个epoch汇总输出一次；损坏文件可用data.quarantine在构建数据集时预先隔离
+			self.image_errors.add()
 			
 			# 使用ImageNet RGB均值创建替代图像，确保数值稳定性
 			# ImageNet均值: [0.485, 0.456, 0.406] * 255 = [123.675, 116.28, 103.53]
@@ -985,34 +1023,8 @@ class WebFG400(VisionDataset):
 			target = self.target_transform(target)
 		return img, target
 
-	def _log_image_error(self, error_msg):
-		"""将图像错误信息记录到日志文件中，而不输出到终端"""
-		import os
-		import time
-		
-		# 获取当前时间戳
-		timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-		
-		# 构建日志文件路径 - 使用与训练日志相同的目录
-		log_dir = './output'  # 默认输出目录
-		if hasattr(self, 'root'):
-			# 尝试构建更合适的日志目录
-			dataset_name = 'webfg400'
-			log_dir = f'./output/{dataset_name}'
-		
-		os.makedirs(log_dir, exist_ok=True)
-		
-		# 写入图像错误日志文件
-		error_log_file = os.path.join(log_dir, 'image_errors.log')
-		try:
-			with open(error_log_file, 'a', encoding='utf-8') as f:
-				f.write(f"[{timestamp}] {error_msg}\n")
-		except:
-			# 如果写入失败，静默忽略，确保训练不中断
-			pass
-
 
-class WebiNat5000(VisionDataset):
+class WebiNat5000(StratifiedSplitMixin, VisionDataset):
 	"""WebiNat-5000 Competition Dataset (ImageFolder格式).
 	
 	与WebiNat5089不同，这个数据集使用ImageFolder结构（类别文件夹）而非TXT标签文件。
@@ -1025,10 +1037,14 @@ class WebiNat5000(VisionDataset):
 	- test_B/*.jpg (B榜测试集，无标签)
 	"""
 	
-	def __init__(self, root, train=True, transform=None, target_transform=None, val_split=0.0, random_seed=42):
+	val_ratio = staticmethod(webinat_val_ratio)
+
+	def __init__(self, root, train=True, transform=None, target_transform=None, val_split=0.0, random_seed=42,
+	             quarantine='none'):
 		super(WebiNat5000, self).__init__(root, transform=transform, target_transform=target_transform)
 		
 		self.loader = default_loader
+		self.image_errors = ImageErrorCounter()
 		self.train = train
 		self.val_split = val_split
 		self.random_seed = random_seed
@@ -1037,77 +1053,20 @@ class WebiNat5000(VisionDataset):
 			# Training data - ImageFolder格式
 			self.data_dir = os.path.join(self.root, 'webinat5000_train', 'train')
 			
-			# 读取所有图片和标签
-			self.samples = []
-			class_folders = sorted(os.listdir(self.data_dir))
-			
-			for class_idx, class_folder in enumerate(class_folders):
-				class_path = os.path.join(self.data_dir, class_folder)
-				if not os.path.isdir(class_path):
-					continue
-				
-				# 遍历该类别下的所有图片
-				for img_name in os.listdir(class_path):
-					if img_name.lower().endswith(('.jpg', '.jpeg', '.png')):
-						img_path = os.path.join(class_path, img_name)
-						self.samples.append((img_path, class_idx))
+			# 读取所有图片和标签（样本清单缓存在数据目录旁，目录未变化时不再逐个listdir）
+			self.samples = SampleTable.from_manifest(load_image_folder(self.data_dir))
+			# 预扫描损坏图像，隔离列表保存在样本清单旁，数据未变化时直接复用；隔离在划分训练/验证集之后进行
+			self.quarantine = quarantine
+			self.quarantined = scan_quarantine(self.samples, cache_path_for(self.data_dir, 'quarantine'), quarantine)
 		else:
 			# Test data - 竞赛测试集（无标签）
 			self.data_dir = os.path.join(self.root, 'webinat5000_test_B', 'test_B')
-			self.samples = []
+			self.samples = SampleTable.from_lists([], [])
 			
-			# 直接读取test_B目录下的所有图片（无子文件夹）
+			# 直接读取test_B目录下的所有图片（无子文件夹），使用-1作为占位符标签（测试集无真实标签）
 			if os.path.exists(self.data_dir):
-				for img_name in sorted(os.listdir(self.data_dir)):
-					if img_name.lower().endswith(('.jpg', '.jpeg', '.png')):
-						img_path = os.path.join(self.data_dir, img_name)
-						# 使用-1作为占位符标签（测试集无真实标签）
-						self.samples.append((img_path, -1))
-	
-	def _split_train_val(self):
-		"""修复后的训练验证集划分：复用WebiNat5089的长尾分布智能分层策略"""
-		if not self.train or self.val_split <= 0:
-			return
-		
-		# 设置随机种子确保可重现性
-		random.seed(self.random_seed)
-		np.random.seed(self.random_seed)
-		
-		# 按类别组织数据
-		class_samples = defaultdict(list)
-		for i, (path, label) in enumerate(self.samples):
-			class_samples[label].append(i)
-		
-		train_indices = []
-		val_indices = []
-		
-		# 基于WebiNat长尾分布的分层策略（与5089相同）
-		for label, indices in class_samples.items():
-			class_size = len(indices)
-			
-			# WebiNat长尾分布适应策略
-			if class_size <= 50:       # 小类别（长尾部分）
-				val_ratio = 0.12      # 更保守的验证比例
-			elif class_size <= 200:    # 中等类别
-				val_ratio = 0.18      # 适中验证比例
-			else:                      # 大类别（头部类别）
-				val_ratio = 0.25      # 充分验证
-			
-			val_size = max(1, int(class_size * val_ratio))
-			
-			# 简单随机划分
-			random.shuffle(indices)
-			val_indices.extend(indices[:val_size])
-			train_indices.extend(indices[val_size:])
-		
-		# 根据标记选择对应数据集
-		if hasattr(self, 'is_validation') and self.is_validation:
-			self.samples = [self.samples[i] for i in val_indices]
-			print(f"WebiNat5000验证集划分完成: {len(self.samples)} 样本")
-		else:
-			self.samples = [self.samples[i] for i in train_indices]
-			print(f"WebiNat5000训练集划分完成: {len(self.samples)} 样本")
-	
+				self.samples = SampleTable.from_manifest(load_image_folder(self.data_dir, flat=True))
+
 	def __len__(self):
 		return len(self.samples)
 	
@@ -1115,10 +1074,9 @@ class WebiNat5000(VisionDataset):
 		path, target = self.samples[idx]
 		try:
 			img = self.loader(path)
-		except (OSError, IOError, PIL.UnidentifiedImageError) as e:
-			# 将错误信息写入日志文件而不是终端输出
-			error_msg = f"Corrupted image at index {idx}: {path} - {e}"
-			self._log_image_error(error_msg)
+		except (OSError, IOError, PIL.UnidentifiedImageError):
+			# 只累计次数，每个epoch汇总输出一次；损坏文件可用data.quarantine在构建数据集时预先隔离
+			self.image_errors.add()
 			
 			# 使用ImageNet RGB均值创建替代图像，确保数值稳定性
 			img = PIL.Image.new('RGB', (384, 384), (124, 116, 104))
@@ -1129,27 +1087,9 @@ class WebiNat5000(VisionDataset):
 			target = self.target_transform(target)
 		return img, target
 	
-	def _log_image_error(self, error_msg):
-		"""将图像错误信息记录到日志文件中，而不输出到终端"""
-		import os
-		import time
-		
-		timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-		log_dir = './output'
-		if hasattr(self, 'root'):
-			dataset_name = 'webinat5000'
-			log_dir = f'./output/{dataset_name}'
-		
-		os.makedirs(log_dir, exist_ok=True)
-		error_log_file = os.path.join(log_dir, 'image_errors.log')
-		try:
-			with open(error_log_file, 'a', encoding='utf-8') as f:
-				f.write(f"[{timestamp}] {error_msg}\n")
-		except:
-			pass
 
 
-class WebiNat5089(VisionDataset):
+class WebiNat5089(StratifiedSplitMixin, VisionDataset):
 	"""WebiNat-5089 Competition Dataset.
 	Args:
 		root (string): Root directory of the dataset.
@@ -1161,10 +1101,13 @@ class WebiNat5089(VisionDataset):
 			target and transforms it.
 	"""
 
+	val_ratio = staticmethod(webinat_val_ratio)
+
 	def __init__(self, root, train=True, transform=None, target_transform=None, val_split=0.0, random_seed=42):
 		super(WebiNat5089, self).__init__(root, transform=transform, target_transform=target_transform)
 		
 		self.loader = default_loader
+		self.image_errors = ImageErrorCounter()
 		self.train = train
 		self.val_split = val_split  # 验证集划分比例，0表示不划分
 		self.random_seed = random_seed
@@ -1178,7 +1121,7 @@ class WebiNat5089(VisionDataset):
 			label_file = os.path.join(self.root, 'test_WebiNat5089', 'val_shuffled_no_labels.txt')
 			self.data_dir = os.path.join(self.root, 'test_WebiNat5089', 'val_shuffled')
 		
-		self.samples = []
+		paths, labels = [], []
 		
 		with open(label_file, 'r') as f:
 			for line in f:
@@ -1193,59 +1136,19 @@ class WebiNat5089(VisionDataset):
 					# Convert Windows path to Unix path
 					img_path = img_path.replace('\\', '/')
 					img_path = os.path.join(self.data_dir, img_path)
-					self.samples.append((img_path, label))
+					paths.append(img_path)
+					labels.append(label)
 				else:
 					# Test format: path without label
 					img_path = line
 					img_path = os.path.join(self.data_dir, img_path)
 					# Use -1 as placeholder for test labels
-					self.samples.append((img_path, -1))
+					paths.append(img_path)
+					labels.append(-1)
 
-		# 注意：不在初始化时自动划分，避免嵌套划分问题
+		self.samples = SampleTable.from_lists(paths, labels)
 
-	def _split_train_val(self):
-		"""修复后的训练验证集划分：统一数据源，适应WebiNat5089长尾分布"""
-		if not self.train or self.val_split <= 0:
-			return
-		
-		# 设置随机种子确保可重现性
-		random.seed(self.random_seed)
-		np.random.seed(self.random_seed)
-		
-		# 按类别组织数据
-		class_samples = defaultdict(list)
-		for i, (path, label) in enumerate(self.samples):
-			class_samples[label].append(i)
-		
-		train_indices = []
-		val_indices = []
-		
-		# 基于WebiNat5089长尾分布的分层策略
-		for label, indices in class_samples.items():
-			class_size = len(indices)
-			
-			# WebiNat5089长尾分布适应策略
-			if class_size <= 50:       # 小类别（长尾部分）
-				val_ratio = 0.12      # 更保守的验证比例
-			elif class_size <= 200:    # 中等类别
-				val_ratio = 0.18      # 适中验证比例
-			else:                      # 大类别（头部类别）
-				val_ratio = 0.25      # 充分验证
-			
-			val_size = max(1, int(class_size * val_ratio))
-			
-			# 简单随机划分
-			random.shuffle(indices)
-			val_indices.extend(indices[:val_size])
-			train_indices.extend(indices[val_size:])
-		
-		# 根据标记选择对应数据集
-		if hasattr(self, 'is_validation') and self.is_validation:
-			self.samples = [self.samples[i] for i in val_indices]
-			print(f"WebiNat5089验证集划分完成: {len(self.samples)} 样本")
-		else:
-			self.samples = [self.samples[i] for i in train_indices]
-			print(f"WebiNat5089训练集划分完成: {len(self.samples)} 样本")
+		# 注意：不在初始化时自动划分，避免嵌套划分问题
 
 	def __len__(self):
 		return len(self.samples)
@@ -1254,10 +1157,9 @@ class WebiNat5089(VisionDataset):
 		path, target = self.samples[idx]
 		try:
 			img = self.loader(path)
-		except (OSError, IOError, PIL.UnidentifiedImageError) as e:
-			# 将错误信息写入日志文件而不是终端输出
-			error_msg = f"Corrupted image at index {idx}: {path} - {e}"
-			self._log_image_error(error_msg)
+		except (OSError, IOError, PIL.UnidentifiedImageError):
+			# 只累计次数，每个epoch汇总输出一次；损坏文件可用data.quarantine在构建数据集时预先隔离
+			self.image_errors.add()
 			
 			# 使用ImageNet RGB均值创建替代图像，确保数值稳定性
 			# ImageNet均值: [0.485, 0.456, 0.406] * 255 = [123.675, 116.28, 103.53]
@@ -1269,31 +1171,13 @@ class WebiNat5089(VisionDataset):
 			target = self.target_transform(target)
 		return img, target
 
-	def _log_image_error(self, error_msg):
-		"""将图像错误信息记录到日志文件中，而不输出到终端"""
-		import os
-		import time
-		
-		# 获取当前时间戳
-		timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-		
-		# 构建日志文件路径 - 使用与训练日志相同的目录
-		log_dir = './output'  # 默认输出目录
-		if hasattr(self, 'root'):
-			# 尝试构建更合适的日志目录
-			dataset_name = 'webinat5089' if 'WebiNat' in self.__class__.__name__ else 'dataset'
-			log_dir = f'./output/{dataset_name}'
-		
-		os.makedirs(log_dir, exist_ok=True)
-		
-		# 写入图像错误日志文件
-		error_log_file = os.path.join(log_dir, 'image_errors.log')
-		try:
-			with open(error_log_file, 'a', encoding='utf-8') as f:
-				f.write(f"[{timestamp}] {error_msg}\n")
-		except:
-			# 如果写入失败，静默忽略，确保训练不中断
-			pass
+
+def get_samples(dataset):
+	"""返回数据集的(path, label)样本表，兼容沿用torchvision私有属性名的数据集类"""
+	for name in ('samples', '_flat_breed_images', '_images', '_image_files'):
+		if hasattr(dataset, name):
+			return getattr(dataset, name)
+	raise AttributeError(f'{dataset.__class__.__name__} does not expose its samples')
 
 
 if __name__ == '__main__':
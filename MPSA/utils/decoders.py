@@ -0,0 +1,105 @@
+import io
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+	import cv2
+except ImportError:
+	cv2 = None
+
+try:
+	from torchvision.io import ImageReadMode, decode_jpeg
+except ImportError:
+	decode_jpeg = None
+
+DECODER_BACKENDS = ('pil', 'torchvision', 'opencv')
+_JPEG_MAGIC = b'\xff\xd8\xff'
+
+
+def _read(path):
+	with open(path, 'rb') as f:
+		return f.read()
+
+
+def pil_decode(data):
+	"""PNG等非JPEG格式以及其他后端失败时的回退解码"""
+	with Image.open(io.BytesIO(data)) as img:
+		return img.convert('RGB')
+
+
+def pil_loader(path):
+	with open(path, 'rb') as f:
+		img = Image.open(f)
+		return img.convert('RGB')
+
+
+def torchvision_loader(path):
+	"""JPEG使用libjpeg-turbo（torchvision.io.decode_jpeg）在CPU上解码，其他格式或解码失败时回退到PIL"""
+	data = _read(path)
+	if data[:3] == _JPEG_MAGIC:
+		try:
+			tensor = decode_jpeg(torch.frombuffer(bytearray(data), dtype=torch.uint8), mode=ImageReadMode.RGB)
+			return Image.fromarray(tensor.permute(1, 2, 0).numpy())
+		except RuntimeError:
+			pass
+	return pil_decode(data)
+
+
+def opencv_loader(path):
+	"""JPEG使用cv2.imdecode解码并转为RGB，其他格式或解码失败时回退到PIL
+
+	与PIL一致，不按EXIF方向旋转（IMREAD_IGNORE_ORIENTATION）。
+	"""
+	data = _read(path)
+	if data[:3] == _JPEG_MAGIC:
+		img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+		if img is not None:
+			return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+	return pil_decode(data)
+
+
+def available_backends():
+	backends = ['pil']
+	if decode_jpeg is not None:
+		backends.append('torchvision')
+	if cv2 is not None:
+		backends.append('opencv')
+	return backends
+
+
+def get_decoder(backend):
+	assert backend in DECODER_BACKENDS, f'Unknown decoder backend: {backend}'
+	if backend not in available_backends():
+		raise ImportError(f'Decoder backend {backend} is not available, install torchvision>=0.8 / opencv-python')
+	return {'pil': pil_loader, 'torchvision': torchvision_loader, 'opencv': opencv_loader}[backend]
+
+
+def select_decoder(paths, candidates=None, verbose=True):
+	"""在给定的样本上依次测试各解码后端，返回最快的后端名
+
+	先完整读取一遍文件，使各后端都从页缓存读取，只比较解码本身；任一后端出错的样本不计入比较。
+	"""
+	candidates = [b for b in (candidates or DECODER_BACKENDS) if b in available_backends()]
+	for path in paths:
+		try:
+			_read(path)
+		except OSError:
+			pass
+	timings = {}
+	for backend in candidates:
+		loader = get_decoder(backend)
+		tik = time.perf_counter()
+		for path in paths:
+			try:
+				loader(path)
+			except (OSError, ValueError):
+				pass
+		timings[backend] = time.perf_counter() - tik
+	best = min(timings, key=timings.get)
+	if verbose:
+		print('[Decoder] ' + '  '.join(f'{b}: {len(paths) / max(t, 1e-9):.0f} img/s' for b, t in timings.items()) +
+		      f' -> {best}')
+	return best
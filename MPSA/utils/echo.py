@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+
+
+def echo_augment(x, y, shift=0, mixup_alpha=0.):
+	"""回声batch的廉价batch级增强：打乱batch顺序、逐样本随机水平翻转与平移裁剪
+
+	y为硬标签时，主循环中的mixup/cutmix在打乱后的batch上重新配对；y为软标签时（data.mixup_collate，
+	worker中已完成混合）打乱顺序不会改变已有的配对，mixup_alpha > 0时再把打乱后的batch与其翻转按
+	Beta(mixup_alpha, mixup_alpha)采样的lam混合一次，图像与软标签同时混合；mixup_alpha为0时只有翻转与平移。
+	x为归一化后的NCHW张量，平移通过反射填充shift像素后逐样本随机取原尺寸窗口实现。
+	"""
+	batch_size, channels, height, width = x.shape
+	perm = torch.randperm(batch_size, device=x.device)
+	x, y = x[perm], y[perm]
+	if mixup_alpha > 0. and y.dim() == 2:
+		lam = float(np.random.beta(mixup_alpha, mixup_alpha))
+		x = x.mul(lam).add_(x.flip(0).mul(1. - lam))
+		y = y.mul(lam).add_(y.flip(0).mul(1. - lam))
+	flip = torch.rand(batch_size, device=x.device) < 0.5
+	x = torch.where(flip[:, None, None, None], x.flip(-1), x)
+	if shift > 0:
+		padded = F.pad(x, (shift, shift, shift, shift), mode='reflect')
+		top = torch.randint(0, 2 * shift + 1, (batch_size, 1), device=x.device)
+		left = torch.randint(0, 2 * shift + 1, (batch_size, 1), device=x.device)
+		rows = top + torch.arange(height, device=x.device)
+		cols = left + torch.arange(width, device=x.device)
+		x = padded[torch.arange(batch_size, device=x.device)[:, None, None, None],
+		           torch.arange(channels, device=x.device)[None, :, None, None],
+		           rows[:, None, :, None], cols[:, None, None, :]]
+	return x, y
+
+
+class EchoLoader:
+	"""数据回声：数据管线跟不上模型时，把每个新batch重复使用factor次，重复的batch由原batch经echo_augment生成
+
+	factor=0时自动选择：每个epoch的前probe个新batch不回声，测量等待数据的时间与每步计算时间，
+	之后按 (等待 + 计算) / 计算 取整（即加载一个batch的时间内模型能跑的步数）确定本epoch剩余部分的factor，
+	多卡时取各rank的最大值，保证每个rank的step数一致。
+	step为当前新batch在本epoch中的序号，progress为以新batch计的进度（回声batch为小数），用于学习率调度。
+	mixup_alpha: batch已在worker中混合（软标签）时回声batch重新混合使用的alpha，见echo_augment。
+	其余属性（dataset、sampler等）都转发给原loader。
+	"""
+
+	def __init__(self, loader, factor=0, max_factor=4, shift=0, probe=20, warmup=3, device=None, mixup_alpha=0.):
+		self.loader = loader
+		if device is None:
+			device = torch.device('cuda', torch.cuda.current_device()) if torch.cuda.is_available() else 'cpu'
+		self.device = device
+		self.auto = factor <= 0
+		self.factor = 1 if self.auto else factor
+		self.max_factor = max_factor
+		self.shift = shift
+		self.mixup_alpha = mixup_alpha
+		self.probe = probe
+		self.warmup = warmup
+		self.step = 0
+		self.progress = 0.
+		self.batches = 0
+		self.echoes = 0
+
+	def __len__(self):
+		return len(self.loader)
+
+	def __getattr__(self, name):
+		return getattr(self.__dict__['loader'], name)
+
+	def _choose_factor(self, wait, compute):
+		factor = min(max(int(round((wait + compute) / max(compute, 1e-6))), 1), self.max_factor)
+		if dist.is_available() and dist.is_initialized():
+			device = 'cuda' if dist.get_backend() == 'nccl' else 'cpu'
+			factor_tensor = torch.tensor([factor], device=device)
+			dist.all_reduce(factor_tensor, op=dist.ReduceOp.MAX)
+			factor = int(factor_tensor.item())
+		return factor
+
+	def __iter__(self):
+		probe = min(self.probe, len(self.loader) // 2)
+		wait, compute, measured, steps = 0., 0., 0, 0
+		iterator = iter(self.loader)
+		self.step = 0
+		if self.auto:
+			self.factor = 1
+		while True:
+			if self.auto and self.step == probe and measured:
+				self.factor = self._choose_factor(wait / measured, compute / steps)
+			tik = time.perf_counter()
+			try:
+				x, y = next(iterator)
+			except StopIteration:
+				return
+			# 回声增强在模型所在设备上完成；mixup会原地修改输入，重复使用时每次都从未修改的副本生成
+			x = x.to(self.device, non_blocking=True)
+			y = y.to(self.device, non_blocking=True)
+			factor = self.factor
+			measure = self.auto and self.warmup <= self.step < probe
+			if measure:
+				wait += time.perf_counter() - tik
+				measured += 1
+			self.batches += 1
+			for echo in range(factor):
+				self.progress = self.step + (echo + 1) / factor
+				if echo > 0:
+					self.echoes += 1
+					batch = echo_augment(x, y, self.shift, self.mixup_alpha)
+				else:
+					batch = (x.clone(), y) if factor > 1 else (x, y)
+				tik = time.perf_counter()
+				yield batch
+				if measure:
+					compute += time.perf_counter() - tik
+					steps += 1
+			self.step += 1
+
+	def pop(self):
+		"""返回(新batch数, 回声batch数)并清零"""
+		batches, echoes = self.batches, self.echoes
+		self.batches, self.echoes = 0, 0
+		return batches, echoes
@@ -1,5 +1,6 @@
 import math
 import os
+import random
 import time
 
 import numpy as np
@@ -63,6 +64,63 @@ def save_checkpoint(config, epoch, model, max_accuracy, optimizer, lr_scheduler,
 	print("----- Saved model checkpoint to", config.data.log_path, '-----')
 
 
+def rng_state():
+	return {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state(),
+	        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else []}
+
+
+def set_rng_state(state):
+	random.setstate(state['python'])
+	np.random.set_state(state['numpy'])
+	torch.set_rng_state(state['torch'])
+	if state['cuda'] and torch.cuda.is_available():
+		torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def _atomic_save(state, path):
+	# 先写临时文件再重命名，写入过程中被抢占也不会损坏上一个检查点
+	torch.save(state, f'{path}.tmp')
+	os.replace(f'{path}.tmp', path)
+
+
+def resume_rank_file(resume_path, rank):
+	return os.path.join(os.path.dirname(resume_path), f'last.rank{max(rank, 0)}.bin')
+
+
+def save_resume_checkpoint(config, epoch, step, model, optimizer, lr_scheduler, loss_scaler, sampler, max_accuracy):
+	"""保存step级可恢复检查点：rank 0写last.bin（模型/优化器/调度器/scaler），每个rank写自己的RNG状态与sampler位置"""
+	save_path = os.path.join(config.data.log_path, 'last.bin')
+	if config.local_rank in [-1, 0]:
+		_atomic_save({'model': model.state_dict(),
+		              'optimizer': optimizer.state_dict(),
+		              'lr_scheduler': lr_scheduler.state_dict(),
+		              'max_accuracy': max_accuracy,
+		              'scaler': loss_scaler.state_dict(),
+		              'epoch': epoch,
+		              'step': step,
+		              'config': config}, save_path)
+	rank_state = {'epoch': epoch, 'step': step, 'rng': rng_state(),
+	              'sampler': sampler.state_dict(step * config.data.batch_size) if hasattr(sampler, 'state_dict') else None}
+	_atomic_save(rank_state, resume_rank_file(save_path, config.local_rank))
+
+
+def load_resume_state(config, sampler):
+	"""在训练循环开始前恢复本rank的RNG状态与sampler位置（放在恢复后的验证之后，验证不会打乱RNG）"""
+	if not config.model.resume or config.train.start_step <= 0:
+		return
+	rank_file = resume_rank_file(config.model.resume, config.local_rank)
+	state = torch.load(rank_file, map_location='cpu', weights_only=False) if os.path.isfile(rank_file) else None
+	resumed = state is not None and state['sampler'] is not None and hasattr(sampler, 'load_state_dict') \
+		and sampler.load_state_dict(state['sampler'])
+	if state is not None:
+		set_rng_state(state['rng'])
+	if not resumed:
+		print(f'----- 无法恢复epoch内的数据位置，epoch {config.train.start_epoch + 1} 将从头开始 -----')
+		config.defrost()
+		config.train.start_step = 0
+		config.freeze()
+
+
 def save_preds(preds, y, all_preds=None, all_label=None, ):
 	if all_preds is None:
 		all_preds = preds.clone().detach()
@@ -76,7 +134,7 @@ def save_preds(preds, y, all_preds=None, all_label=None, ):
 def load_checkpoint(config, model, optimizer, scheduler, loss_scaler, log):
 	if config.local_rank in [-1, 0]:
 		print('-' * 18, f'Resuming form \'{config.model.resume} \''.center(42), '-' * 18)
-	checkpoint = torch.load(config.model.resume, map_location='cpu')
+	checkpoint = torch.load(config.model.resume, map_location='cpu', weights_only=False)
 	state_dicts = {k.replace('module.', ''): v for k, v in checkpoint['model'].items()}
 	state_dicts = {k.replace('_orig_mod.', ''): v for k, v in state_dicts.items()}
 	msg = model.load_state_dict(state_dicts, strict=True)
@@ -84,15 +142,25 @@ def load_checkpoint(config, model, optimizer, scheduler, loss_scaler, log):
 	log.info(msg)
 	max_accuracy = 0.0
 	if 'optimizer' in checkpoint and 'lr_scheduler' in checkpoint and 'epoch' in checkpoint:
-		# optimizer.load_state_dict(checkpoint['optimizer'])
+		try:
+			optimizer.load_state_dict(checkpoint['optimizer'])
+		except ValueError as e:
+			# 参数分组与检查点不一致（如更换了冻结策略）时只恢复权重
+			log.info(f'Optimizer state not restored: {e}')
 		scheduler.load_state_dict(checkpoint['lr_scheduler'])
 		config.defrost()
-		config.train.start_epoch = checkpoint['epoch'] + 1
+		if 'step' in checkpoint:
+			# step级检查点（last.bin）：从中断的epoch的下一个batch继续
+			config.train.start_epoch = checkpoint['epoch']
+			config.train.start_step = checkpoint['step']
+		else:
+			config.train.start_epoch = checkpoint['epoch'] + 1
 		config.freeze()
 		if 'scaler' in checkpoint:
 			loss_scaler.load_state_dict(checkpoint['scaler'])
 		if config.local_rank in [-1, 0]:
-			print('-' * 10, f"Loaded Successfully '{config.model.resume}' Epoch {checkpoint['epoch'] + 1}".center(58),
+			print('-' * 10, f"Loaded Successfully '{config.model.resume}' Epoch {checkpoint['epoch'] + 1}"
+			                f"{' Step ' + str(checkpoint['step']) if 'step' in checkpoint else ''}".center(58),
 			      '-' * 10)
 		if 'max_accuracy' in checkpoint:
 			max_accuracy = checkpoint['max_accuracy']
@@ -0,0 +1,119 @@
+import atexit
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+
+from utils.gpu_aug import ToUint8Tensor
+
+
+def split_transform(transform):
+	"""把测试变换拆成确定性的PIL部分（可缓存）与张量化部分（ToTensor/Normalize或ToUint8Tensor）"""
+	# 保留原Compose的类型（如InstrumentedCompose）
+	compose = type(transform) if isinstance(transform, transforms.Compose) else transforms.Compose
+	steps = transform.transforms if isinstance(transform, transforms.Compose) else [transform]
+	for i, step in enumerate(steps):
+		if isinstance(step, (transforms.ToTensor, ToUint8Tensor)):
+			return compose(steps[:i]), compose(steps[i:])
+	return compose(steps), None
+
+
+def default_cache_dir():
+	return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class CachedEvalDataset:
+	"""验证集变换结果缓存：第一次验证时把Resize/CenterCrop后的uint8图像写入共享内存映射文件，
+	之后的验证直接读取，跳过解码与缩放
+
+	容量不足以放下整个验证集时，每个进程最先访问的capacity个样本常驻缓存，其余样本每次解码。
+	验证按固定顺序遍历，LRU或按位置取模覆盖的策略在每一遍都会在读到之前把缓存全部替换掉，命中率为0；
+	固定子集则保证每一遍有capacity个命中。每个槽位只对应一个样本且只写一次，无需加锁。
+
+	Args:
+		dataset: 原验证集，其transform应只包含确定性的PIL变换
+		post_transform: 读取缓存后执行的张量化变换
+		shape: 缓存图像的(H, W, 3)，尺寸不一致的样本不缓存
+		max_bytes: 本进程缓存文件大小上限
+		indices: 本进程验证时访问的样本序号（即验证sampler的输出），决定样本在缓存中的位置，默认全部样本
+		rank: 用于区分各进程的缓存文件
+	"""
+
+	def __init__(self, dataset, post_transform, shape, max_bytes, cache_dir='', indices=None, rank=0):
+		self.dataset = dataset
+		self.post_transform = post_transform
+		self.shape = tuple(shape)
+		self.rank = max(rank, 0)
+		indices = np.arange(len(dataset)) if indices is None else np.asarray(indices, dtype=np.int64)
+		self.positions = np.full(len(dataset), -1, dtype=np.int64)
+		self.positions[indices] = np.arange(len(indices))
+		sample_bytes = int(np.prod(self.shape))
+		self.capacity = int(max(min(len(indices), max_bytes // sample_bytes), 0))
+
+		# 每次运行新建缓存文件，不跨运行复用，避免原始图像变化后读到过期内容
+		prefix = os.path.join(cache_dir or default_cache_dir(), f'mpsa_eval_{os.getpid()}_{self.rank}')
+		self.data_file, self.tag_file = f'{prefix}.u8', f'{prefix}.tag'
+		if self.capacity > 0:
+			np.memmap(self.data_file, dtype=np.uint8, mode='w+', shape=(self.capacity,) + self.shape).flush()
+			# tag: [样本序号 + 1（0表示空）, 标签]
+			np.memmap(self.tag_file, dtype=np.int64, mode='w+', shape=(self.capacity, 2)).flush()
+			atexit.register(self._cleanup, os.getpid())
+		self._data, self._tags = None, None
+
+	def _cleanup(self, owner):
+		if os.getpid() != owner:
+			return
+		for path in (self.data_file, self.tag_file):
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+	def __len__(self):
+		return len(self.dataset)
+
+	def __getattr__(self, name):
+		# samples/classes等属性转发给原数据集
+		if name == 'dataset':
+			raise AttributeError(name)
+		return getattr(self.dataset, name)
+
+	def _open(self):
+		# 在worker进程内首次访问时再建立内存映射
+		if self._data is None:
+			self._data = np.memmap(self.data_file, dtype=np.uint8, mode='r+', shape=(self.capacity,) + self.shape)
+			self._tags = np.memmap(self.tag_file, dtype=np.int64, mode='r+', shape=(self.capacity, 2))
+
+	def _slot(self, idx):
+		pos = self.positions[idx]
+		return pos if 0 <= pos < self.capacity else None
+
+	def _read(self, slot, idx):
+		if self._tags[slot, 0] != idx + 1:
+			return None
+		return np.array(self._data[slot]), int(self._tags[slot, 1])
+
+	def _write(self, slot, idx, img, target):
+		# 先写数据再写tag，tag非空时数据一定完整
+		self._data[slot] = img
+		self._tags[slot, 1] = target
+		self._tags[slot, 0] = idx + 1
+
+	def __getitem__(self, idx):
+		slot = self._slot(idx) if self.capacity > 0 else None
+		cached = None
+		if slot is not None:
+			self._open()
+			cached = self._read(slot, idx)
+		if cached is not None:
+			img, target = Image.fromarray(cached[0]), cached[1]
+		else:
+			img, target = self.dataset[idx]
+			arr = np.asarray(img)
+			if slot is not None and arr.shape == self.shape and isinstance(target, (int, np.integer)):
+				self._write(slot, idx, arr, int(target))
+		if self.post_transform is not None:
+			img = self.post_transform(img)
+		return img, target
@@ -0,0 +1,170 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+
+try:
+	import fcntl
+except ImportError:  # Windows下num_workers为0，淘汰只在本进程中进行，无需跨进程加锁
+	fcntl = None
+
+
+class FileCache:
+	"""网络盘数据集的本地读穿透文件缓存：首次读取时把原始文件复制到cache_dir，之后直接读本地副本
+
+	文件先复制为临时文件再os.replace原子替换，同一主机上的多个worker/rank共享同一目录时不会读到半个文件；
+	命中时更新副本的mtime，总大小超过max_bytes时由一个进程（flock非阻塞获取.lock）按mtime从旧到新淘汰到90%。
+	源文件视为不可变，内容变化后需手动清空缓存目录。命中/未命中计数放在共享内存中，worker累加、主进程读取并清零。
+	"""
+
+	def __init__(self, cache_dir, max_bytes, check_ratio=0.01):
+		self.cache_dir = cache_dir
+		self.max_bytes = int(max_bytes)
+		self.check_bytes = max(int(self.max_bytes * check_ratio), 1)
+		self.lock_file = os.path.join(cache_dir, '.lock')
+		os.makedirs(cache_dir, exist_ok=True)
+		# [命中次数, 未命中次数, 复制的字节数, 自上次检查容量以来新增的字节数]
+		self._stats = multiprocessing.Array('q', 4)
+		self._warmup_thread = None
+		self.evict()
+
+	def local_path(self, path):
+		digest = hashlib.sha1(os.path.abspath(path).encode('utf-8', 'surrogateescape')).hexdigest()
+		return os.path.join(self.cache_dir, digest[:2], digest[2:] + os.path.splitext(path)[1])
+
+	def _add(self, hits=0, misses=0, nbytes=0):
+		with self._stats.get_lock():
+			self._stats[0] += hits
+			self._stats[1] += misses
+			self._stats[2] += nbytes
+			self._stats[3] += nbytes
+			check = self._stats[3] >= self.check_bytes
+			if check:
+				self._stats[3] = 0
+		return check
+
+	def _copy(self, path, local):
+		os.makedirs(os.path.dirname(local), exist_ok=True)
+		tmp_path = f'{local}.tmp{os.getpid()}_{threading.get_ident()}'
+		try:
+			shutil.copyfile(path, tmp_path)
+			os.replace(tmp_path, local)
+		except OSError:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+		return os.path.getsize(local)
+
+	def fetch(self, path):
+		"""返回可读取的本地副本路径；缓存目录写入失败（如磁盘已满）时返回原路径"""
+		local = self.local_path(path)
+		try:
+			os.utime(local)
+			self._add(hits=1)
+			return local
+		except FileNotFoundError:
+			pass
+		try:
+			nbytes = self._copy(path, local)
+		except OSError:
+			return path
+		if self._add(misses=1, nbytes=nbytes):
+			self.evict()
+		return local
+
+	def _entries(self):
+		entries = []
+		for sub in os.scandir(self.cache_dir):
+			if not sub.is_dir():
+				continue
+			for entry in os.scandir(sub.path):
+				try:
+					st = entry.stat()
+				except FileNotFoundError:
+					continue
+				if '.tmp' in entry.name:
+					# 复制中途被终止的进程留下的临时文件
+					if time.time() - st.st_mtime > 3600:
+						self._remove(entry.path)
+					continue
+				entries.append((st.st_mtime, st.st_size, entry.path))
+		return entries
+
+	@staticmethod
+	def _remove(path):
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+	def evict(self, low_watermark=0.9):
+		"""总大小超过max_bytes时按mtime从旧到新删除到max_bytes * low_watermark；其他进程正在淘汰时直接返回"""
+		with open(self.lock_file, 'a') as lock:
+			try:
+				if fcntl is not None:
+					fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except OSError:
+				return
+			entries = self._entries()
+			total = sum(size for _, size, _ in entries)
+			if total <= self.max_bytes:
+				return
+			entries.sort()
+			for _, size, path in entries:
+				if total <= self.max_bytes * low_watermark:
+					break
+				self._remove(path)
+				total -= size
+
+	def warmup(self, paths, max_fraction=0.9):
+		"""后台线程按顺序预先复制paths中的文件（不计入命中/未命中），复制量达到容量的max_fraction后停止"""
+
+		def _run():
+			copied = 0
+			for path in paths:
+				if copied >= self.max_bytes * max_fraction:
+					break
+				local = self.local_path(path)
+				if os.path.exists(local):
+					continue
+				try:
+					nbytes = self._copy(path, local)
+				except OSError:
+					continue
+				copied += nbytes
+				if self._add(nbytes=nbytes):
+					self.evict()
+			print(f'[FileCache] 预热完成，复制 {copied / 2 ** 30:.2f} GiB 到 {self.cache_dir}')
+
+		self._warmup_thread = threading.Thread(target=_run, name='file-cache-warmup', daemon=True)
+		self._warmup_thread.start()
+		return self._warmup_thread
+
+	def pop(self):
+		"""返回(命中次数, 未命中次数, 复制的字节数（含预热）)并清零"""
+		with self._stats.get_lock():
+			hits, misses, nbytes = self._stats[0], self._stats[1], self._stats[2]
+			self._stats[0] = self._stats[1] = self._stats[2] = 0
+		return hits, misses, nbytes
+
+
+class CachedLoader:
+	"""包装图像加载函数：从FileCache的本地副本读取，副本在取得路径后被淘汰时回退到原文件"""
+
+	def __init__(self, loader, cache):
+		self.loader = loader
+		self.cache = cache
+
+	def __call__(self, path):
+		local = self.cache.fetch(path)
+		try:
+			return self.loader(local)
+		except FileNotFoundError:
+			if local == path:
+				raise
+			return self.loader(path)
+
+	def __repr__(self):
+		return f'{self.__class__.__name__}({self.loader!r}, {self.cache.cache_dir})'
@@ -0,0 +1,172 @@
+import json
+import os
+import time
+import hashlib
+
+import numpy as np
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+_MAGIC = b'MPSAIDX1'
+_ALIGN = 64
+MANIFEST_VERSION = 1
+
+
+def save_arrays(path, arrays, meta=None):
+	"""将若干numpy数组写入单个可内存映射的二进制文件（先写临时文件再原子替换）"""
+	header = {'meta': meta or {}, 'arrays': {}}
+	offset = 0
+	for name, arr in arrays.items():
+		arr = np.ascontiguousarray(arr)
+		header['arrays'][name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+		offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+	layout = header['arrays']
+	header = json.dumps(header).encode('utf-8')
+	data_start = -(-(16 + len(header)) // _ALIGN) * _ALIGN
+
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	tmp_path = f'{path}.tmp{os.getpid()}'
+	with open(tmp_path, 'wb') as f:
+		f.write(_MAGIC)
+		f.write(np.uint64(len(header)).tobytes())
+		f.write(header)
+		for name, arr in arrays.items():
+			f.seek(data_start + layout[name]['offset'])
+			f.write(np.ascontiguousarray(arr).tobytes())
+		f.truncate(max(f.tell(), data_start + offset))
+	os.replace(tmp_path, path)
+
+
+def load_arrays(path, mmap=True):
+	"""读取save_arrays写出的文件，返回(arrays, meta)；mmap=True时数组为只读内存映射视图"""
+	with open(path, 'rb') as f:
+		if f.read(8) != _MAGIC:
+			raise ValueError(f'Not a valid index file: {path}')
+		header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+		header = json.loads(f.read(header_len).decode('utf-8'))
+		data_start = -(-(16 + header_len) // _ALIGN) * _ALIGN
+		if mmap:
+			buffer = np.memmap(path, dtype=np.uint8, mode='r')
+		else:
+			f.seek(0)
+			buffer = np.frombuffer(f.read(), dtype=np.uint8)
+
+	arrays = {}
+	for name, info in header['arrays'].items():
+		dtype = np.dtype(info['dtype'])
+		count = int(np.prod(info['shape'])) if info['shape'] else 1
+		start = data_start + info['offset']
+		arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(info['shape'])
+	return arrays, header['meta']
+
+
+def encode_strings(strings):
+	"""字符串列表 -> (连续utf-8字节缓冲, int64偏移数组)，偏移长度为len+1"""
+	encoded = [s.encode('utf-8', 'surrogateescape') for s in strings]
+	offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+	if encoded:
+		np.cumsum([len(b) for b in encoded], out=offsets[1:])
+	return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def decode_string(buffer, offsets, idx):
+	return bytes(buffer[offsets[idx]:offsets[idx + 1]]).decode('utf-8', 'surrogateescape')
+
+
+def cache_path_for(data_dir, suffix='manifest', cache_dir=None):
+	"""索引文件默认放在数据目录旁边（如 train/ -> .train.manifest）；目录不可写时退回 ~/.cache/mpsa"""
+	data_dir = os.path.abspath(data_dir)
+	parent, name = os.path.split(data_dir.rstrip(os.sep))
+	if cache_dir is None and os.access(parent, os.W_OK):
+		return os.path.join(parent, f'.{name}.{suffix}')
+	cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'mpsa')
+	digest = hashlib.md5(data_dir.encode('utf-8')).hexdigest()[:12]
+	return os.path.join(cache_dir, f'{name}-{digest}.{suffix}')
+
+
+def _dir_mtimes(data_dir, dir_names):
+	mtimes = np.empty(len(dir_names) + 1, dtype=np.int64)
+	mtimes[0] = os.stat(data_dir).st_mtime_ns
+	for i, name in enumerate(dir_names):
+		mtimes[i + 1] = os.stat(os.path.join(data_dir, name)).st_mtime_ns
+	return mtimes
+
+
+class ImageFolderManifest:
+	"""ImageFolder风格目录的样本清单：相对路径、标签、文件大小与修改时间
+
+	flat=False: data_dir/<class>/*.jpg，类别序号按sorted(os.listdir)顺序分配
+	flat=True : data_dir/*.jpg（无标签测试集），标签统一为-1
+	"""
+
+	def __init__(self, data_dir, arrays, meta):
+		self.data_dir = data_dir
+		self.path_buffer = arrays['path_buffer']
+		self.path_offsets = arrays['path_offsets']
+		self.labels = arrays['labels']
+		self.sizes = arrays['sizes']
+		self.mtimes = arrays['mtimes']
+		self.classes = meta.get('classes', [])
+
+	def __len__(self):
+		return len(self.labels)
+
+	def path(self, idx):
+		return os.path.join(self.data_dir, decode_string(self.path_buffer, self.path_offsets, idx))
+
+	def samples(self):
+		return [(self.path(i), int(self.labels[i])) for i in range(len(self))]
+
+	@staticmethod
+	def scan(data_dir, flat=False, extensions=IMG_EXTENSIONS):
+		from utils.scanner import scan_image_folder
+		classes, dir_names, rel_paths, labels, sizes, mtimes = scan_image_folder(data_dir, flat, extensions)
+
+		path_buffer, path_offsets = encode_strings(rel_paths)
+		arrays = {'path_buffer': path_buffer,
+		          'path_offsets': path_offsets,
+		          'labels': np.asarray(labels, dtype=np.int32),
+		          'sizes': np.asarray(sizes, dtype=np.int64),
+		          'mtimes': np.asarray(mtimes, dtype=np.int64)}
+		arrays['dir_mtimes'] = _dir_mtimes(data_dir, dir_names)
+		dir_buffer, dir_offsets = encode_strings(dir_names)
+		arrays['dir_buffer'], arrays['dir_offsets'] = dir_buffer, dir_offsets
+		meta = {'version': MANIFEST_VERSION, 'flat': flat, 'extensions': list(extensions), 'classes': classes}
+		return arrays, meta
+
+	@staticmethod
+	def is_valid(data_dir, arrays, meta, flat, extensions):
+		"""只stat根目录与各类别目录：新增/删除文件都会改变所在目录的mtime"""
+		if meta.get('version') != MANIFEST_VERSION or meta.get('flat') != flat \
+				or tuple(meta.get('extensions', ())) != tuple(extensions):
+			return False
+		dir_names = [decode_string(arrays['dir_buffer'], arrays['dir_offsets'], i)
+		             for i in range(len(arrays['dir_offsets']) - 1)]
+		try:
+			return np.array_equal(_dir_mtimes(data_dir, dir_names), arrays['dir_mtimes'])
+		except OSError:
+			return False
+
+
+def load_image_folder(data_dir, flat=False, extensions=IMG_EXTENSIONS, cache_dir=None):
+	"""读取（或首次扫描并写入）data_dir的样本清单
+
+	命中缓存时只需一次文件读取 + 每个类别目录一次stat；目录有变化时重新扫描并覆盖缓存。
+	"""
+	manifest_file = cache_path_for(data_dir, 'manifest', cache_dir)
+	if os.path.isfile(manifest_file):
+		try:
+			arrays, meta = load_arrays(manifest_file)
+			if ImageFolderManifest.is_valid(data_dir, arrays, meta, flat, extensions):
+				return ImageFolderManifest(data_dir, arrays, meta)
+		except (OSError, ValueError, KeyError):
+			pass
+
+	tik = time.time()
+	arrays, meta = ImageFolderManifest.scan(data_dir, flat, extensions)
+	try:
+		save_arrays(manifest_file, arrays, meta)
+	except OSError as e:
+		print(f'[Manifest] 无法写入样本清单 {manifest_file}: {e}')
+	print(f'[Manifest] 扫描 {data_dir}: {len(arrays["labels"])} 样本, 耗时 {time.time() - tik:.1f}s')
+	return ImageFolderManifest(data_dir, arrays, meta)
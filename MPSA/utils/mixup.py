@@ -0,0 +1,97 @@
+import math
+import multiprocessing
+
+import numpy as np
+import torch
+from torch.utils.data import default_collate, get_worker_info
+
+
+def mixup_target(target, num_classes, lam=1., smoothing=0.):
+	"""与timm.data.mixup.mixup_target相同的软标签：标签平滑后的one-hot按lam与batch翻转后的标签混合"""
+	off_value = smoothing / num_classes
+	on_value = 1. - smoothing + off_value
+	y1 = torch.full((target.size(0), num_classes), off_value).scatter_(1, target.long()[:, None], on_value)
+	return y1 * lam + y1.flip(0) * (1. - lam)
+
+
+def cutmix_bbox(height, width, lam, rng):
+	"""面积约为 (1 - lam) 的随机裁剪框(上, 下, 左, 右)，中心均匀分布，超出图像的部分截断"""
+	cut_ratio = math.sqrt(1. - lam)
+	cut_h, cut_w = int(height * cut_ratio), int(width * cut_ratio)
+	cy, cx = int(rng.integers(0, height)), int(rng.integers(0, width))
+	top, bottom = np.clip(cy - cut_h // 2, 0, height), np.clip(cy + cut_h // 2, 0, height)
+	left, right = np.clip(cx - cut_w // 2, 0, width), np.clip(cx + cut_w // 2, 0, width)
+	return int(top), int(bottom), int(left), int(right)
+
+
+class MixupCollate:
+	"""在DataLoader worker中完成mixup/cutmix的collate_fn，batch级行为与timm.data.Mixup（mode='batch'）一致
+
+	每个batch按prob决定是否混合，两者都开启时按switch_prob选择cutmix，样本与batch翻转后的同位置样本配对；
+	cutmix按实际裁剪面积修正lam。输入可以是归一化后的float NCHW图像，也可以是data.gpu_aug下的uint8 NHWC图像
+	（channels_last=True，混合后取整）。
+	返回的软标签可直接用于SoftTargetCrossEntropy。
+	随机数由(seed, rank, epoch, batch序号)确定：DataLoader按顺序把第b个batch分给第b % num_workers个worker，
+	因此结果与worker数无关；set_epoch写入共享内存，常驻worker也能看到，从step级检查点恢复时传入start_step即可复现。
+	"""
+
+	def __init__(self, mixup_alpha, cutmix_alpha, num_classes, label_smoothing=0., prob=1., switch_prob=0.5,
+	             seed=0, rank=0, channels_last=False, collate_fn=default_collate):
+		self.mixup_alpha = mixup_alpha
+		self.cutmix_alpha = cutmix_alpha
+		self.num_classes = num_classes
+		self.label_smoothing = label_smoothing
+		self.prob = prob
+		self.switch_prob = switch_prob
+		self.seed = seed
+		self.rank = rank
+		self.channels_last = channels_last
+		self.collate_fn = collate_fn
+		# [epoch, 本epoch的起始batch序号]
+		self._epoch = multiprocessing.Array('q', 2)
+		self._seen = None
+		self._count = 0
+
+	def set_epoch(self, epoch, start_step=0):
+		with self._epoch.get_lock():
+			self._epoch[0], self._epoch[1] = epoch, start_step
+
+	def _batch_rng(self):
+		epoch, start_step = self._epoch[:]
+		if self._seen != (epoch, start_step):
+			self._seen, self._count = (epoch, start_step), 0
+		info = get_worker_info()
+		worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+		batch_index = start_step + self._count * num_workers + worker_id
+		self._count += 1
+		return np.random.default_rng([self.seed, self.rank, epoch, batch_index])
+
+	def _params(self, rng):
+		"""返回(lam, 是否cutmix)"""
+		if rng.random() >= self.prob:
+			return 1., False
+		use_cutmix = self.cutmix_alpha > 0. and (self.mixup_alpha <= 0. or rng.random() < self.switch_prob)
+		alpha = self.cutmix_alpha if use_cutmix else self.mixup_alpha
+		return float(rng.beta(alpha, alpha)), use_cutmix
+
+	def __call__(self, batch):
+		x, y = self.collate_fn(batch)
+		rng = self._batch_rng()
+		lam, use_cutmix = self._params(rng)
+		if lam < 1. and use_cutmix:
+			height, width = x.shape[1:3] if self.channels_last else x.shape[-2:]
+			top, bottom, left, right = cutmix_bbox(height, width, lam, rng)
+			region = (slice(None), slice(top, bottom), slice(left, right)) if self.channels_last else \
+				(Ellipsis, slice(top, bottom), slice(left, right))
+			x[region] = x.flip(0)[region]
+			lam = 1. - (bottom - top) * (right - left) / (height * width)
+		elif lam < 1.:
+			if x.dtype == torch.uint8:
+				x = x.float().mul_(lam).add_(x.flip(0).float().mul_(1. - lam)).round_().to(torch.uint8)
+			else:
+				x = x.mul(lam).add_(x.flip(0).mul(1. - lam))
+		return x, mixup_target(y, self.num_classes, lam, self.label_smoothing)
+
+	def __repr__(self):
+		return (f'{self.__class__.__name__}(mixup_alpha={self.mixup_alpha}, cutmix_alpha={self.cutmix_alpha}, '
+		        f'prob={self.prob}, switch_prob={self.switch_prob}, label_smoothing={self.label_smoothing})')
@@ -0,0 +1,143 @@
+import os
+import time
+
+import numpy as np
+import PIL
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision.datasets.folder import default_loader
+
+from utils.manifest import save_arrays, load_arrays, encode_strings
+from utils.sample_table import SampleTable, load_pruned_indices
+
+
+def packed_paths(prefix):
+	"""打包文件由两部分组成：<prefix>.u8（像素数据）与 <prefix>.index（偏移/形状/标签/原始路径）"""
+	return f'{prefix}.u8', f'{prefix}.index'
+
+
+class _ResizeForPacking(Dataset):
+	"""打包时使用的中间数据集：解码并缩放到 resize x resize，返回uint8 HWC数组"""
+
+	def __init__(self, samples, resize, loader=default_loader):
+		self.samples = samples
+		self.resize = resize
+		self.loader = loader
+
+	def __len__(self):
+		return len(self.samples)
+
+	def __getitem__(self, idx):
+		path, label = self.samples[idx]
+		try:
+			img = self.loader(path)
+		except (OSError, IOError, PIL.UnidentifiedImageError):
+			img = PIL.Image.new('RGB', (self.resize, self.resize), (124, 116, 104))
+		img = img.resize((self.resize, self.resize), Image.BICUBIC)
+		return np.array(img, dtype=np.uint8), label, idx
+
+
+def pack_dataset(samples, prefix, resize, num_workers=8, meta=None, loader=default_loader):
+	"""将样本表中的所有图像预先缩放到(resize, resize)并写入单个内存映射文件
+
+	Args:
+		samples: 支持samples[idx] -> (path, label)的样本表
+		prefix: 输出文件前缀
+		resize: 目标边长，应与config.data.resize一致
+		meta: 额外写入索引的信息（如数据集名、类别数、划分参数）
+		loader: 图像加载函数，可传入draft模式的加载函数加速大图解码
+	"""
+	data_file, index_file = packed_paths(prefix)
+	os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+	num_samples = len(samples)
+	sample_bytes = resize * resize * 3
+	offsets = np.arange(num_samples, dtype=np.int64) * sample_bytes
+	data = np.memmap(f'{data_file}.tmp', dtype=np.uint8, mode='w+',
+	                 shape=(num_samples * sample_bytes,)) if num_samples else None
+
+	paths, labels = [], np.empty(num_samples, dtype=np.int32)
+	for i in range(num_samples):
+		paths.append(samples[i][0])
+	loader = DataLoader(_ResizeForPacking(samples, resize, loader), batch_size=None, shuffle=False,
+	                    num_workers=num_workers)
+	tik = time.time()
+	for step, (img, label, idx) in enumerate(loader):
+		data[offsets[idx]:offsets[idx] + sample_bytes] = np.asarray(img).reshape(-1)
+		labels[idx] = label
+		if (step + 1) % 10000 == 0:
+			print(f'[Pack] {step + 1}/{num_samples} ({(step + 1) / (time.time() - tik):.0f} img/s)')
+	if data is not None:
+		data.flush()
+		del data
+		os.replace(f'{data_file}.tmp', data_file)
+
+	path_buffer, path_offsets = encode_strings(paths)
+	arrays = {'offsets': offsets,
+	          'shapes': np.tile(np.array([resize, resize, 3], dtype=np.int32), (num_samples, 1)),
+	          'labels': labels,
+	          'path_buffer': path_buffer,
+	          'path_offsets': path_offsets}
+	save_arrays(index_file, arrays, dict(meta or {}, resize=resize))
+	print(f'[Pack] {prefix}: {num_samples} 样本, {num_samples * sample_bytes / 2 ** 30:.1f} GiB, '
+	      f'耗时 {time.time() - tik:.0f}s')
+
+
+class PackedImageDataset(Dataset):
+	"""读取pack_dataset生成的预缩放图像，__getitem__只做一次连续内存拷贝，无需JPEG解码
+
+	Args:
+		prefix (string): 打包文件前缀（不含扩展名）
+		transform (callable, optional): 作用于PIL图像的变换（图像已是resize x resize，无需再Resize）
+		target_transform (callable, optional): 作用于标签的变换
+	"""
+
+	def __init__(self, prefix, transform=None, target_transform=None):
+		self.prefix = prefix
+		self.transform = transform
+		self.target_transform = target_transform
+		data_file, index_file = packed_paths(prefix)
+		arrays, self.meta = load_arrays(index_file)
+		self.offsets = arrays['offsets']
+		self.shapes = arrays['shapes']
+		self.labels = arrays['labels']
+		path_offsets = arrays['path_offsets']
+		self.samples = SampleTable(arrays['path_buffer'], path_offsets[:-1], path_offsets[1:], self.labels)
+		self.data_file = data_file
+		# data.prune_index剪枝后保留的样本在打包文件中的序号，None表示使用全部样本
+		self.indices = None
+		self._data = None
+
+	def __len__(self):
+		return len(self.indices) if self.indices is not None else len(self.labels)
+
+	def prune(self, index_file, keep, skip=0.):
+		"""按tools/prune_scores.py写出的分数剪枝，分数文件须由打包时的同一训练集划分生成"""
+		digest = self.meta.get('digest')
+		if digest is None:
+			raise ValueError(f'{self.prefix} 没有记录打包时训练集划分的digest，无法对应剪枝分数，请重新运行tools/pack_dataset.py')
+		indices, meta = load_pruned_indices(index_file, digest, self.labels, keep, skip)
+		if indices is None:
+			print(f'[Prune] {index_file} 不是由打包时的训练集划分生成的，不剪枝')
+			return
+		print(f"{self.__class__.__name__}训练集按{meta.get('metric')}剪枝: {len(self.labels)} -> {len(indices)} 样本")
+		self.indices = indices
+		self.samples = self.samples.subset(indices)
+
+	@property
+	def data(self):
+		# 在首次访问时（通常已在worker进程内）再建立内存映射
+		if self._data is None:
+			self._data = np.memmap(self.data_file, dtype=np.uint8, mode='r')
+		return self._data
+
+	def __getitem__(self, idx):
+		if self.indices is not None:
+			idx = self.indices[idx]
+		offset, shape = self.offsets[idx], self.shapes[idx]
+		img = Image.fromarray(np.array(self.data[offset:offset + int(np.prod(shape))]).reshape(shape))
+		target = int(self.labels[idx])
+		if self.transform is not None:
+			img = self.transform(img)
+		if self.target_transform is not None:
+			target = self.target_transform(target)
+		return img, target
@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import time
+
+from torchvision import transforms
+
+
+class StageTimer:
+	"""按阶段累计耗时/次数/字节数，计数放在共享内存中，DataLoader各worker累加、主进程读取并清零"""
+
+	def __init__(self, stages):
+		self.stages = list(stages)
+		self._values = multiprocessing.Array('d', 3 * len(self.stages))
+
+	def add(self, stage, seconds, count=1, nbytes=0):
+		self.add_at(self.stages.index(stage), seconds, count, nbytes)
+
+	def add_at(self, index, seconds, count=1, nbytes=0):
+		i = 3 * index
+		with self._values.get_lock():
+			self._values[i] += seconds
+			self._values[i + 1] += count
+			self._values[i + 2] += nbytes
+
+	def pop(self):
+		"""返回{stage: (seconds, count, bytes)}并清零"""
+		with self._values.get_lock():
+			values = self._values[:]
+			self._values[:] = [0.] * len(values)
+		return {stage: tuple(values[3 * i:3 * i + 3]) for i, stage in enumerate(self.stages)}
+
+
+class TimedCall:
+	"""包装一个可调用对象，把每次调用的耗时计入timer的stage阶段"""
+
+	def __init__(self, fn, timer, stage):
+		self.fn = fn
+		self.timer = timer
+		self.stage = stage
+
+	def __call__(self, *args, **kwargs):
+		tik = time.perf_counter()
+		result = self.fn(*args, **kwargs)
+		self.timer.add(self.stage, time.perf_counter() - tik)
+		return result
+
+	def __repr__(self):
+		return f'{self.__class__.__name__}({self.fn!r})'
+
+
+class TimedLoader(TimedCall):
+	"""包装图像加载函数：耗时包含读文件与解码，同时累计读取的文件字节数"""
+
+	def __call__(self, path):
+		tik = time.perf_counter()
+		img = self.fn(path)
+		try:
+			nbytes = os.path.getsize(path)
+		except OSError:
+			nbytes = 0
+		self.timer.add(self.stage, time.perf_counter() - tik, nbytes=nbytes)
+		return img
+
+
+class InstrumentedCompose(transforms.Compose):
+	"""逐个变换计时的Compose，各worker的耗时通过共享内存中的StageTimer汇总
+
+	阶段名为"序号.变换类名"，如 0.Resize、1.RandomHorizontalFlip。
+	"""
+
+	def __init__(self, transforms):
+		super().__init__(transforms)
+		self.timer = StageTimer([f'{i}.{t.__class__.__name__}' for i, t in enumerate(self.transforms)])
+
+	def __call__(self, img):
+		for i, t in enumerate(self.transforms):
+			tik = time.perf_counter()
+			img = t(img)
+			self.timer.add_at(i, time.perf_counter() - tik)
+		return img
+
+	def pop_timings(self):
+		"""返回{阶段: 每次调用的平均毫秒数}并清零，本周期内没有调用时返回空字典"""
+		return pop_timings([(self, 0)])
+
+
+def pop_timings(composes):
+	"""合并多个InstrumentedCompose的计时并清零，返回{阶段: 每次调用的平均毫秒数}
+
+	composes为[(compose, 阶段序号的偏移)]：长宽比分桶时各桶的变换结构相同，同名阶段合并；
+	验证集缓存把测试变换拆成缓存前后两段，后一段的序号接在前一段之后。
+	"""
+	totals = {}
+	for compose, offset in composes:
+		for i, (seconds, count, _) in enumerate(compose.timer.pop().values()):
+			stage = f'{i + offset}.{compose.transforms[i].__class__.__name__}'
+			total_seconds, total_count = totals.get(stage, (0., 0))
+			totals[stage] = (total_seconds + seconds, total_count + count)
+	return {stage: seconds / count * 1000 for stage, (seconds, count) in totals.items() if count}
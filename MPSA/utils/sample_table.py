@@ -0,0 +1,219 @@
+import hashlib
+import math
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from utils.manifest import encode_strings, save_arrays, load_arrays
+from utils.scanner import default_scan_threads
+
+
+class SampleTable:
+	"""紧凑的(path, label)样本表：所有路径存放在一个连续字节缓冲中，配合起止偏移与int32标签数组
+
+	与list[tuple]不同，整张表只由少数几个numpy数组组成，fork出的DataLoader worker访问时
+	不会因为引用计数写入而逐页解除写时复制共享；samples[idx]仍然返回(path, label)。
+	"""
+
+	def __init__(self, path_buffer, starts, ends, labels, root=''):
+		self.path_buffer = path_buffer
+		self.starts = starts
+		self.ends = ends
+		self.labels = labels
+		self.root = root
+
+	@classmethod
+	def from_lists(cls, paths, labels, root=''):
+		path_buffer, offsets = encode_strings(paths)
+		return cls(path_buffer, offsets[:-1], offsets[1:], np.asarray(labels, dtype=np.int32), root)
+
+	@classmethod
+	def from_manifest(cls, manifest):
+		offsets = manifest.path_offsets
+		return cls(manifest.path_buffer, offsets[:-1], offsets[1:], manifest.labels, manifest.data_dir)
+
+	def __len__(self):
+		return len(self.labels)
+
+	def __getitem__(self, idx):
+		return self.path(idx), int(self.labels[idx])
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def path(self, idx):
+		rel_path = bytes(self.path_buffer[self.starts[idx]:self.ends[idx]]).decode('utf-8', 'surrogateescape')
+		return os.path.join(self.root, rel_path) if self.root else rel_path
+
+	def digest(self):
+		"""样本表内容（路径与标签）的哈希"""
+		sha = hashlib.sha1()
+		sha.update(str(self.root).encode('utf-8', 'surrogateescape'))
+		for arr in (self.path_buffer, self.starts, self.ends, self.labels):
+			sha.update(np.ascontiguousarray(arr).tobytes())
+		return sha.hexdigest()
+
+	def subset(self, indices):
+		"""按索引取子表，路径缓冲与原表共享"""
+		indices = np.asarray(indices, dtype=np.int64)
+		return SampleTable(self.path_buffer, self.starts[indices], self.ends[indices], self.labels[indices],
+		                   self.root)
+
+
+def group_by_label(labels):
+	"""按标签分组样本索引，返回[(label, indices)]；组顺序为标签首次出现的顺序，组内索引升序"""
+	labels = np.asarray(labels)
+	if len(labels) == 0:
+		return []
+	order = np.argsort(labels, kind='stable')
+	sorted_labels = labels[order]
+	boundaries = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+	groups = np.split(order, boundaries)
+	groups.sort(key=lambda indices: indices[0])
+	return [(int(labels[indices[0]]), indices) for indices in groups]
+
+
+def stratified_split(labels, val_ratio, seed):
+	"""分层划分训练/验证集：每个类别取 max(1, int(n * val_ratio(n))) 个样本作为验证集
+
+	随机过程与原各数据集中的实现一致（以seed初始化random，按类别首次出现的顺序依次shuffle），
+	相同seed下划分结果不变。
+	Returns:
+		(train_indices, val_indices)
+	"""
+	rng = random.Random(seed)
+	train_indices, val_indices = [], []
+	for label, indices in group_by_label(labels):
+		val_size = max(1, int(len(indices) * val_ratio(len(indices))))
+		rng.shuffle(indices)
+		val_indices.append(indices[:val_size])
+		train_indices.append(indices[val_size:])
+	empty = np.empty(0, dtype=np.int64)
+	return np.concatenate(train_indices or [empty]), np.concatenate(val_indices or [empty])
+
+
+def prune_indices(scores, labels, keep, skip=0.):
+	"""按难度分数（越大越难）在每个类别内剪枝：先去掉最难的skip比例（网络数据中多为标签噪声），
+	再保留其后最难的 max(1, ceil(n * keep)) 个样本；按类别剪枝不会让长尾类别被整体删掉
+
+	Returns:
+		升序的保留样本索引
+	"""
+	scores = np.asarray(scores)
+	kept = [np.empty(0, dtype=np.int64)]
+	for label, indices in group_by_label(labels):
+		order = indices[np.argsort(-scores[indices], kind='stable')]
+		num_skip = min(int(len(indices) * skip), len(indices) - 1)
+		num_keep = max(1, int(math.ceil(len(indices) * keep)))
+		kept.append(order[num_skip:num_skip + num_keep])
+	return np.sort(np.concatenate(kept))
+
+
+def load_pruned_indices(index_file, digest, labels, keep, skip=0.):
+	"""读取tools/prune_scores.py写出的分数文件并按类别剪枝，返回(保留的样本索引, 分数文件的元信息)
+
+	分数文件不是由digest对应的训练集划分生成时索引为None。
+	"""
+	arrays, meta = load_arrays(index_file, mmap=False)
+	if meta.get('digest') != digest:
+		return None, meta
+	return prune_indices(arrays['scores'], labels, keep, skip), meta
+
+
+def load_split(cache_file, table, seed, val_split, val_ratio):
+	"""读取缓存的划分索引，样本表、seed或val_split变化时重新划分并写回"""
+	key = {'digest': table.digest(), 'seed': seed, 'val_split': val_split}
+	if os.path.isfile(cache_file):
+		try:
+			arrays, meta = load_arrays(cache_file, mmap=False)
+			if all(meta.get(k) == v for k, v in key.items()):
+				return arrays['train'], arrays['val']
+		except (OSError, ValueError, KeyError):
+			pass
+	train_indices, val_indices = stratified_split(table.labels, val_ratio, seed)
+	try:
+		save_arrays(cache_file, {'train': train_indices, 'val': val_indices}, key)
+	except OSError as e:
+		print(f'[SampleTable] 无法写入划分缓存 {cache_file}: {e}')
+	return train_indices, val_indices
+
+
+def read_image_size(path):
+	"""只解析文件头读取(宽, 高)，无法读取时返回(0, 0)"""
+	try:
+		with Image.open(path) as img:
+			return img.size
+	except (OSError, ValueError, Image.DecompressionBombError):
+		return 0, 0
+
+
+def load_image_sizes(cache_file, table, num_threads=None):
+	"""读取缓存的各样本图像尺寸（int32数组，每行为宽、高），样本表变化时并行读取文件头重新生成并写回"""
+	digest = table.digest()
+	if os.path.isfile(cache_file):
+		try:
+			arrays, meta = load_arrays(cache_file, mmap=False)
+			if meta.get('digest') == digest:
+				return arrays['sizes']
+		except (OSError, ValueError, KeyError):
+			pass
+	paths = [table.path(i) for i in range(len(table))]
+	with ThreadPoolExecutor(max_workers=num_threads or default_scan_threads()) as pool:
+		sizes = np.asarray(list(pool.map(read_image_size, paths, chunksize=64)), dtype=np.int32).reshape(-1, 2)
+	try:
+		save_arrays(cache_file, {'sizes': sizes}, {'digest': digest})
+	except OSError as e:
+		print(f'[SampleTable] 无法写入图像尺寸缓存 {cache_file}: {e}')
+	return sizes
+
+
+def metadata_signature(sources):
+	"""元数据文件的(文件名, 大小, mtime)签名，任一文件变化都会使缓存失效"""
+	signature = []
+	for source in sources:
+		st = os.stat(source)
+		signature.append([os.path.basename(source), st.st_size, st.st_mtime_ns])
+	return signature
+
+
+def load_cached_table(cache_file, sources, parse, root=''):
+	"""解析一次元数据并缓存为二进制sidecar，之后的构造直接内存映射读取
+
+	Args:
+		cache_file: sidecar文件路径
+		sources: 元数据文件列表，用于校验缓存是否过期
+		parse: 无参函数，返回(paths, labels, extra)，extra为可JSON序列化的附加信息（如类别名）
+		root: 路径前缀，访问时拼接
+	Returns:
+		(SampleTable, extra)
+	"""
+	signature = metadata_signature(sources)
+	if os.path.isfile(cache_file):
+		try:
+			arrays, meta = load_arrays(cache_file)
+			if meta.get('signature') == signature:
+				offsets = arrays['path_offsets']
+				return SampleTable(arrays['path_buffer'], offsets[:-1], offsets[1:], arrays['labels'], root), \
+					meta.get('extra', {})
+		except (OSError, ValueError, KeyError):
+			pass
+
+	paths, labels, extra = parse()
+	path_buffer, offsets = encode_strings(paths)
+	labels = np.asarray(labels, dtype=np.int32)
+	try:
+		save_arrays(cache_file, {'path_buffer': path_buffer, 'path_offsets': offsets, 'labels': labels},
+		            {'signature': signature, 'extra': extra})
+	except OSError as e:
+		print(f'[SampleTable] 无法写入元数据缓存 {cache_file}: {e}')
+	return SampleTable(path_buffer, offsets[:-1], offsets[1:], labels, root), extra
+
+
+def read_columns(path, sep=None):
+	"""读取以空白分隔的文本元数据，返回每行的字段列表（跳过空行）"""
+	with open(path, 'r') as f:
+		return [line.strip().split(sep) for line in f if line.strip()]
@@ -0,0 +1,180 @@
+import collections
+import math
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DistributedSampler, Sampler
+
+
+class ResumableSampler(DistributedSampler):
+	"""可从epoch中途恢复的训练sampler，单卡与多卡通用（单卡时num_replicas=1, rank=0）
+
+	排列方式与DistributedSampler相同：以seed + epoch生成全局排列，补齐到num_replicas的整数倍后按rank跨步取样。
+	state_dict()保存全局排列与本epoch已消耗的样本数，load_state_dict()之后本epoch从下一个未训练的样本开始，
+	不会重复已训练过的数据；进入下一个epoch后自动恢复正常。
+	"""
+
+	def __init__(self, dataset, num_replicas=1, rank=0, shuffle=True, seed=0, drop_last=False):
+		super().__init__(dataset, num_replicas=num_replicas, rank=max(rank, 0), shuffle=shuffle, seed=seed,
+		                 drop_last=drop_last)
+		self.start = 0
+		self._permutation = None
+
+	def set_epoch(self, epoch):
+		if epoch != self.epoch:
+			self.start = 0
+			self._permutation = None
+		super().set_epoch(epoch)
+
+	def permutation(self):
+		if self._permutation is not None:
+			return self._permutation
+		if self.shuffle:
+			g = torch.Generator()
+			g.manual_seed(self.seed + self.epoch)
+			return torch.randperm(len(self.dataset), generator=g).numpy()
+		return np.arange(len(self.dataset))
+
+	def __iter__(self):
+		indices = self.permutation()
+		if not self.drop_last:
+			padding_size = self.total_size - len(indices)
+			if padding_size > 0:
+				indices = np.concatenate([indices] + [indices] * math.ceil(padding_size / len(indices)))
+		indices = indices[:self.total_size]
+		indices = indices[self.rank:self.total_size:self.num_replicas]
+		return iter(indices[self.start:].tolist())
+
+	def __len__(self):
+		return self.num_samples - self.start
+
+	def state_dict(self, consumed):
+		"""consumed: 本rank在当前epoch已训练的样本数（step * batch_size）"""
+		return {'epoch': self.epoch, 'seed': self.seed, 'start': consumed,
+		        'permutation': torch.from_numpy(np.asarray(self.permutation(), dtype=np.int64))}
+
+	def load_state_dict(self, state):
+		if len(state['permutation']) != len(self.dataset):
+			print(f"[Sampler] 检查点中的排列长度 {len(state['permutation'])} 与数据集大小 {len(self.dataset)} 不一致，"
+			      f"从epoch {state['epoch'] + 1} 开头重新开始")
+			self.set_epoch(state['epoch'])
+			return False
+		self.epoch = state['epoch']
+		self.start = state['start']
+		self._permutation = state['permutation'].numpy()
+		return True
+
+
+def aspect_bucket_shapes(img_size, ratios, stride=32):
+	"""各长宽比（宽/高）对应的裁剪尺寸(高, 宽)：边长为stride的整数倍，stride网格上的token数不超过img_size的方形输入"""
+	budget = (img_size // stride) ** 2
+	shapes = []
+	for ratio in ratios:
+		height = max(int(round(math.sqrt(budget / ratio))), 1)
+		width = max(min(budget // height, int(round(height * ratio))), 1)
+		shapes.append((height * stride, width * stride))
+	return shapes
+
+
+def assign_buckets(sizes, shapes):
+	"""按log长宽比最接近的原则为每个样本分配桶，sizes每行为(宽, 高)；尺寸未知的样本分到最接近方形的桶"""
+	sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+	known = (sizes > 0).all(1)
+	log_ratios = np.zeros(len(sizes))
+	log_ratios[known] = np.log(sizes[known, 0] / sizes[known, 1])
+	bucket_ratios = np.log([width / height for height, width in shapes])
+	return np.abs(log_ratios[:, None] - bucket_ratios[None]).argmin(1)
+
+
+class AspectRatioBatchSampler(Sampler):
+	"""按长宽比分桶组batch：从sampler依次取样本放入所属的桶，桶内攒满batch_size个即输出，元素为(index, bucket)
+
+	同一batch共用该桶的裁剪尺寸。每个epoch固定输出 (本rank样本数) // batch_size 个batch（多卡时各rank的step数一致）：
+	sampler取完后，在剩余不足一个batch的桶中按样本数从多到少循环补齐。
+	sampler会先于输出的batch取样本攒在桶中，且DataLoader会预取若干batch，因此每输出一个batch都记录此时sampler的
+	实际位置与各桶内容；state_dict(consumed)按已训练的batch数取对应记录，恢复后桶内容与sampler位置都与中断时一致，
+	既不重复已训练的batch，也不丢失尚在桶中的样本。内部sampler须为ResumableSampler。
+	"""
+
+	def __init__(self, sampler, buckets, batch_size, history=4096):
+		self.sampler = sampler
+		self.buckets = np.asarray(buckets)
+		self.batch_size = batch_size
+		# 已输出batch数 -> (sampler位置, 各桶内容)，只保留最近history个，足以覆盖DataLoader的预取深度
+		self._history = collections.OrderedDict()
+		self._history_size = history
+		self._resume = None
+
+	def __len__(self):
+		start_batches = self._resume['batches'] if self._resume is not None else 0
+		return (len(self.sampler) + self.sampler.start) // self.batch_size - start_batches
+
+	def set_epoch(self, epoch):
+		if epoch != self.sampler.epoch:
+			self._resume = None
+		self.sampler.set_epoch(epoch)
+
+	def _record(self, emitted, position, pending):
+		self._history[emitted] = (position, {bucket: list(batch) for bucket, batch in pending.items() if batch})
+		while len(self._history) > self._history_size:
+			self._history.popitem(last=False)
+
+	def __iter__(self):
+		total = len(self) + (self._resume['batches'] if self._resume is not None else 0)
+		if self._resume is not None:
+			emitted, pending = self._resume['batches'], {b: list(v) for b, v in self._resume['pending'].items()}
+		else:
+			emitted, pending = 0, {}
+		position = self.sampler.start
+		self._history.clear()
+		self._record(emitted, position, pending)
+		for index in self.sampler:
+			position += 1
+			bucket = int(self.buckets[index])
+			batch = pending.setdefault(bucket, [])
+			batch.append(index)
+			if len(batch) == self.batch_size:
+				pending[bucket] = []
+				emitted += 1
+				self._record(emitted, position, pending)
+				yield [(i, bucket) for i in batch]
+		for bucket, batch in sorted(pending.items(), key=lambda item: len(item[1]), reverse=True):
+			if emitted >= total or not batch:
+				break
+			pending[bucket] = []
+			emitted += 1
+			self._record(emitted, position, pending)
+			yield [(i, bucket) for i in (batch * math.ceil(self.batch_size / len(batch)))[:self.batch_size]]
+
+	def state_dict(self, consumed):
+		"""consumed: 本rank在当前epoch已训练的样本数（step * batch_size）"""
+		batches = consumed // self.batch_size
+		if batches not in self._history:
+			raise RuntimeError(f'No sampler snapshot for batch {batches}, the DataLoader prefetched too far ahead')
+		position, pending = self._history[batches]
+		return {'sampler': self.sampler.state_dict(position), 'batches': batches, 'pending': pending}
+
+	def load_state_dict(self, state):
+		if 'pending' not in state or not self.sampler.load_state_dict(state['sampler']):
+			return False
+		self._resume = {'batches': state['batches'], 'pending': state['pending']}
+		return True
+
+
+class BucketedDataset(Dataset):
+	"""配合AspectRatioBatchSampler使用：按(index, bucket)取样本，使用该桶裁剪尺寸对应的变换，其余属性转发给原数据集"""
+
+	def __init__(self, dataset, transforms):
+		self.dataset = dataset
+		self.transforms = transforms
+
+	def __len__(self):
+		return len(self.dataset)
+
+	def __getattr__(self, name):
+		return getattr(self.__dict__['dataset'], name)
+
+	def __getitem__(self, item):
+		index, bucket = item
+		self.dataset.transform = self.transforms[bucket]
+		return self.dataset[index]
@@ -0,0 +1,80 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+SB_SCHEDULES = ('constant', 'linear', 'cosine')
+SB_STRATEGIES = ('topk', 'weighted')
+
+
+def per_sample_loss(logits, targets, smoothing=0.):
+	"""逐样本交叉熵，targets可以是类别下标或mixup/cutmix产生的软标签"""
+	log_probs = F.log_softmax(logits.float(), dim=-1)
+	if targets.dim() == log_probs.dim():
+		return -(targets * log_probs).sum(-1)
+	nll = -log_probs.gather(-1, targets.long().unsqueeze(-1)).squeeze(-1)
+	if smoothing > 0:
+		return (1. - smoothing) * nll - smoothing * log_probs.mean(-1)
+	return nll
+
+
+class SelectiveBackprop:
+	"""选择性反向传播：先用no_grad前向给整个batch打分，只对损失较大的一部分样本做带梯度的前向与反向
+
+	保留比例在start_epoch之前为1，之后按schedule在训练结束时过渡到keep：
+		constant: 从start_epoch起直接使用keep
+		linear / cosine: 从1线性/余弦下降到keep
+	strategy为topk时保留损失最大的样本，为weighted时按损失加权无放回采样，对噪声标签更稳健。
+	"""
+
+	def __init__(self, keep, epochs, schedule='constant', start_epoch=0, strategy='topk', smoothing=0.):
+		assert 0. < keep <= 1., f'Keep ratio must be in (0, 1], got {keep}'
+		assert schedule in SB_SCHEDULES, f'Unknown selective backprop schedule: {schedule}'
+		assert strategy in SB_STRATEGIES, f'Unknown selective backprop strategy: {strategy}'
+		self.keep = keep
+		self.epochs = epochs
+		self.schedule = schedule
+		self.start_epoch = start_epoch
+		self.strategy = strategy
+		self.smoothing = smoothing
+		self.seen = 0
+		self.kept = 0
+
+	def ratio(self, epoch, progress=0.):
+		"""epoch + progress（本epoch已完成的比例）处的保留比例"""
+		if epoch < self.start_epoch:
+			return 1.
+		if self.schedule == 'constant':
+			return self.keep
+		t = min((epoch + progress - self.start_epoch) / max(self.epochs - self.start_epoch, 1), 1.)
+		if self.schedule == 'cosine':
+			t = (1. - math.cos(math.pi * t)) / 2
+		return 1. - (1. - self.keep) * t
+
+	def count(self, batch_size, ratio):
+		"""按保留比例计算本batch反向传播的样本数，并计入统计"""
+		num_keep = min(max(int(round(batch_size * ratio)), 1), batch_size)
+		self.seen += batch_size
+		self.kept += num_keep
+		return num_keep
+
+	def select(self, logits, targets, num_keep):
+		"""根据打分前向的logits返回要反向传播的num_keep个样本下标"""
+		losses = per_sample_loss(logits, targets, self.smoothing)
+		if self.strategy == 'weighted':
+			return torch.multinomial(losses.clamp(min=1e-6), num_keep, replacement=False)
+		return losses.topk(num_keep).indices
+
+	def pop(self):
+		"""返回(打分的样本数, 反向传播的样本数)并清零"""
+		seen, kept = self.seen, self.kept
+		self.seen, self.kept = 0, 0
+		return seen, kept
+
+
+def build_selective_backprop(config):
+	if config.train.sb_keep >= 1.:
+		return None
+	smoothing = config.model.label_smooth if config.data.mixup <= 0. else 0.
+	return SelectiveBackprop(config.train.sb_keep, config.train.epochs, config.train.sb_schedule,
+	                         config.train.sb_start_epoch, config.train.sb_strategy, smoothing)
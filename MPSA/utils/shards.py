@@ -0,0 +1,309 @@
+import io
+import json
+import multiprocessing
+import os
+import random
+import tarfile
+import time
+
+import PIL
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+from utils.dataset import ImageErrorCounter
+
+SHARD_INDEX = 'index.json'
+
+
+def write_shards(samples, out_dir, shard_bytes=1 << 30, seed=42, meta=None, min_shards=0):
+	"""将样本的原始图像字节按打乱后的顺序写入约shard_bytes大小的tar分片
+
+	每个样本在tar中对应两个成员：<key>.<ext>（原始图像字节）与 <key>.cls（十进制标签），
+	与webdataset的约定一致。分片列表与各分片的样本数写入 index.json。
+	min_shards: 至少写出的分片数（训练时的 world_size * num_workers），每个分片的样本数不超过 样本数 // min_shards
+	"""
+	if min_shards > len(samples):
+		raise ValueError(f'{len(samples)} 个样本无法切分为至少 {min_shards} 个分片')
+	os.makedirs(out_dir, exist_ok=True)
+	order = list(range(len(samples)))
+	random.Random(seed).shuffle(order)
+	max_count = len(order) // min_shards if min_shards > 0 else len(order)
+
+	shards, tar, shard_size, shard_count = [], None, 0, 0
+	tik = time.time()
+
+	def _close():
+		if tar is not None:
+			tar.close()
+			shards.append({'name': shards_name, 'samples': shard_count})
+
+	for n, idx in enumerate(order):
+		path, label = samples[idx]
+		if tar is None or shard_size >= shard_bytes or shard_count >= max_count:
+			_close()
+			shards_name = f'shard-{len(shards):06d}.tar'
+			tar = tarfile.open(os.path.join(out_dir, shards_name), 'w')
+			shard_size, shard_count = 0, 0
+		with open(path, 'rb') as f:
+			payload = f.read()
+		key = f'{idx:09d}'
+		ext = os.path.splitext(path)[1].lower().lstrip('.') or 'jpg'
+		for name, data in ((f'{key}.{ext}', payload), (f'{key}.cls', str(int(label)).encode('ascii'))):
+			info = tarfile.TarInfo(name)
+			info.size = len(data)
+			tar.addfile(info, io.BytesIO(data))
+		shard_size += len(payload)
+		shard_count += 1
+		if (n + 1) % 50000 == 0:
+			print(f'[Shards] {n + 1}/{len(order)} ({(n + 1) / (time.time() - tik):.0f} img/s)')
+	_close()
+
+	index = dict(meta or {}, shards=shards, samples=len(order), seed=seed)
+	with open(os.path.join(out_dir, SHARD_INDEX), 'w') as f:
+		json.dump(index, f, indent=1)
+	print(f'[Shards] {out_dir}: {len(order)} 样本, {len(shards)} 个分片, 耗时 {time.time() - tik:.0f}s')
+
+
+def _iter_tar(path, wanted):
+	"""顺序读取tar分片，按key合并图像字节与标签，产出(分片内样本序号, key, 图像字节, 标签)
+
+	只读取序号在wanted中的样本，其余样本只解析tar头、跳过数据；wanted中的样本都读到后不再读取分片的剩余部分。
+	"""
+	last = max(wanted)
+	with tarfile.open(path, 'r:') as tar:
+		index, current, image, label = -1, None, None, None
+		for member in tar:
+			if not member.isfile():
+				continue
+			key, ext = member.name.rsplit('.', 1)
+			if key != current:
+				if image is not None and label is not None:
+					yield index, current, image, label
+				current, image, label = key, None, None
+				index += 1
+				if index > last:
+					return
+			if index not in wanted:
+				continue
+			data = tar.extractfile(member).read()
+			if ext == 'cls':
+				label = int(data)
+			else:
+				image = data
+		if image is not None and label is not None:
+			yield index, current, image, label
+
+
+def shuffle_order(num_samples, quota, buffer_size, rng):
+	"""shuffle buffer的输出顺序：按顺序读入样本序号，缓冲区满后每读入一个就随机换出一个，读完后打乱输出缓冲区
+
+	换出的位置只取决于rng而与样本内容无关，因此可以先算出顺序，读取时只保留配额内的样本；
+	返回前quota个输出的样本序号。
+	"""
+	if quota <= 0:
+		return []
+	buffer, order = [], []
+	buffer_size = min(buffer_size, quota)
+	for position in range(num_samples):
+		if len(buffer) < buffer_size:
+			buffer.append(position)
+			continue
+		i = rng.randrange(len(buffer))
+		buffer[i], position = position, buffer[i]
+		order.append(position)
+		if len(order) >= quota:
+			return order
+	rng.shuffle(buffer)
+	return order + buffer[:quota - len(order)]
+
+
+def decode_image(data, draft_size=None):
+	with Image.open(io.BytesIO(data)) as img:
+		if draft_size and img.format == 'JPEG':
+			img.draft('RGB', (draft_size, draft_size))
+		return img.convert('RGB')
+
+
+class ShardedImageDataset(IterableDataset):
+	"""顺序读取tar分片的训练集
+
+	- 每个epoch按(seed, epoch)重新打乱分片顺序，先在rank之间、再在各rank的worker之间轮流分配，
+	  每个分片每个epoch只由一个worker读取一次
+	- 每个worker的batch配额按index.json中各分片的样本数确定，配额内的样本本epoch恰好出现一次，
+	  不重复也不循环读取；凑不满配额之外的样本（各worker的尾部）本epoch丢弃，相当于DistributedSampler + drop_last
+	- 每个rank每个epoch产出 len(self) 个样本（batch_size的整数倍），按分到样本最少的分片时的下界确定，各rank步数一致
+	- 每个worker维护一个shuffle buffer，在分片内部的顺序之上再做一次局部打乱
+	- keep为data.prune_index剪枝后保留的样本序号（即分片中的key），其余样本不读取，配额按保留的样本数计算
+	- 可从epoch中途恢复：各worker的分片与配额、shuffle buffer的输出顺序都由(seed, epoch)确定，
+	  state_dict()只需保存已训练的batch数，恢复后各worker跳过已产出的样本，不重复也不遗漏
+	分片数须不少于 world_size * num_workers，否则构建DataLoader时报错，可用 tools/make_shards.py --slots 重新切分。
+	"""
+
+	def __init__(self, root, transform=None, target_transform=None, batch_size=1, rank=0, world_size=1,
+	             shuffle_buffer=2000, seed=42, draft_size=None, keep=None):
+		self.root = root
+		self.transform = transform
+		self.target_transform = target_transform
+		self.batch_size = batch_size
+		self.rank = max(rank, 0)
+		self.world_size = max(world_size, 1)
+		self.shuffle_buffer = shuffle_buffer
+		self.seed = seed
+		self.draft_size = draft_size
+		with open(os.path.join(root, SHARD_INDEX), 'r') as f:
+			self.index = json.load(f)
+		self.shards = [os.path.join(root, shard['name']) for shard in self.index['shards']]
+		self.counts = [shard['samples'] for shard in self.index['shards']]
+		# 剪枝时各分片中保留样本的(分片内序号, key)，None表示全部保留
+		self.kept = None
+		if keep is not None:
+			self.kept = self._kept_members(keep)
+			self.counts = [len(kept) for kept in self.kept]
+		# DataLoader的worker数，由build_loader通过set_num_workers设置；0表示在主进程中读取
+		self.num_workers = 0
+		self.image_errors = ImageErrorCounter()
+		# persistent worker中的数据集副本无法感知主进程的属性修改，[epoch, 本epoch已训练的batch数]放在共享内存中
+		self._epoch = multiprocessing.Array('q', 2)
+
+	def _kept_members(self, keep):
+		"""write_shards按seed打乱样本序号后依次写入各分片，据此还原每个分片中的key，返回各分片中保留的样本"""
+		order = list(range(self.index['samples']))
+		random.Random(self.index['seed']).shuffle(order)
+		keep, kept, start = set(int(k) for k in keep), [], 0
+		for count in self.counts:
+			kept.append([(j, key) for j, key in enumerate(order[start:start + count]) if key in keep])
+			start += count
+		return kept
+
+	def set_epoch(self, epoch):
+		"""进入新的epoch时从头开始；与load_state_dict恢复的epoch相同时从中断处继续"""
+		with self._epoch.get_lock():
+			if epoch != self._epoch[0]:
+				self._epoch[1] = 0
+			self._epoch[0] = epoch
+
+	def state_dict(self, consumed):
+		"""consumed: 本rank在当前epoch已训练的样本数（step * batch_size）"""
+		return {'epoch': self._epoch[0], 'start': consumed, 'seed': self.seed, 'world_size': self.world_size,
+		        'num_workers': self.num_workers, 'counts': list(self.counts)}
+
+	def load_state_dict(self, state):
+		current = {'seed': self.seed, 'world_size': self.world_size, 'num_workers': self.num_workers,
+		           'counts': list(self.counts)}
+		if any(state.get(key) != value for key, value in current.items()):
+			# 分片划分与各worker的配额随这些设置变化，无法对应到中断时的位置
+			print(f"[Shards] 检查点中的seed/world_size/num_workers/分片与当前设置不一致，从epoch {state['epoch'] + 1} 开头重新开始")
+			self.set_epoch(state['epoch'])
+			return False
+		with self._epoch.get_lock():
+			self._epoch[0], self._epoch[1] = state['epoch'], state['start'] // self.batch_size
+		return True
+
+	def set_num_workers(self, num_workers):
+		"""检查分片是否够num_workers个worker分，不够时抛出ValueError"""
+		self.num_batches(num_workers)
+		self.num_workers = num_workers
+
+	def max_workers(self):
+		"""每个rank最多可用的worker数"""
+		return max(len(self.shards) // self.world_size, 1)
+
+	def num_batches(self, num_workers):
+		"""每个rank每个epoch的batch数：按分片数最少的rank分到样本数最少的分片计算，再减去每个worker凑不满batch的尾部"""
+		slots = max(num_workers, 1)
+		per_rank = len(self.shards) // self.world_size
+		if per_rank < slots:
+			raise ValueError(f'{self.root} 只有 {len(self.shards)} 个分片，少于 world_size * num_workers = '
+			                 f'{self.world_size * slots}；请减小data.num_workers，或用 '
+			                 f'tools/make_shards.py --slots {self.world_size * slots} 重新切分')
+		smallest = sum(sorted(self.counts)[:per_rank])
+		return max((smallest - slots * (self.batch_size - 1)) // self.batch_size, 0)
+
+	def __len__(self):
+		return (self.num_batches(self.num_workers) - self._epoch[1]) * self.batch_size
+
+	def _plan(self, epoch, num_workers):
+		"""本rank各worker在本epoch的(分片列表, batch配额)，各worker独立计算且结果相同"""
+		order = list(range(len(self.shards)))
+		random.Random(self.seed + epoch).shuffle(order)
+		rank_shards = order[self.rank::self.world_size]
+		worker_shards = [rank_shards[w::num_workers] for w in range(num_workers)]
+		capacity = [sum(self.counts[s] for s in shards) // self.batch_size for shards in worker_shards]
+		num_batches, total = self.num_batches(num_workers), max(sum(capacity), 1)
+		# 按各worker能凑满的batch数成比例分配，余数依次给小数部分最大的worker，不会超过其能凑满的batch数
+		quotas = [c * num_batches // total for c in capacity]
+		remainders = sorted(range(num_workers), key=lambda w: (-(capacity[w] * num_batches % total), w))
+		for w in remainders[:num_batches - sum(quotas)]:
+			quotas[w] += 1
+		return worker_shards, quotas
+
+	@staticmethod
+	def _served(quotas, steps):
+		"""DataLoader按worker序号轮流取batch、跳过已取完配额的worker：返回前steps个batch中各worker提供的batch数，
+		以及之后第一个轮到的worker"""
+		served, w = [0] * len(quotas), 0
+		for _ in range(min(steps, sum(quotas))):
+			while served[w] >= quotas[w]:
+				w = (w + 1) % len(quotas)
+			served[w] += 1
+			w = (w + 1) % len(quotas)
+		return served, w
+
+	def _read(self, shards, wanted):
+		"""按顺序读取shards中序号在wanted里的样本，产出(序号, 样本)；序号为样本在这些分片依次拼接后的位置"""
+		offset = 0
+		for shard in shards:
+			count = self.counts[shard]
+			local = [p - offset for p in wanted if offset <= p < offset + count]
+			if local:
+				# members: 分片内序号 -> (保留样本中的序号, 预期的key)；剪枝时按还原出的写入顺序逐个核对key
+				if self.kept is not None:
+					members = {self.kept[shard][i][0]: (i, self.kept[shard][i][1]) for i in local}
+				else:
+					members = {i: (i, None) for i in local}
+				for index, key, image, label in _iter_tar(self.shards[shard], members):
+					i, expected = members[index]
+					if expected is not None and int(key) != expected:
+						raise RuntimeError(f'{self.shards[shard]} 中第{index}个样本的key为{key}，与按index.json还原的写入顺序不一致')
+					yield offset + i, (image, label)
+			offset += count
+
+	def __iter__(self):
+		info = get_worker_info()
+		worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+		epoch, start = self._epoch[:]
+		worker_shards, quotas = self._plan(epoch, num_workers)
+		served, first = self._served(quotas, start)
+		# 恢复时DataLoader重新从0号worker开始轮询，worker整体轮转first位，剩余batch的顺序与未中断时相同
+		slot = (worker_id + first) % num_workers
+		shards, quota = worker_shards[slot], quotas[slot] * self.batch_size
+		rng = random.Random((self.seed + epoch) * 100003 + self.rank * num_workers + slot)
+		order = shuffle_order(sum(self.counts[s] for s in shards), quota, self.shuffle_buffer, rng)
+		# 跳过本worker在中断前已产出的样本，只读取剩余样本（包括中断时还在shuffle buffer中的样本）
+		order = order[served[slot] * self.batch_size:]
+		if not order:
+			return
+		# 样本一读到就按order的顺序尽早产出，未产出的样本不超过shuffle buffer的大小
+		pending, n = {}, 0
+		for position, sample in self._read(shards, set(order)):
+			pending[position] = sample
+			while n < len(order) and order[n] in pending:
+				yield self._prepare(pending.pop(order[n]))
+				n += 1
+		for position in order[n:]:
+			if position in pending:
+				yield self._prepare(pending.pop(position))
+
+	def _prepare(self, sample):
+		data, target = sample
+		try:
+			img = decode_image(data, self.draft_size)
+		except (OSError, IOError, PIL.UnidentifiedImageError):
+			# 与各数据集__getitem__中的处理一致：计入读取失败次数，损坏图像用ImageNet均值的灰图代替
+			self.image_errors.add()
+			img = PIL.Image.new('RGB', (384, 384), (124, 116, 104))
+		if self.transform is not None:
+			img = self.transform(img)
+		if self.target_transform is not None:
+			target = self.target_transform(target)
+		return img, target
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from utils.sample_table import metadata_signature, group_by_label
+from utils.scanner import default_scan_threads
+
+VERIFY_MODES = ('none', 'fast', 'full')
+QUARANTINE_POLICIES = ('none', 'exclude', 'remap')
+
+
+def table_digest(table, sources=()):
+	"""样本表与元数据文件的联合哈希，作为"已校验清单"的标识"""
+	sha = hashlib.sha1()
+	sha.update(json.dumps(metadata_signature(sources)).encode('utf-8'))
+	sha.update(table.digest().encode('ascii'))
+	return sha.hexdigest()
+
+
+def _dir_mtimes(dirs):
+	return [os.stat(d).st_mtime_ns for d in dirs]
+
+
+def check_file(path, mode='fast'):
+	"""fast: 文件存在且非空；full: 额外解析图像头，并检查JPEG结尾的EOI标记以发现截断文件"""
+	try:
+		st = os.stat(path)
+		if st.st_size <= 0:
+			return False
+		if mode != 'full':
+			return True
+		with Image.open(path) as img:
+			img_format = img.format
+		if img_format == 'JPEG':
+			with open(path, 'rb') as f:
+				f.seek(max(st.st_size - 64, 0))
+				# 部分JPEG在EOI之后还有填充字节，因此在末尾一小段内查找
+				return b'\xff\xd9' in f.read()
+		return True
+	except (OSError, ValueError, Image.DecompressionBombError):
+		return False
+
+
+def verify_samples(table, record_file, sources=(), mode='fast', num_threads=None):
+	"""并行校验样本表中的所有文件，返回未通过校验的路径列表
+
+	校验结果写入记录文件（清单哈希 + 图像目录mtime + 未通过的路径）。之后若元数据文件、样本表与各图像目录的
+	mtime均未变化，且记录的模式不弱于本次请求的模式，则直接返回记录中的结果。
+	"""
+	if mode == 'none':
+		return []
+	assert mode in VERIFY_MODES, f'Unknown verify mode: {mode}'
+	digest = table_digest(table, sources)
+	if os.path.isfile(record_file):
+		try:
+			with open(record_file, 'r') as f:
+				record = json.load(f)
+			if record['digest'] == digest and VERIFY_MODES.index(record['mode']) >= VERIFY_MODES.index(mode) \
+					and _dir_mtimes(record['dirs']) == record['dir_mtimes']:
+				return record.get('bad', [])
+		except (OSError, ValueError, KeyError):
+			pass
+
+	paths = [table.path(i) for i in range(len(table))]
+	with ThreadPoolExecutor(max_workers=num_threads or default_scan_threads()) as pool:
+		results = list(pool.map(lambda p: check_file(p, mode), paths, chunksize=64))
+	bad = [p for p, ok in zip(paths, results) if not ok]
+	dirs = sorted({os.path.dirname(p) for p in paths})
+	try:
+		with open(f'{record_file}.tmp{os.getpid()}', 'w') as f:
+			json.dump({'digest': digest, 'mode': mode, 'count': len(paths),
+			           'dirs': dirs, 'dir_mtimes': _dir_mtimes(dirs), 'bad': bad}, f)
+		os.replace(f'{record_file}.tmp{os.getpid()}', record_file)
+	except OSError as e:
+		print(f'[Verify] 无法写入校验记录 {record_file}: {e}')
+	return bad
+
+
+def scan_quarantine(table, record_file, policy='exclude', num_threads=None):
+	"""预扫描样本表（解析图像头并检查JPEG截断），返回损坏文件路径列表；policy为none时不扫描
+
+	损坏文件列表持久化在record_file中（即verify_samples的校验记录），数据未变化时不再重复扫描。
+	"""
+	assert policy in QUARANTINE_POLICIES, f'Unknown quarantine policy: {policy}'
+	if policy == 'none' or len(table) == 0:
+		return []
+	return verify_samples(table, record_file, mode='full', num_threads=num_threads)
+
+
+def quarantine_table(table, bad, policy='exclude', seed=0):
+	"""把scan_quarantine找出的损坏样本隔离出样本表
+
+	- exclude：直接去掉损坏样本
+	- remap：用本表内同类别中随机的完好样本替换，样本数与类别分布不变（该类别没有完好样本时仍去掉）
+	"""
+	assert policy in QUARANTINE_POLICIES, f'Unknown quarantine policy: {policy}'
+	bad_set = set(bad)
+	is_bad = np.array([table.path(i) in bad_set for i in range(len(table))], dtype=bool)
+	if policy == 'none' or not is_bad.any():
+		return table
+	if policy == 'exclude':
+		indices = np.flatnonzero(~is_bad)
+	else:
+		indices = np.arange(len(table))
+		rng = np.random.RandomState(seed)
+		for label, group in group_by_label(table.labels):
+			bad_indices, good_indices = group[is_bad[group]], group[~is_bad[group]]
+			if len(bad_indices) == 0:
+				continue
+			indices[bad_indices] = rng.choice(good_indices, len(bad_indices)) if len(good_indices) else -1
+		indices = indices[indices >= 0]
+	print(f'[Quarantine] {int(is_bad.sum())} 个损坏图像已{"排除" if policy == "exclude" else "替换"}')
+	return table.subset(indices)